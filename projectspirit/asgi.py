@@ -0,0 +1,21 @@
+"""
+ASGI config for the live leaderboard process.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Only the server-sent event streams under /live/ are
+served here; the site itself runs on gunicorn (see wsgi.py), and claims
+made there reach these streams through Postgres NOTIFY.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'projectspirit.settings')
+
+django.setup()
+
+# Imported once settings are configured
+from spiritdashboard.live import LiveApplication  # noqa: E402
+
+application = LiveApplication()
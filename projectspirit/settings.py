@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'spiritdashboard.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,7 +53,8 @@ ROOT_URLCONF = 'projectspirit.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timed for ProfilingMiddleware
+        'BACKEND': 'spiritdashboard.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -61,6 +63,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'spiritdashboard.pages.page_cache',
             ],
         },
     },
@@ -122,6 +125,52 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Caching
+# Local memory is per process; set CACHE_BACKEND to the database or file
+# backend (with CACHE_LOCATION) so all gunicorn workers share one cache.
+# The key index only turns guessed keys away with a shared backend.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'projectspirit'),
+    }
+}
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_CACHE_TIMEOUT = 300
+
+# Rendered pages and fragments are keyed by content versions, so the timeout
+# only bounds memory. The release goes into every key and ETag so a deploy
+# that changes templates doesn't serve old pages. Without a shared cache the
+# versions themselves expire quickly, since other workers never see a bump.
+PAGE_CACHE_TIMEOUT = 3600
+PAGE_VERSION_LOCAL_TIMEOUT = 30
+PAGE_CACHE_RELEASE = os.environ.get('HEROKU_RELEASE_VERSION', '')
+
+# Health decays by a point per interval (in seconds) without a claim and
+# each claim restores some
+HEALTH_DECAY_INTERVAL = 4 * 3600
+HEALTH_PER_CLAIM = 10
+
+# Profiling
+# Every request is measured for the staff-only /metrics/ endpoint; this
+# fraction of them is also run under cProfile into PROFILE_DIR.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = 100
+
+# Background tasks
+# Claims leave non-critical work, like the ledger, to `manage.py run_tasks`
+# (the Procfile's worker). Eager mode runs tasks inline instead, for local
+# development without a worker.
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '') == '1'
+
+# Live leaderboards
+# The Procfile's `live` process (uvicorn) serves only /live/; route that path
+# to it and set LIVE_ENABLED=1 so pages link the streams and gunicorn workers
+# pass claims on to it with Postgres NOTIFY.
+LIVE_ENABLED = os.environ.get('LIVE_ENABLED', '') == '1'
+
 # Authentication
 LOGIN_URL = 'spiritdashboard:login'
 LOGIN_REDIRECT_URL = 'spiritdashboard:index'
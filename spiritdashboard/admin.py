@@ -1,7 +1,19 @@
-from django.contrib import admin
+import io
+from itertools import chain
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import path
+
+from . import imports, keys
+from .forms import MissionUploadForm
 
-from .models import CompletedMission, Mission, MissionKey, User, Grade
+from .models import BackgroundTask, CompletedMission, LedgerEntry, Mission, MissionKey, User, Grade
 
 class SpiritUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
@@ -9,8 +21,88 @@ class SpiritUserAdmin(UserAdmin):
     )
 
 
+class GenerateKeysForm(forms.Form):
+    count = forms.IntegerField(min_value=1, max_value=100000, initial=100,
+                               help_text='Number of keys to create for each selected mission.')
+    one_use = forms.BooleanField(initial=True, required=False)
+
+
+class MissionAdmin(admin.ModelAdmin):
+    actions = ['generate_keys']
+    change_list_template = 'admin/spiritdashboard/mission/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_missions),
+                 name='spiritdashboard_mission_import'),
+        ] + super().get_urls()
+
+    def import_missions(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+
+        form = MissionUploadForm(request.POST or None, request.FILES or None)
+        errors = None
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            rows = imports.read_rows(io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''),
+                                     imports.detect_format(upload.name))
+            # Only the missions are remembered; their keys are read back
+            # batch by batch while the response streams
+            keyed = set()
+            try:
+                result = imports.import_missions(
+                    rows, keys_per_mission=form.cleaned_data['keys'], one_use=form.cleaned_data['one_use'],
+                    on_keys=lambda batch: keyed.update(mission_key.mission_id for mission_key in batch))
+            except imports.InvalidRows as e:
+                errors = e
+            except (ValueError, UnicodeDecodeError) as e:
+                form.add_error('file', 'Could not read the file: {}'.format(e))
+            else:
+                self.message_user(request, 'Created {} missions, updated {} and generated {} keys.'.format(
+                    result.created, result.updated, result.keys), messages.SUCCESS)
+                if not keyed:
+                    return redirect('admin:spiritdashboard_mission_changelist')
+                response = StreamingHttpResponse(
+                    keys.stream_csv(keys.stored_batches(keyed), request.build_absolute_uri('/')),
+                    content_type='text/csv')
+                response['Content-Disposition'] = 'attachment; filename="mission-keys.csv"'
+                return response
+
+        return render(request, 'admin/spiritdashboard/mission/import_missions.html', context={
+            **self.admin_site.each_context(request),
+            'title': 'Import missions',
+            'form': form,
+            'errors': errors,
+            'opts': self.model._meta,
+        })
+
+    def generate_keys(self, request, queryset):
+        form = GenerateKeysForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return render(request, 'admin/spiritdashboard/mission/generate_keys.html', context={
+                **self.admin_site.each_context(request),
+                'title': 'Generate keys',
+                'form': form,
+                'missions': queryset,
+                'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+                'opts': self.model._meta,
+            })
+
+        batches = chain.from_iterable(
+            keys.generate_keys(mission, form.cleaned_data['count'], one_use=form.cleaned_data['one_use'])
+            for mission in queryset)
+        base_url = request.build_absolute_uri('/')
+        response = StreamingHttpResponse(keys.stream_csv(batches, base_url), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="mission-keys.csv"'
+        return response
+    generate_keys.short_description = 'Generate keys for selected missions'
+
+
 admin.site.register(User, SpiritUserAdmin)
-admin.site.register(Mission)
+admin.site.register(Mission, MissionAdmin)
 admin.site.register(MissionKey)
 admin.site.register(Grade)
 admin.site.register(CompletedMission)
+admin.site.register(LedgerEntry)
+admin.site.register(BackgroundTask)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SpiritdashboardConfig(AppConfig):
     name = 'spiritdashboard'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.crypto import salted_hmac
+import pagan
+
+from . import metrics
+
+
+AVATAR_HASH = pagan.SHA512
+AVATAR_SIZE = 128
+
+
+def avatar_digest(username, hashfun=AVATAR_HASH, size=AVATAR_SIZE):
+    # Content address of a rendered avatar: changes whenever any input does.
+    # Signed with SECRET_KEY so only URLs the site handed out get rendered,
+    # not any name an anonymous caller makes up.
+    source = '{}:{}:{}'.format(username, hashfun, size)
+    return salted_hmac('spiritdashboard.avatars.avatar_digest', source).hexdigest()
+
+
+def render_avatar(username, hashfun=AVATAR_HASH, size=AVATAR_SIZE):
+    avatar = pagan.Avatar(username, hashfun)
+    img = avatar.img
+    if img.size != (size, size):
+        img = img.resize((size, size))
+    buffered = BytesIO()
+    img.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+class AvatarCache:
+    """
+    Two-tier cache of rendered avatar PNGs.
+
+    Recently used images are kept in an in-process LRU; everything that has
+    been rendered is also written to ``storage`` under ``location`` so that
+    a restarted worker doesn't have to render it again.
+    """
+
+    def __init__(self, storage=None, location='avatars', max_entries=256,
+                 hashfun=AVATAR_HASH, size=AVATAR_SIZE):
+        self.storage = storage or default_storage
+        self.location = location
+        self.max_entries = max_entries
+        self.hashfun = hashfun
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, username):
+        return avatar_digest(username, self.hashfun, self.size)
+
+    def path(self, username):
+        return '{}/{}.png'.format(self.location, self.digest(username))
+
+    def get(self, username):
+        digest = self.digest(username)
+
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                return data
+
+        path = self.path(username)
+        if self.storage.exists(path):
+            with self.storage.open(path, 'rb') as f:
+                data = f.read()
+        else:
+            with metrics.timed('avatar_time'):
+                data = render_avatar(username, self.hashfun, self.size)
+            self.storage.save(path, ContentFile(data))
+
+        self._remember(digest, data)
+        return data
+
+    def url(self, username):
+        # Makes sure the image exists so the browser's request is a cheap read
+        self.get(username)
+        return reverse('spiritdashboard:avatar', args=[username, self.digest(username)])
+
+    def warm(self, usernames):
+        count = 0
+        for username in usernames:
+            self.get(username)
+            count += 1
+        return count
+
+    def invalidate(self, username):
+        digest = self.digest(username)
+        with self._lock:
+            self._entries.pop(digest, None)
+        path = self.path(username)
+        if self.storage.exists(path):
+            self.storage.delete(path)
+
+    def clear(self, storage=False):
+        with self._lock:
+            self._entries.clear()
+        if storage and self.storage.exists(self.location):
+            for name in self.storage.listdir(self.location)[1]:
+                self.storage.delete('{}/{}'.format(self.location, name))
+
+    def _remember(self, digest, data):
+        with self._lock:
+            self._entries[digest] = data
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+avatar_cache = AvatarCache(
+    max_entries=getattr(settings, 'AVATAR_CACHE_MAX_ENTRIES', 256))
@@ -0,0 +1,254 @@
+import json
+import math
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import ranking, tasks
+from .models import Grade, Mission, MissionKey, User
+
+
+SCENARIOS = ('dashboard', 'leaderboard', 'register', 'claim', 'burst', 'wifi_burst')
+
+
+def percentile(values, q):
+    # Nearest-rank percentile, so every reported value is one that was observed
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+def summarize(timings, errors, elapsed):
+    milliseconds = [timing * 1000 for timing in timings]
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': _round(percentile(milliseconds, 50)),
+        'p95_ms': _round(percentile(milliseconds, 95)),
+        'p99_ms': _round(percentile(milliseconds, 99)),
+        'mean_ms': _round(sum(milliseconds) / len(milliseconds) if milliseconds else None),
+        'throughput_rps': _round(len(timings) / elapsed if elapsed else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class Request:
+
+    def __init__(self, client, method, url, data=None, expect=(200,), **extra):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.data = data
+        self.expect = expect
+        self.extra = extra
+
+    def __call__(self):
+        response = getattr(self.client, self.method)(self.url, self.data, secure=True, **self.extra)
+        return response.status_code in self.expect
+
+
+class Harness:
+    """
+    Drives the main flows through the Django test client against whatever
+    database is configured, usually a synthetic school from
+    ``synthetic.generate_school()``.
+
+    Each scenario prepares its clients (logins, keys) first and then times
+    only the requests, spread over ``concurrency`` threads. The ``burst``
+    scenario is the assembly: ``burst_size`` students claiming the same key at
+    once over ``burst_concurrency`` connections. ``wifi_burst`` is the same
+    assembly with every phone behind the school's one NAT address.
+
+    The background tasks a scenario leaves behind are run after its timed
+    requests, as the worker would, and counted under ``tasks``.
+    """
+
+    def __init__(self, requests=200, concurrency=1, burst_size=300, burst_concurrency=16, seed=None):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.burst_size = burst_size
+        self.burst_concurrency = burst_concurrency
+        self.rng = random.Random(seed)
+        self.addresses = 0
+
+    def run(self, scenarios=SCENARIOS, progress=None):
+        results = {}
+        for name in scenarios:
+            results[name] = getattr(self, name)()
+            results[name]['tasks'] = self.drain()
+            if progress is not None:
+                progress(name, results[name])
+        return results
+
+    def drain(self):
+        ran = 0
+        while True:
+            batch = tasks.run_pending()
+            ran += batch
+            if batch < tasks.TASK_BATCH_SIZE:
+                return ran
+
+    def dashboard(self):
+        return self.drive([Request(self.login(user), 'get', reverse('spiritdashboard:dashboard'))
+                           for user in self.users(self.requests)])
+
+    def leaderboard(self):
+        users = reverse('spiritdashboard:user_leaderboard')
+        grades = reverse('spiritdashboard:grade_leaderboard')
+        pages = [users, grades, users + '?period=week', users + '?around', grades + '?around', None]
+        jobs = []
+        for i, user in enumerate(self.users(self.requests)):
+            # Every sixth request pages deep into the board from the user's own position
+            url = pages[i % len(pages)] or '{}?after={}'.format(users, ranking.format_cursor(user.points, user.pk))
+            jobs.append(Request(self.login(user), 'get', url))
+        return self.drive(jobs)
+
+    def register(self):
+        grades = list(Grade.objects.values_list('pk', flat=True))
+        token = '{:x}'.format(self.rng.getrandbits(32))
+        jobs = []
+        for i in range(self.requests):
+            password = 'correct-horse-{}-{}'.format(token, i)
+            jobs.append(Request(Client(), 'post', reverse('spiritdashboard:register'), {
+                'username': 'bench{}x{}'.format(token, i), 'first_name': 'Bench', 'last_name': str(i),
+                'email': 'bench{}x{}@example.com'.format(token, i), 'password1': password,
+                'password2': password, 'grade': self.rng.choice(grades) if grades else '',
+            }, expect=(302,)))
+        return self.drive(jobs)
+
+    def claim(self):
+        now = timezone.now()
+        keys = {}
+        for mission_id, key in MissionKey.objects.filter(
+                one_use=False, mission__start_time__lte=now, mission__end_time__gte=now).values_list(
+                'mission_id', 'key'):
+            keys.setdefault(mission_id, key)
+
+        jobs = []
+        taken = set()
+        for user in self.users(self.requests * 3):
+            open_ids = [mission_id for mission_id in keys
+                        if mission_id not in user.completed_mission_ids and (user.pk, mission_id) not in taken]
+            if open_ids:
+                mission_id = self.rng.choice(open_ids)
+                taken.add((user.pk, mission_id))
+                jobs.append(self.claim_request(user, keys[mission_id]))
+            if len(jobs) >= self.requests:
+                break
+        return self.drive(jobs)
+
+    def burst(self, title='Assembly', address=None):
+        now = timezone.now()
+        mission = Mission.objects.create(title=title, description='Everyone, right now.', location='Gym',
+                                         value=50, start_time=now - timedelta(minutes=1),
+                                         end_time=now + timedelta(hours=1))
+        key = MissionKey.objects.create(mission=mission, one_use=False).key
+        users = User.objects.order_by('?')[:self.burst_size]
+        jobs = [self.claim_request(user, key, address) for user in users]
+        return self.drive(jobs, self.burst_concurrency)
+
+    def wifi_burst(self):
+        return self.burst('Assembly on school Wi-Fi', address='10.255.255.254')
+
+    def claim_request(self, user, key, address=None):
+        # Unless told otherwise every phone gets its own address, like
+        # students on mobile data
+        if address is None:
+            self.addresses += 1
+            address = '10.{}.{}.{}'.format(self.addresses >> 16 & 255, self.addresses >> 8 & 255,
+                                            self.addresses & 255)
+        return Request(self.login(user), 'get', reverse('spiritdashboard:claim_key', args=[key]),
+                       HTTP_X_FORWARDED_FOR=address)
+
+    def users(self, count):
+        ids = list(User.objects.values_list('pk', flat=True))
+        chosen = [self.rng.choice(ids) for _ in range(count)] if ids else []
+        users = User.objects.in_bulk(set(chosen))
+        return [users[pk] for pk in chosen]
+
+    def login(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def drive(self, jobs, concurrency=None):
+        concurrency = max(1, min(concurrency or self.concurrency, len(jobs) or 1))
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+
+        timings = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        job = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    start = time.perf_counter()
+                    try:
+                        ok = job()
+                    except Exception:
+                        ok = False
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        timings.append(elapsed)
+                        if not ok:
+                            errors.append(job.url)
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    connection.close()
+
+        start = time.perf_counter()
+        if concurrency == 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+
+        result = summarize(timings, len(errors), elapsed)
+        result['concurrency'] = concurrency
+        return result
+
+
+def compare(baseline, results):
+    """
+    Yields ``(scenario, metric, before, after, change)`` for every latency
+    and throughput figure present in both runs; ``change`` is a fraction.
+    """
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            before, after = previous.get(metric), current.get(metric)
+            if before and after is not None:
+                yield name, metric, before, after, (after - before) / before
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
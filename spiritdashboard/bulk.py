@@ -0,0 +1,106 @@
+from django.db import connection, connections
+from django.db.models.sql import UpdateQuery
+
+
+def update_returning(queryset, returning, **values):
+    """
+    ``queryset.update(**values)`` that also returns the ``returning`` fields
+    of every updated row as they were written, in the same statement.
+    """
+    model = queryset.model
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    compiler = query.get_compiler(queryset.db)
+    compiler.pre_sql_setup()
+    sql, params = compiler.as_sql()
+
+    quote = connection.ops.quote_name
+    sql += ' RETURNING {}'.format(', '.join(quote(model._meta.get_field(name).column) for name in returning))
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def increment(model, deltas, columns):
+    """
+    Adds ``deltas[pk]`` (a tuple lined up with ``columns``) to each row in a
+    single ``UPDATE ... FROM (VALUES ...)`` statement.
+    """
+    if not deltas:
+        return 0
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    placeholders = '({})'.format(', '.join(['%s'] * (len(columns) + 1)))
+    sql = 'UPDATE {table} SET {assignments} FROM (VALUES {values}) AS v(id, {names}) WHERE {table}.id = v.id'.format(
+        table=table,
+        assignments=', '.join('{0} = {1}.{0} + v.{0}'.format(quote(column), table) for column in columns),
+        values=', '.join([placeholders] * len(deltas)),
+        names=', '.join(quote(column) for column in columns),
+    )
+
+    params = []
+    # Updating in primary key order keeps concurrent batches from deadlocking
+    for pk, values in sorted(deltas.items()):
+        params.append(pk)
+        params.extend(values)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def append(model, column, values):
+    """
+    Appends ``values[pk]`` (a list of integers) to the integer array
+    ``column`` of each row in one statement.
+    """
+    if not values:
+        return 0
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    sql = 'UPDATE {table} SET {column} = {table}.{column} || v.items FROM (VALUES {values}) AS v(id, items) WHERE {table}.id = v.id'.format(
+        table=table,
+        column=quote(column),
+        values=', '.join(['(%s, %s::integer[])'] * len(values)),
+    )
+
+    params = []
+    for pk, items in sorted(values.items()):
+        params.append(pk)
+        params.append(list(items))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def assign(model, values, fields):
+    """
+    Sets ``fields`` of each row to ``values[pk]`` (a tuple lined up with
+    ``fields``) in one statement; ``bulk_update``'s CASE per field and row
+    costs far more to build and to plan.
+    """
+    if not values:
+        return 0
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in fields]
+    placeholders = '(%s, {})'.format(', '.join('%s::{}'.format(field.db_type(connection)) for field in fields))
+    sql = 'UPDATE {table} SET {assignments} FROM (VALUES {values}) AS v(id, {names}) WHERE {table}.id = v.id'.format(
+        table=table,
+        assignments=', '.join('{0} = v.{0}'.format(quote(field.column)) for field in fields),
+        values=', '.join([placeholders] * len(values)),
+        names=', '.join(quote(field.column) for field in fields),
+    )
+
+    params = []
+    for pk, row in sorted(values.items()):
+        params.append(pk)
+        params.extend(field.get_db_prep_save(value, connection) for field, value in zip(fields, row))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+
+# Backends that keep entries in one process's memory, or not at all
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared(alias='default'):
+    # Whether what one process writes to the cache (another web worker, the
+    # task worker, a management command) is seen by every other process
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_BACKENDS
@@ -0,0 +1,291 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Upper
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import bulk, health, leaderboards, ledger, live, pages
+from .keyindex import key_index
+from .models import CompletedMission, Grade, LedgerEntry, MissionKey, SyncedClaim, User
+from .summary import append_completed
+
+
+KEY_LENGTH = 10
+BATCH_LIMIT = 1000
+
+CLAIMED = 'claimed'
+ALREADY_COMPLETED = 'already_completed'
+INVALID = 'invalid'
+INVALID_KEY = 'invalid_key'
+KEY_USED = 'key_used'
+OUTSIDE_WINDOW = 'outside_window'
+UNKNOWN_USER = 'unknown_user'
+
+
+class ClaimError(Exception):
+    pass
+
+
+class KeyAlreadyUsed(ClaimError):
+    pass
+
+
+def claim(user, key):
+    """
+    Claims ``key`` for ``user`` and returns the completed mission.
+
+    Every counter is bumped with an ``F()`` update inside one transaction,
+    so concurrent claims never lose points, and the (mission, user) unique
+    constraint on ``CompletedMission`` makes a second claim of the same
+    mission fail instead of paying out twice. Raises ``ClaimError`` when
+    nothing was claimed.
+    """
+    if key is None or len(key) != KEY_LENGTH or not key_index.might_contain(key):
+        raise ClaimError('Invalid key, or you have already completed the mission.')
+
+    try:
+        mission_key = MissionKey.objects.select_related('mission').get(key=key)
+    except MissionKey.DoesNotExist:
+        raise ClaimError('Invalid key, or you have already completed the mission.')
+
+    mission = mission_key.mission
+    now = timezone.now()
+    if mission.start_time > now or mission.end_time < now:
+        raise ClaimError('Invalid key, or you have already completed the mission.')
+
+    try:
+        with transaction.atomic():
+            # bulk_create skips post_save: the user update below records the
+            # mission in completed_mission_ids itself
+            completion, = CompletedMission.objects.bulk_create(
+                [CompletedMission(mission=mission, user=user, grade_id=user.grade_id, completed_at=now)])
+
+            # A one-use key is only consumed if nobody consumed it first
+            keys = MissionKey.objects.filter(pk=mission_key.pk)
+            if mission_key.one_use:
+                keys = keys.filter(times_used=0)
+            if not keys.update(times_used=F('times_used') + 1):
+                raise KeyAlreadyUsed('Key provided has already been used.')
+
+            # The totals as written go to the cached boards, which can then
+            # never count this claim twice or miss it
+            (points, total_xp), = bulk.update_returning(
+                User.objects.filter(pk=user.pk), ('points', 'total_xp'),
+                points=F('points') + mission.value,
+                total_xp=F('total_xp') + mission.xp_points,
+                completed_mission_ids=append_completed(mission.pk),
+                **health.regenerate_expressions(now))
+
+            grade_points = None
+            if user.grade_id is not None:
+                (grade_points,), = bulk.update_returning(
+                    Grade.objects.filter(pk=user.grade_id), ('points',),
+                    points=F('points') + mission.value)
+
+            # The ledger only feeds the daily and weekly boards, so it is
+            # left to a worker; enqueued here, it exists only if the claim does
+            ledger.record_completion.enqueue(completion.pk, user.grade_id,
+                                             key='ledger:completion:{}'.format(completion.pk))
+    except IntegrityError:
+        raise ClaimError('Invalid key, or you have already completed the mission.')
+
+    # Keeps the caller's copy in step without reading the row back
+    user.points = points
+    user.total_xp = total_xp
+    user.completed_mission_ids = list(user.completed_mission_ids) + [mission.pk]
+    user.health, user.health_updated_at = health.regenerate(
+        user.health, user.health_updated_at, user.health_max, now)
+
+    live.publish_claim(leaderboards.record_claim(user, grade_points))
+    # The updates above send no signals
+    pages.content_versions.bump(pages.USERS, pages.GRADES, pages.COMPLETIONS)
+
+    return mission
+
+
+def claim_batch(station, items):
+    """
+    Applies claims recorded offline by the scanning station ``station``.
+
+    Each item is a dict with a station-generated ``id``, the ``user``'s
+    username, the ``key`` and the ISO 8601 time it was ``scanned_at``, which
+    is what the mission's start/end window is checked against. Everything is
+    applied in one transaction with a fixed number of set-based queries, and
+    every outcome is stored under the station and ``id`` so a retried upload
+    gets the same answers without paying out twice, while another station
+    may reuse the same ids. Returns one ``{'id', 'status'}`` dict per item,
+    in order.
+    """
+    statuses = {}
+    valid = []
+    for item in items:
+        parsed = _parse_item(item)
+        if parsed is None:
+            continue
+        if parsed['scanned_at'] is None:
+            statuses.setdefault(parsed['id'], INVALID)
+        elif parsed['id'] not in statuses:
+            statuses[parsed['id']] = None
+            valid.append(parsed)
+
+    claimed = []
+    with transaction.atomic():
+        done = dict(SyncedClaim.objects.filter(station=station, client_id__in=[item['id'] for item in valid])
+                    .values_list('client_id', 'status'))
+        statuses.update(done)
+        todo = sorted((item for item in valid if item['id'] not in done), key=lambda item: item['scanned_at'])
+
+        if todo:
+            claimed = _apply_batch(station, todo, statuses)
+
+    if claimed:
+        leaderboards.user_leaderboard.invalidate()
+        leaderboards.grade_leaderboard.invalidate()
+        live.publish_claim({board: live.RESET for board in live.LIVE_BOARDS})
+        pages.content_versions.bump(pages.USERS, pages.GRADES, pages.COMPLETIONS)
+
+    results = []
+    for item in items:
+        client_id = item.get('id') if isinstance(item, dict) else None
+        results.append({'id': client_id, 'status': statuses.get(_client_id(client_id), INVALID)})
+    return results
+
+
+def station_id(value):
+    # Station names follow the same rules as the ids they scope
+    return _client_id(value)
+
+
+def _client_id(value):
+    if isinstance(value, (str, int)) and not isinstance(value, bool) and 0 < len(str(value)) <= 64:
+        return str(value)
+    return None
+
+
+def _parse_item(item):
+    if not isinstance(item, dict):
+        return None
+    client_id = _client_id(item.get('id'))
+    if client_id is None:
+        return None
+
+    username, key, scanned_at = item.get('user'), item.get('key'), item.get('scanned_at')
+    parsed = {'id': client_id, 'user': username, 'key': key, 'scanned_at': None}
+    if not isinstance(username, str) or not isinstance(key, str) or not isinstance(scanned_at, str):
+        return parsed
+    try:
+        when = parse_datetime(scanned_at)
+    except ValueError:
+        return parsed
+    if when is not None and timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    parsed['scanned_at'] = when
+    return parsed
+
+
+def _apply_batch(station, items, statuses):
+    users = {user.upper: user for user in User.objects.annotate(upper=Upper('username')).filter(
+        upper__in={item['user'].upper() for item in items})}
+    keys = {mission_key.key: mission_key for mission_key in MissionKey.objects.select_for_update(of=('self',))
+            .select_related('mission').filter(key__in={item['key'] for item in items})}
+    completed = CompletedMission.objects.completed_pairs(
+        users.values(), {mission_key.mission_id for mission_key in keys.values()})
+
+    # Earliest scan first, so that is who gets a contested one-use key
+    accepted = []
+    uses = defaultdict(int)
+    for item in items:
+        user = users.get(item['user'].upper())
+        mission_key = keys.get(item['key'])
+        if user is None:
+            statuses[item['id']] = UNKNOWN_USER
+        elif mission_key is None:
+            statuses[item['id']] = INVALID_KEY
+        elif not mission_key.mission.start_time <= item['scanned_at'] <= mission_key.mission.end_time:
+            statuses[item['id']] = OUTSIDE_WINDOW
+        elif (user.pk, mission_key.mission_id) in completed:
+            statuses[item['id']] = ALREADY_COMPLETED
+        elif mission_key.one_use and mission_key.times_used + uses[mission_key.pk] > 0:
+            statuses[item['id']] = KEY_USED
+        else:
+            completed.add((user.pk, mission_key.mission_id))
+            uses[mission_key.pk] += 1
+            accepted.append((item, user, mission_key))
+
+    inserted = _insert_completions(accepted)
+
+    claimed = []
+    user_deltas = defaultdict(lambda: [0, 0])
+    grade_deltas = defaultdict(lambda: [0])
+    key_deltas = defaultdict(lambda: [0])
+    completions = defaultdict(list)
+    entries = []
+    for item, user, mission_key in accepted:
+        mission = mission_key.mission
+        if (user.pk, mission.pk) not in inserted:
+            # An online claim got there between our read and our insert
+            statuses[item['id']] = ALREADY_COMPLETED
+            continue
+
+        statuses[item['id']] = CLAIMED
+        claimed.append(item)
+        user_deltas[user.pk][0] += mission.value
+        user_deltas[user.pk][1] += mission.xp_points
+        if user.grade_id is not None:
+            grade_deltas[user.grade_id][0] += mission.value
+        key_deltas[mission_key.pk][0] += 1
+        completions[user.pk].append(mission.pk)
+        entries.append(LedgerEntry(user_id=user.pk, grade_id=user.grade_id, mission=mission,
+                                   points=mission.value, xp_points=mission.xp_points,
+                                   created_at=item['scanned_at']))
+
+    bulk.increment(User, user_deltas, ['points', 'total_xp'])
+    bulk.increment(Grade, grade_deltas, ['points'])
+    bulk.increment(MissionKey, key_deltas, ['times_used'])
+    bulk.append(User, 'completed_mission_ids', completions)
+    _regenerate_health(completions)
+    if entries:
+        ledger.record_many(entries)
+
+    SyncedClaim.objects.bulk_create([
+        SyncedClaim(station=station, client_id=item['id'], status=statuses[item['id']],
+                    scanned_at=item['scanned_at'],
+                    user=users.get(item['user'].upper()),
+                    mission=keys[item['key']].mission if item['key'] in keys else None)
+        for item in items
+    ], ignore_conflicts=True)
+
+    return claimed
+
+
+def _regenerate_health(completions):
+    # One update per distinct number of claims, usually just the one
+    by_claims = defaultdict(list)
+    for user_id, mission_ids in completions.items():
+        by_claims[len(mission_ids)].append(user_id)
+    now = timezone.now()
+    for claims, user_ids in sorted(by_claims.items()):
+        User.objects.filter(pk__in=sorted(user_ids)).update(**health.regenerate_expressions(now, claims))
+
+
+def _insert_completions(accepted):
+    # ON CONFLICT DO NOTHING lets racing online claims win without aborting the batch
+    if not accepted:
+        return set()
+
+    quote = connection.ops.quote_name
+    sql = (
+        'INSERT INTO {table} (user_id, mission_id, grade_id, completed_at) VALUES {values} '
+        'ON CONFLICT (mission_id, user_id) DO NOTHING RETURNING user_id, mission_id'
+    ).format(table=quote(CompletedMission._meta.db_table),
+             values=', '.join(['(%s, %s, %s, %s)'] * len(accepted)))
+
+    params = []
+    for item, user, mission_key in accepted:
+        params.extend([user.pk, mission_key.mission_id, user.grade_id, item['scanned_at']])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return set(cursor.fetchall())
@@ -0,0 +1,133 @@
+import csv
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .keys import Echo
+from .models import CompletedMission, Grade, User
+
+
+EXPORT_CHUNK_SIZE = 2000
+FORMATS = ('csv', 'json')
+
+
+def day_bounds(start=None, end=None):
+    # Whole local days, end date included
+    tz = timezone.get_current_timezone()
+    since = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz) if start else None
+    until = timezone.make_aware(datetime.datetime.combine(
+        end + datetime.timedelta(days=1), datetime.time.min), tz) if end else None
+    return since, until
+
+
+def _range(field, since, until):
+    condition = Q()
+    if since is not None:
+        condition &= Q(**{field + '__gte': since})
+    if until is not None:
+        condition &= Q(**{field + '__lt': until})
+    return condition
+
+
+def ranked_rows(rows, points_index):
+    """
+    Prepends a competition rank (1, 2, 2, 4) to rows that arrive in
+    descending points order, counting as they stream past.
+    """
+    position = 0
+    previous = rank = None
+    for row in rows:
+        position += 1
+        if row[points_index] != previous:
+            rank, previous = position, row[points_index]
+        yield (rank,) + tuple(row)
+
+
+def users(grade=None, since=None, until=None):
+    """
+    Standings of every user, or of one ``grade``'s. With a date range,
+    ``points`` are those earned in it according to the ledger. Ranks are
+    within the exported set and levels come straight from ``total_xp``.
+    """
+    queryset = User.objects.all()
+    if grade is not None:
+        queryset = queryset.filter(grade=grade)
+    if since is not None or until is not None:
+        queryset = queryset.annotate(standing=Coalesce(
+            Sum('ledgerentry__points', filter=_range('ledgerentry__created_at', since, until)),
+            Value(0), output_field=IntegerField()))
+    else:
+        queryset = queryset.annotate(standing=F('points'))
+
+    rows = queryset.order_by('-standing', 'pk').values_list(
+        'standing', 'pk', 'username', 'first_name', 'last_name', 'grade__name', 'total_xp'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    yield ('rank', 'points', 'id', 'username', 'first_name', 'last_name', 'grade', 'total_xp', 'level')
+    for row in ranked_rows(rows, 0):
+        yield row + (User.level_for_xp(row[-1]),)
+
+
+def grades(grade=None, since=None, until=None):
+    queryset = Grade.objects.all()
+    if grade is not None:
+        queryset = queryset.filter(pk=grade.pk)
+    if since is not None or until is not None:
+        queryset = queryset.annotate(standing=Coalesce(
+            Sum('ledgerentry__points', filter=_range('ledgerentry__created_at', since, until)),
+            Value(0), output_field=IntegerField()))
+    else:
+        queryset = queryset.annotate(standing=F('points'))
+    # Counted separately so the ledger join cannot multiply them
+    members = dict(User.objects.filter(grade__isnull=False).values_list('grade').annotate(Count('pk')))
+
+    rows = queryset.order_by('-standing', 'pk').values_list('standing', 'pk', 'name').iterator(
+        chunk_size=EXPORT_CHUNK_SIZE)
+
+    yield ('rank', 'points', 'id', 'name', 'members')
+    for row in ranked_rows(rows, 0):
+        yield row + (members.get(row[2], 0),)
+
+
+def history(grade=None, since=None, until=None):
+    queryset = CompletedMission.objects.filter(_range('completed_at', since, until))
+    if grade is not None:
+        queryset = queryset.filter(grade=grade)
+
+    rows = queryset.order_by('completed_at', 'pk').values_list(
+        'completed_at', 'user_id', 'user__username', 'grade__name', 'mission_id', 'mission__title',
+        'mission__value', 'mission__xp_points',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    yield ('completed_at', 'user_id', 'username', 'grade', 'mission_id', 'mission', 'points', 'xp_points')
+    yield from rows
+
+
+EXPORTS = {
+    'users': users,
+    'grades': grades,
+    'history': history,
+}
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def stream_json(rows):
+    """
+    Streams a JSON array of objects keyed by the header row, one row per
+    chunk, so the document is never held in memory whole.
+    """
+    rows = iter(rows)
+    header = next(rows)
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',\n' if i else '\n') + encoder.encode(dict(zip(header, row)))
+    yield '\n]\n'
@@ -1,6 +1,8 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
-from .models import Grade, User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Grade, Mission, User
 
 class SignUpForm(UserCreationForm):
     first_name = forms.CharField(max_length=30, required=True)
@@ -11,4 +13,85 @@ class SignUpForm(UserCreationForm):
 
     class Meta:
         model = User
-        fields = ('username', 'first_name', 'last_name', 'email', 'password1', 'password2', 'grade')
\ No newline at end of file
+        fields = ('username', 'first_name', 'last_name', 'email', 'password1', 'password2', 'grade')
+
+class ExportFilterForm(forms.Form):
+    grade = forms.ModelChoiceField(queryset=Grade.objects.all(), required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError('The start date must not be after the end date.')
+        return cleaned_data
+
+
+class IsoDateTimeField(forms.DateTimeField):
+    # Also takes ISO 8601 with a 'T' and an offset, as exported by spreadsheets and JSON
+    def to_python(self, value):
+        if isinstance(value, str):
+            parsed = parse_datetime(value.strip())
+            if parsed is not None:
+                if timezone.is_naive(parsed):
+                    parsed = timezone.make_aware(parsed)
+                return parsed
+        return super().to_python(value)
+
+
+class MissionImportForm(forms.ModelForm):
+    start_time = IsoDateTimeField()
+    end_time = IsoDateTimeField()
+    xp_points = forms.IntegerField(required=False, min_value=0)
+    keys = forms.IntegerField(required=False, min_value=0, max_value=100000)
+
+    class Meta:
+        model = Mission
+        fields = ('title', 'description', 'location', 'value', 'xp_points', 'start_time', 'end_time')
+
+    def clean_xp_points(self):
+        xp_points = self.cleaned_data['xp_points']
+        return Mission._meta.get_field('xp_points').default if xp_points is None else xp_points
+
+    def validate_unique(self):
+        # A row naming an existing mission updates it rather than being an error
+        pass
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start_time'), cleaned_data.get('end_time')
+        if start and end and start > end:
+            raise forms.ValidationError('The mission must not end before it starts.')
+        return cleaned_data
+
+
+class MissionUploadForm(forms.Form):
+    file = forms.FileField(help_text='CSV with a header row, a JSON array of objects, or JSON lines.')
+    keys = forms.IntegerField(min_value=0, max_value=100000, initial=0,
+                              help_text='Keys to create for each new mission, unless its row has a "keys" column.')
+    one_use = forms.BooleanField(initial=True, required=False)
+
+
+class RosterRowForm(forms.Form):
+    username = forms.CharField(max_length=150, required=False, validators=[User.username_validator])
+    first_name = forms.CharField(max_length=30)
+    last_name = forms.CharField(max_length=150)
+    email = forms.EmailField(max_length=254)
+    grade = forms.CharField(max_length=50, required=False)
+    password = forms.CharField(required=False, strip=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if 'username' in cleaned_data:
+            # Defaults to the part of the school email before the @
+            username = cleaned_data['username'] or cleaned_data.get('email', '').partition('@')[0]
+            try:
+                if not username:
+                    raise forms.ValidationError('Give a username or an email address.')
+                User.username_validator(username)
+            except forms.ValidationError as e:
+                self.add_error('username', e)
+            else:
+                cleaned_data['username'] = username
+        return cleaned_data
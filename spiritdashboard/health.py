@@ -0,0 +1,80 @@
+import datetime
+
+from django.conf import settings
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, FloatField, Func, IntegerField, Value
+from django.db.models.functions import Cast, Floor, Greatest, Least
+from django.utils import timezone
+
+
+# A student loses a point of health for every HEALTH_DECAY_INTERVAL seconds
+# without a claim, and gets HEALTH_PER_CLAIM back for each claim
+HEALTH_DECAY_INTERVAL = getattr(settings, 'HEALTH_DECAY_INTERVAL', 4 * 3600)
+HEALTH_PER_CLAIM = getattr(settings, 'HEALTH_PER_CLAIM', 10)
+
+
+def decay(health, since, now=None):
+    """
+    Health stored as ``health`` at ``since``, as of ``now``. Returns the
+    ``(health, since)`` pair to store instead: ``since`` only moves on by
+    the whole intervals that were lost, so storing the pair changes nothing
+    about what is read later.
+    """
+    now = now or timezone.now()
+    lost = min(health, max(0, int((now - since).total_seconds() // HEALTH_DECAY_INTERVAL)))
+    return health - lost, since + datetime.timedelta(seconds=lost * HEALTH_DECAY_INTERVAL)
+
+
+def regenerate(health, since, health_max, now=None, claims=1):
+    # A claim is activity, so the decay clock starts again from now
+    now = now or timezone.now()
+    current, _ = decay(health, since, now)
+    return min(health_max, current + claims * HEALTH_PER_CLAIM), now
+
+
+class Elapsed(Func):
+    template = 'EXTRACT(EPOCH FROM (%(expressions)s))'
+    arg_joiner = ' - '
+    output_field = FloatField()
+
+
+def _lost(now):
+    # decay() in SQL: whole intervals since the stored time, never more than the row has
+    intervals = Floor(Elapsed(Value(now, output_field=DateTimeField()), F('health_updated_at'))
+                      / Value(float(HEALTH_DECAY_INTERVAL)))
+    return Least(F('health'), Greatest(Value(0), Cast(intervals, IntegerField())))
+
+
+def decay_expressions(now):
+    lost = _lost(now)
+    return {
+        'health': F('health') - lost,
+        'health_updated_at': ExpressionWrapper(
+            F('health_updated_at') + ExpressionWrapper(
+                lost * Value(datetime.timedelta(seconds=HEALTH_DECAY_INTERVAL), output_field=DurationField()),
+                output_field=DurationField()),
+            output_field=DateTimeField()),
+    }
+
+
+def regenerate_expressions(now, claims=1):
+    """
+    Expressions for ``User.objects.update(**...)``, so a claim tops up health
+    in the same statement that pays its points.
+    """
+    return {
+        'health': Least(F('health_max'), F('health') - _lost(now) + Value(claims * HEALTH_PER_CLAIM)),
+        'health_updated_at': Value(now, output_field=DateTimeField()),
+    }
+
+
+def materialize(users, now=None):
+    """
+    Stores the decayed health of every user in ``users`` (a queryset) with
+    one UPDATE, skipping rows with nothing to lose yet, and returns how many
+    were written. Reads never need this; run it before anything that reads
+    the column directly, or before changing the decay interval.
+    """
+    now = now or timezone.now()
+    return users.filter(
+        health__gt=0, health_updated_at__lte=now - datetime.timedelta(seconds=HEALTH_DECAY_INTERVAL),
+    ).update(**decay_expressions(now))
@@ -0,0 +1,367 @@
+import csv
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+
+from . import bulk, keys, leaderboards, pages
+from .forms import MissionImportForm, RosterRowForm
+from .keyindex import key_index
+from .models import Grade, Mission, User
+from .schedule import mission_schedule
+
+
+IMPORT_BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 100
+
+MISSION_FIELDS = ('title', 'description', 'location', 'value', 'xp_points', 'start_time', 'end_time')
+
+MissionImport = namedtuple('MissionImport', 'created updated unchanged keys mission_ids')
+RosterImport = namedtuple('RosterImport', 'created skipped errors')
+
+ROSTER_BATCH_SIZE = 500
+CREDENTIALS_HEADER = ['username', 'password', 'first_name', 'last_name', 'email', 'grade']
+
+
+class InvalidRows(Exception):
+
+    def __init__(self, errors, count):
+        self.errors = errors
+        self.count = count
+        super().__init__('{} invalid rows'.format(count))
+
+
+def detect_format(name):
+    extension = os.path.splitext(name)[1].lower()
+    return 'json' if extension in ('.json', '.jsonl', '.ndjson') else 'csv'
+
+
+def format_errors(errors):
+    for line, row_errors in errors:
+        yield 'Line {}: {}'.format(line, '; '.join(
+            '{}: {}'.format(field, ' '.join(error['message'] for error in field_errors))
+            for field, field_errors in row_errors.items()))
+
+
+def read_rows(f, fmt):
+    """
+    Yields ``(line, row)`` from a text file without reading it whole. CSV
+    needs a header row. JSON may be an array of objects or one object per
+    line; ``line`` is then the row's position.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        yield from enumerate(_json_objects(f), start=1)
+
+
+def _json_objects(f):
+    # Decodes one value at a time from a sliding buffer; every value is an
+    # object, so a value cut off at the end of the buffer never parses
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    opened = closed = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if buffer[position] == '[' and not opened:
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == ']' and opened and not closed:
+                closed = True
+                position += 1
+                continue
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield value
+                continue
+        if eof:
+            return
+        chunk = f.read(JSON_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def validate(rows):
+    """
+    Yields ``(line, data, keys, errors)`` for every row, checked with
+    ``MissionImportForm``; ``errors`` is None for valid rows and ``keys``
+    is None unless the row has a count of its own.
+    """
+    for line, row in rows:
+        if not isinstance(row, dict):
+            yield line, None, None, {'__all__': [{'message': 'Expected an object.', 'code': 'invalid'}]}
+            continue
+        form = MissionImportForm({name: '' if value is None else value for name, value in row.items()})
+        if form.is_valid():
+            data = {name: form.cleaned_data[name] for name in MISSION_FIELDS}
+            yield line, data, form.cleaned_data['keys'], None
+        else:
+            yield line, None, None, form.errors.get_json_data()
+
+
+def import_missions(rows, keys_per_mission=0, one_use=True, batch_size=IMPORT_BATCH_SIZE, on_keys=None):
+    """
+    Creates or updates a mission for every row of ``rows`` (from
+    ``read_rows``), matched on title and start time, in one transaction.
+
+    Rows are validated and written ``batch_size`` at a time with an
+    ``INSERT ... ON CONFLICT`` and ``bulk.assign()``; rows identical to the
+    stored mission are left alone. New missions get ``keys_per_mission`` keys, or
+    their row's ``keys``, in the same transaction, and every batch of keys
+    is passed to ``on_keys``. If any row is invalid nothing is written and
+    ``InvalidRows`` lists the first ``MAX_REPORTED_ERRORS``.
+    """
+    created = updated = unchanged = key_count = 0
+    mission_ids = []
+    errors = []
+    invalid = 0
+
+    with transaction.atomic():
+        checked = validate(rows)
+        while True:
+            batch = list(islice(checked, batch_size))
+            if not batch:
+                break
+
+            valid = []
+            for line, data, count, row_errors in batch:
+                if row_errors is not None:
+                    invalid += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append((line, row_errors))
+                else:
+                    valid.append((data, keys_per_mission if count is None else count))
+            if invalid or not valid:
+                # Keep validating so every error is reported, but stop writing
+                continue
+
+            new, changed, same = _upsert(valid)
+            created += len(new)
+            updated += len(changed)
+            unchanged += same
+            mission_ids.extend(mission.pk for mission, _ in new)
+            mission_ids.extend(mission.pk for mission in changed)
+
+            for key_batch in keys.generate_key_sets([(mission, count) for mission, count in new if count],
+                                                    one_use=one_use):
+                key_count += len(key_batch)
+                if on_keys is not None:
+                    on_keys(key_batch)
+
+        if invalid:
+            raise InvalidRows(errors, invalid)
+
+        invalidate_caches()
+        transaction.on_commit(invalidate_caches)
+
+    return MissionImport(created, updated, unchanged, key_count, mission_ids)
+
+
+def _upsert(rows):
+    # The last row wins when a batch names the same mission twice
+    by_key = {}
+    for data, count in rows:
+        by_key[data['title'], data['start_time']] = (data, count)
+
+    existing = {}
+    for mission in Mission.objects.filter(title__in={title for title, _ in by_key}).only(
+            'pk', *MISSION_FIELDS):
+        existing[mission.title, mission.start_time] = mission
+
+    new = [(natural_key, data, count) for natural_key, (data, count) in by_key.items()
+           if natural_key not in existing]
+    inserted = _insert_missions([data for _, data, _ in new])
+    if len(inserted) < len(new):
+        # Another import created these since we looked; update them instead
+        lost = {natural_key for natural_key, _, _ in new if natural_key not in inserted}
+        for mission in Mission.objects.filter(title__in={title for title, _ in lost}).only('pk', *MISSION_FIELDS):
+            if (mission.title, mission.start_time) in lost:
+                existing[mission.title, mission.start_time] = mission
+
+    created, changed, same = [], [], 0
+    for natural_key, (data, count) in by_key.items():
+        mission = inserted.get(natural_key)
+        if mission is not None:
+            created.append((mission, count))
+            continue
+        mission = existing[natural_key]
+        if any(getattr(mission, name) != value for name, value in data.items()):
+            for name, value in data.items():
+                setattr(mission, name, value)
+            changed.append(mission)
+        else:
+            same += 1
+
+    bulk.assign(Mission, {mission.pk: tuple(getattr(mission, name) for name in MISSION_FIELDS)
+                          for mission in changed}, MISSION_FIELDS)
+    return created, changed, same
+
+
+def _insert_missions(rows):
+    """
+    Inserts a mission per row with ``ON CONFLICT DO NOTHING`` on the
+    natural key and returns the ones inserted by it. A concurrent import
+    that inserts the same mission first makes ours wait for it to commit
+    and then skip the row, rather than storing it twice.
+    """
+    if not rows:
+        return {}
+
+    quote = connection.ops.quote_name
+    fields = [Mission._meta.get_field(name) for name in MISSION_FIELDS]
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT (title, start_time) DO NOTHING RETURNING id, title, start_time'
+    ).format(table=quote(Mission._meta.db_table),
+             columns=', '.join(quote(field.column) for field in fields),
+             values=', '.join(['({})'.format(', '.join(['%s'] * len(fields)))] * len(rows)))
+
+    missions = [Mission(**data) for data in rows]
+    params = []
+    for mission in missions:
+        params.extend(field.get_db_prep_save(getattr(mission, field.attname), connection) for field in fields)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = {(title, start_time): pk for pk, title, start_time in cursor.fetchall()}
+
+    inserted = {}
+    for mission in missions:
+        natural_key = (mission.title, mission.start_time)
+        if natural_key in ids:
+            mission.pk = ids[natural_key]
+            inserted[natural_key] = mission
+    return inserted
+
+
+def invalidate_caches():
+    # bulk_create and bulk_update send none of the signals that do this
+    mission_schedule.invalidate()
+    key_index.invalidate()
+    pages.content_versions.bump(pages.MISSIONS)
+
+
+class GradeLookup:
+    """
+    Grade ids by case-insensitive name, read with one query. Unknown names
+    resolve to None, or to a new grade with ``create``.
+    """
+
+    def __init__(self, create=False):
+        self.create = create
+        self._ids = {name.lower(): pk for pk, name in Grade.objects.values_list('pk', 'name')}
+
+    def __call__(self, name):
+        key = name.strip().lower()
+        if key not in self._ids and self.create:
+            self._ids[key] = Grade.objects.create(name=name.strip()).pk
+        return self._ids.get(key)
+
+
+def _init_hasher():
+    # Workers started with spawn rather than fork need settings loaded
+    django.setup()
+
+
+def _hash(password):
+    return make_password(password)
+
+
+def import_roster(rows, credentials=None, create_grades=False, workers=None, batch_size=ROSTER_BATCH_SIZE,
+                  progress=None):
+    """
+    Creates a user for every valid row of ``rows`` (from ``read_rows``),
+    ``batch_size`` at a time with ``bulk_create``, each batch in its own
+    transaction so a long import keeps what it has done.
+
+    Usernames that exist already, in any case, are skipped, so an
+    interrupted import can simply be run again. Rows without a password get
+    a random one. Hashing, by far the slowest part, is spread over
+    ``workers`` processes (all cores by default; 1 hashes in-process).
+    Every created user's credentials are written to the ``credentials``
+    csv.writer once their batch commits, and ``progress(rows, created,
+    skipped)`` is called after each batch.
+    """
+    grades = GradeLookup(create=create_grades)
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(workers, initializer=_init_hasher) if workers > 1 else None
+    created = skipped = seen_rows = 0
+    errors = []
+    seen = set()
+
+    try:
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            seen_rows += len(batch)
+
+            students = []
+            for line, row in batch:
+                form = RosterRowForm(row)
+                if not form.is_valid():
+                    errors.append((line, form.errors.get_json_data()))
+                    continue
+                data = form.cleaned_data
+                grade_id = grades(data['grade']) if data['grade'] else None
+                if data['grade'] and grade_id is None:
+                    errors.append((line, {'grade': [{'message': 'No grade named {!r}.'.format(data['grade']),
+                                                     'code': 'invalid'}]}))
+                    continue
+                if data['username'].lower() in seen:
+                    skipped += 1
+                    continue
+                seen.add(data['username'].lower())
+                students.append((data, grade_id))
+
+            taken = set(User.objects.annotate(lower=Lower('username')).filter(
+                lower__in=[data['username'].lower() for data, _ in students]).values_list('lower', flat=True))
+            skipped += sum(1 for data, _ in students if data['username'].lower() in taken)
+            students = [(data, grade_id) for data, grade_id in students if data['username'].lower() not in taken]
+
+            passwords = [data['password'] or User.objects.make_random_password(12) for data, _ in students]
+            if pool is not None:
+                hashes = list(pool.map(_hash, passwords, chunksize=max(1, len(passwords) // workers)))
+            else:
+                hashes = [_hash(password) for password in passwords]
+
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    User(username=data['username'], first_name=data['first_name'], last_name=data['last_name'],
+                         email=data['email'], grade_id=grade_id, password=hashed)
+                    for (data, grade_id), hashed in zip(students, hashes))
+            created += len(students)
+
+            if credentials is not None:
+                for (data, _), password in zip(students, passwords):
+                    credentials.writerow([data['username'], password, data['first_name'], data['last_name'],
+                                          data['email'], data['grade']])
+            if progress is not None:
+                progress(seen_rows, created, skipped)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if created:
+            # bulk_create sends none of the signals that do this
+            leaderboards.user_leaderboard.invalidate()
+            pages.content_versions.bump(pages.USERS)
+
+    return RosterImport(created, skipped, errors)
@@ -0,0 +1,111 @@
+import hashlib
+import math
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import caches
+from .models import MissionKey
+
+
+KEY_INDEX_TIMEOUT = getattr(settings, 'KEY_INDEX_TIMEOUT', 3600)
+KEY_INDEX_ERROR_RATE = getattr(settings, 'KEY_INDEX_ERROR_RATE', 0.001)
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1000)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8))
+                   for position in self._positions(value))
+
+
+class KeyIndex:
+    """
+    Bloom filter of every key whose mission hasn't ended, used to turn away
+    guessed keys without touching the database.
+
+    The filter is built once and shared through Django's cache; each worker
+    keeps a local copy and only reloads it when the shared version number
+    changes. A false positive just falls through to the normal key lookup.
+
+    A false negative turns a real key away, so the filter is only used when
+    every process sees the same version, i.e. with a shared cache backend
+    (or ``enabled``, or the KEY_INDEX_ENABLED setting). Otherwise keys
+    created by another process would be missing until a restart.
+    """
+
+    VERSION_KEY = 'keyindex:version'
+
+    def __init__(self, timeout=KEY_INDEX_TIMEOUT, error_rate=KEY_INDEX_ERROR_RATE, enabled=None):
+        self.timeout = timeout
+        self.error_rate = error_rate
+        self.enabled = enabled
+        self._version = None
+        self._filter = None
+        self._lock = threading.Lock()
+
+    def is_enabled(self):
+        if self.enabled is not None:
+            return self.enabled
+        return getattr(settings, 'KEY_INDEX_ENABLED', None) or caches.is_shared()
+
+    def might_contain(self, key):
+        if not self.is_enabled():
+            return True
+        return key in self._current()
+
+    def _current(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is not None and version == self._version:
+            return self._filter
+
+        with self._lock:
+            if version is None:
+                version = self.invalidate()
+            # Filters are stored per version, so one built from keys read
+            # before a later invalidation can never pass for the new version
+            filter_key = 'keyindex:filter:{}'.format(version)
+            bloom = cache.get(filter_key)
+            if bloom is None:
+                bloom = self.build()
+                cache.set(filter_key, bloom, self.timeout)
+            self._version, self._filter = version, bloom
+            return bloom
+
+    def build(self):
+        keys = MissionKey.objects.filter(mission__end_time__gte=timezone.now()).values_list('key', flat=True)
+        keys = list(keys.iterator())
+        bloom = BloomFilter(len(keys), self.error_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def invalidate(self):
+        # A random token rather than a counter, so a cache flush can't hand
+        # out a version some worker already holds a stale filter for
+        version = uuid.uuid4().hex
+        cache.set(self.VERSION_KEY, version, None)
+        return version
+
+
+key_index = KeyIndex()
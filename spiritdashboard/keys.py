@@ -0,0 +1,177 @@
+import csv
+from itertools import chain, islice, repeat
+
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+
+from .keyindex import key_index
+from .models import MissionKey, generate_random_key
+
+
+KEY_BATCH_SIZE = 1000
+KEY_BATCH_ATTEMPTS = 5
+SHEET_SIZE = (1275, 1650)  # US letter at 150 DPI
+SHEET_COLUMNS = 3
+SHEET_ROWS = 4
+
+
+def generate_keys(mission, count, one_use=True, batch_size=KEY_BATCH_SIZE):
+    """
+    Creates ``count`` new keys for ``mission`` and yields them batch by batch.
+
+    Candidates come from the CSPRNG in ``generate_random_key``. Each batch
+    drops candidates that already exist with one ``key__in`` query and
+    draws replacements until it is full, so collisions cost a query per
+    batch rather than per key.
+    """
+    return generate_key_sets([(mission, count)], one_use=one_use, batch_size=batch_size)
+
+
+def generate_key_sets(counts, one_use=True, batch_size=KEY_BATCH_SIZE):
+    """
+    Same as ``generate_keys`` for many missions at once: ``counts`` is a
+    sequence of ``(mission, count)`` and batches span missions, so a term's
+    worth of missions with a few keys each still costs a query per batch.
+    """
+    owners = chain.from_iterable(repeat(mission, count) for mission, count in counts)
+    while True:
+        missions = list(islice(owners, batch_size))
+        if not missions:
+            return
+        batch = _create_batch(missions, one_use)
+        # bulk_create skips the save signals that normally do this
+        key_index.invalidate()
+        yield batch
+
+
+def stored_batches(mission_ids, batch_size=KEY_BATCH_SIZE):
+    """
+    Yields the stored keys of ``mission_ids`` in creation order, a query per
+    batch, so keys made in an earlier transaction can be streamed without
+    holding them all.
+    """
+    last = 0
+    while True:
+        batch = list(MissionKey.objects.filter(mission_id__in=mission_ids, pk__gt=last).select_related(
+            'mission').order_by('pk')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def _create_batch(missions, one_use):
+    for attempt in range(KEY_BATCH_ATTEMPTS):
+        keys = _unique_candidates(len(missions))
+        try:
+            with transaction.atomic():
+                return MissionKey.objects.bulk_create(
+                    MissionKey(mission=mission, key=key, one_use=one_use) for mission, key in zip(missions, keys))
+        except IntegrityError:
+            # Another generator took one of our candidates; draw the batch again
+            if attempt == KEY_BATCH_ATTEMPTS - 1:
+                raise
+
+
+def _unique_candidates(size):
+    keys = set()
+    while len(keys) < size:
+        while len(keys) < size:
+            keys.add(generate_random_key())
+        taken = MissionKey.objects.filter(key__in=keys).values_list('key', flat=True)
+        keys.difference_update(taken)
+    return keys
+
+
+def claim_url(key, base_url):
+    return base_url.rstrip('/') + reverse('spiritdashboard:claim_key', args=[key])
+
+
+CSV_HEADER = ['mission', 'key', 'one_use', 'url']
+
+
+def batch_rows(batch, base_url):
+    for mission_key in batch:
+        yield [mission_key.mission.title, mission_key.key, mission_key.one_use,
+               claim_url(mission_key.key, base_url)]
+
+
+def csv_rows(batches, base_url):
+    yield CSV_HEADER
+    for batch in batches:
+        yield from batch_rows(batch, base_url)
+
+
+def write_csv(batches, out, base_url):
+    writer = csv.writer(out)
+    for row in csv_rows(batches, base_url):
+        writer.writerow(row)
+
+
+class Echo:
+    # File-like object that hands csv.writer's output straight back
+    def write(self, value):
+        return value
+
+
+def stream_csv(batches, base_url):
+    writer = csv.writer(Echo())
+    for row in csv_rows(batches, base_url):
+        yield writer.writerow(row)
+
+
+def render_sheets(batches, base_url):
+    """
+    Yields printable pages of QR codes, one Pillow image at a time, so only
+    the page being drawn is ever held in memory.
+    """
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+    page = []
+    for batch in batches:
+        for mission_key in batch:
+            page.append(mission_key)
+            if len(page) == per_page:
+                yield _render_sheet(page, base_url)
+                page = []
+    if page:
+        yield _render_sheet(page, base_url)
+
+
+def _render_sheet(mission_keys, base_url):
+    from PIL import Image, ImageDraw
+    import qrcode
+
+    sheet = Image.new('RGB', SHEET_SIZE, 'white')
+    draw = ImageDraw.Draw(sheet)
+    cell_width = SHEET_SIZE[0] // SHEET_COLUMNS
+    cell_height = SHEET_SIZE[1] // SHEET_ROWS
+    qr_size = min(cell_width, cell_height) - 80
+
+    for i, mission_key in enumerate(mission_keys):
+        left = (i % SHEET_COLUMNS) * cell_width
+        top = (i // SHEET_COLUMNS) * cell_height
+
+        code = qrcode.make(claim_url(mission_key.key, base_url)).resize((qr_size, qr_size))
+        sheet.paste(code, (left + (cell_width - qr_size) // 2, top + 20))
+        draw.text((left + 20, top + qr_size + 25), mission_key.mission.title[:40], fill='black')
+        draw.text((left + 20, top + qr_size + 45), mission_key.key, fill='black')
+        draw.rectangle([left, top, left + cell_width - 1, top + cell_height - 1], outline='#cccccc')
+
+    return sheet
+
+
+def write_pdf(batches, path, base_url):
+    # Pillow appends one page at a time to the file on disk
+    pages = 0
+    for sheet in render_sheets(batches, base_url):
+        sheet.save(path, 'PDF', resolution=150, append=bool(pages))
+        pages += 1
+    return pages
+
+
+def write_pngs(batches, prefix, base_url):
+    pages = 0
+    for sheet in render_sheets(batches, base_url):
+        pages += 1
+        sheet.save('{}-{:04d}.png'.format(prefix, pages), 'PNG')
+    return pages
@@ -0,0 +1,167 @@
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Grade, User
+from .ranking import ranked
+
+
+LEADERBOARD_SIZE = getattr(settings, 'LEADERBOARD_SIZE', 10)
+LEADERBOARD_CACHE_TIMEOUT = getattr(settings, 'LEADERBOARD_CACHE_TIMEOUT', 300)
+
+
+class Leaderboard(ABC):
+    """
+    Top-N standings stored in Django's cache with their ranks precomputed.
+
+    Entries are plain dicts so that any cache backend can hold them. Claims
+    write their new totals into the cached list through ``record()``;
+    ``rebuild()`` replaces it from the database and runs on a miss or once
+    the entry has been cached for ``timeout`` seconds.
+    """
+
+    def __init__(self, name, size=LEADERBOARD_SIZE, timeout=LEADERBOARD_CACHE_TIMEOUT):
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+
+    @property
+    def key(self):
+        return 'leaderboard:{}'.format(self.name)
+
+    @abstractmethod
+    def queryset(self):
+        """Rows ranked on the board; they need ``pk`` and ``points``."""
+
+    @abstractmethod
+    def serialize(self, obj):
+        """A cacheable dict for one row, with its ``id`` and ``points``."""
+
+    def entries(self):
+        entries = cache.get(self.key)
+        if entries is None:
+            entries = self.rebuild()
+        return entries
+
+    def rebuild(self):
+        entries = []
+        for obj in ranked(self.queryset())[:self.size]:
+            entry = self.serialize(obj)
+            entry['ranking'] = obj.ranking
+            entries.append(entry)
+        cache.set(self.key, entries, self.timeout)
+        return entries
+
+    def invalidate(self):
+        cache.delete(self.key)
+
+    def record(self, pk, points):
+        """
+        Writes ``points``, the total a claim just committed for row ``pk``,
+        into the cached board. Only rows that may enter the board cost a
+        query.
+
+        Returns what changed on the board for live clients: ``None`` if
+        nothing did, ``{'reset': True}`` if the board couldn't be updated in
+        place, otherwise the ``changed`` entries and the ``removed`` ids.
+        """
+        lock, dirty = self.key + ':lock', self.key + ':dirty'
+        if not cache.add(lock, True, 5):
+            # Someone else is editing the list. The flag makes them drop it
+            # if they store it after our delete, so our total isn't lost
+            cache.set(dirty, True, 5)
+            self.invalidate()
+            return {'reset': True}
+
+        try:
+            entries = cache.get(self.key)
+            if entries is None:
+                return {'reset': True}
+            before = {entry['id']: (entry['points'], entry['ranking']) for entry in entries}
+
+            for entry in entries:
+                if entry['id'] == pk:
+                    # Totals only grow between rebuilds, so a claim recorded
+                    # out of order can't take the board backwards
+                    entry['points'] = max(entry['points'], points)
+                    break
+            else:
+                full = len(entries) >= self.size
+                if full and points < entries[-1]['points']:
+                    return None
+                obj = self.queryset().filter(pk=pk).first()
+                if obj is None or full and obj.points < entries[-1]['points']:
+                    return None
+                entries.append(self.serialize(obj))
+
+            entries = self.rerank(entries)
+            cache.set(self.key, entries, self.timeout)
+            if cache.get(dirty):
+                cache.delete_many([self.key, dirty])
+                return {'reset': True}
+        finally:
+            cache.delete(lock)
+
+        after = {entry['id'] for entry in entries}
+        return {
+            'changed': [entry for entry in entries
+                        if before.get(entry['id']) != (entry['points'], entry['ranking'])],
+            'removed': [entry_id for entry_id in before if entry_id not in after],
+        }
+
+    def rerank(self, entries):
+        # Everyone above a top-N entry is also in the top N, so ranks computed
+        # within the list are the same as ranks over the whole table
+        entries.sort(key=lambda entry: (-entry['points'], entry['id']))
+        entries = entries[:self.size]
+        for i, entry in enumerate(entries):
+            if i and entry['points'] == entries[i - 1]['points']:
+                entry['ranking'] = entries[i - 1]['ranking']
+            else:
+                entry['ranking'] = i + 1
+        return entries
+
+
+class UserLeaderboard(Leaderboard):
+
+    def queryset(self):
+        return User.objects.select_related('grade')
+
+    def serialize(self, user):
+        return {
+            'id': user.pk,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'grade': {'name': user.grade.name} if user.grade else None,
+            'points': user.points,
+        }
+
+
+class GradeLeaderboard(Leaderboard):
+
+    def queryset(self):
+        return Grade.objects.all()
+
+    def serialize(self, grade):
+        return {
+            'id': grade.pk,
+            'name': grade.name,
+            'points': grade.points,
+        }
+
+
+user_leaderboard = UserLeaderboard('users')
+grade_leaderboard = GradeLeaderboard('grades')
+
+
+def record_claim(user, grade_points):
+    diffs = {user_leaderboard.name: user_leaderboard.record(user.pk, user.points)}
+    if user.grade_id is not None:
+        diffs[grade_leaderboard.name] = grade_leaderboard.record(user.grade_id, grade_points)
+    return diffs
+
+
+def rebuild_all():
+    user_leaderboard.rebuild()
+    grade_leaderboard.rebuild()
@@ -0,0 +1,156 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Rank
+from django.utils import timezone
+
+from . import tasks
+from .models import CompletedMission, GradePointsRollup, LedgerEntry, Mission, User, UserPointsRollup
+
+
+DAY = 'day'
+WEEK = 'week'
+PERIODS = (DAY, WEEK)
+
+
+def bucket_start(period, when=None):
+    # Buckets follow the school's local calendar; weeks start on Monday
+    day = timezone.localdate(when)
+    if period == WEEK:
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+
+def record(user, grade_id, mission, when):
+    """
+    Writes the ledger entry for a claim and adds its points to every rollup
+    bucket it falls in. Meant to run inside the claim's transaction.
+    """
+    LedgerEntry.objects.create(
+        user_id=user.pk, grade_id=grade_id, mission=mission,
+        points=mission.value, xp_points=mission.xp_points, created_at=when)
+    _add_to_rollups([(user.pk, grade_id, mission.value, when)])
+
+
+@tasks.task
+def record_completion(completion_id, grade_id):
+    """
+    record() for a claim, run by a worker. Does nothing if the completion
+    is gone or already has its entry, e.g. from rebuild_rollups().
+    """
+    completion = CompletedMission.objects.select_related('mission').filter(pk=completion_id).first()
+    if completion is None or LedgerEntry.objects.filter(user_id=completion.user_id,
+                                                        mission_id=completion.mission_id).exists():
+        return
+    record(User(pk=completion.user_id), grade_id, completion.mission, completion.completed_at)
+
+
+def record_many(entries):
+    # Same as record() for a batch of unsaved LedgerEntry rows, in three queries
+    LedgerEntry.objects.bulk_create(entries)
+    _add_to_rollups([(entry.user_id, entry.grade_id, entry.points, entry.created_at) for entry in entries])
+
+
+def _add_to_rollups(claims):
+    user_totals = defaultdict(int)
+    grade_totals = defaultdict(int)
+    for user_id, grade_id, points, when in claims:
+        for period in PERIODS:
+            bucket = bucket_start(period, when)
+            user_totals[period, bucket, user_id] += points
+            if grade_id is not None:
+                grade_totals[period, bucket, grade_id] += points
+
+    _upsert_rollups(UserPointsRollup, 'user_id', user_totals)
+    _upsert_rollups(GradePointsRollup, 'grade_id', grade_totals)
+
+
+def _upsert_rollups(model, column, totals):
+    # One upsert for all buckets; concurrent claims add instead of overwrite
+    if not totals:
+        return
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    sql = (
+        'INSERT INTO {table} (period, bucket, {column}, points) VALUES {values} '
+        'ON CONFLICT (period, bucket, {column}) '
+        'DO UPDATE SET points = {table}.points + EXCLUDED.points'
+    ).format(table=table, column=quote(column), values=', '.join(['(%s, %s, %s, %s)'] * len(totals)))
+
+    params = []
+    for (period, bucket, owner_id), points in sorted(totals.items()):
+        params.extend([period, bucket, owner_id, points])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def user_standings(period, when=None, size=10):
+    rollups = _standings(UserPointsRollup, period, when, size).select_related('user__grade')
+    return [_as_owner(rollup, rollup.user) for rollup in rollups]
+
+
+def grade_standings(period, when=None, size=10):
+    rollups = _standings(GradePointsRollup, period, when, size).select_related('grade')
+    return [_as_owner(rollup, rollup.grade) for rollup in rollups]
+
+
+def _standings(model, period, when, size):
+    return model.objects.filter(period=period, bucket=bucket_start(period, when)).annotate(
+        ranking=Window(expression=Rank(), order_by=F('points').desc())).order_by('-points', 'pk')[:size]
+
+
+def _as_owner(rollup, owner):
+    # Lets the leaderboard templates render windowed rows like lifetime ones
+    owner.points = rollup.points
+    owner.ranking = rollup.ranking
+    return owner
+
+
+def rebuild_rollups():
+    """
+    Recreates missing ledger entries from ``CompletedMission`` and then
+    rebuilds every rollup from the ledger, all with set-based statements.
+    Completions from before timestamps were recorded are dated at their
+    mission's start time.
+    """
+    quote = connection.ops.quote_name
+    tables = {
+        'ledger': quote(LedgerEntry._meta.db_table),
+        'completed': quote(CompletedMission._meta.db_table),
+        'mission': quote(Mission._meta.db_table),
+        'user_rollup': quote(UserPointsRollup._meta.db_table),
+        'grade_rollup': quote(GradePointsRollup._meta.db_table),
+    }
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {ledger} (user_id, grade_id, mission_id, points, xp_points, created_at) '
+            'SELECT c.user_id, c.grade_id, c.mission_id, m.value, m.xp_points, '
+            'COALESCE(c.completed_at, m.start_time) '
+            'FROM {completed} c '
+            'JOIN {mission} m ON m.id = c.mission_id '
+            'WHERE NOT EXISTS (SELECT 1 FROM {ledger} l '
+            'WHERE l.user_id = c.user_id AND l.mission_id = c.mission_id)'.format(**tables))
+        created = cursor.rowcount
+
+        cursor.execute('DELETE FROM {user_rollup}'.format(**tables))
+        cursor.execute('DELETE FROM {grade_rollup}'.format(**tables))
+
+        for period in PERIODS:
+            bucket = "date_trunc('{}', created_at AT TIME ZONE %s)::date".format(period)
+            cursor.execute(
+                'INSERT INTO {user_rollup} (period, bucket, user_id, points) '
+                'SELECT %s, {bucket}, user_id, SUM(points) FROM {ledger} '
+                'GROUP BY 2, user_id'.format(bucket=bucket, **tables), [period, settings.TIME_ZONE])
+            cursor.execute(
+                'INSERT INTO {grade_rollup} (period, bucket, grade_id, points) '
+                'SELECT %s, {bucket}, grade_id, SUM(points) FROM {ledger} '
+                'WHERE grade_id IS NOT NULL '
+                'GROUP BY 2, grade_id'.format(bucket=bucket, **tables), [period, settings.TIME_ZONE])
+
+    return created
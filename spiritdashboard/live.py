@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import re
+import select
+import threading
+
+from django.conf import settings
+from django.db import connection, connections
+
+
+logger = logging.getLogger(__name__)
+
+LIVE_QUEUE_SIZE = getattr(settings, 'LIVE_QUEUE_SIZE', 64)
+LIVE_KEEPALIVE = getattr(settings, 'LIVE_KEEPALIVE', 15)
+LIVE_RECONNECT_DELAY = getattr(settings, 'LIVE_RECONNECT_DELAY', 5)
+LIVE_PATH = '/live/leaderboard/{}/'
+LIVE_BOARDS = ('users', 'grades')
+LIVE_CHANNEL = 'live_leaderboard'
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+LIVE_PAYLOAD_LIMIT = 7999
+
+RESET = {'reset': True}
+
+
+class Subscription:
+
+    def __init__(self, channel, loop, size):
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop. A client too slow to keep up is
+        # told to refetch instead of being sent a backlog of stale diffs
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESET
+        self.queue.put_nowait(event)
+
+    def close(self):
+        self.deliver(None)
+
+
+class Broker:
+    """
+    In-process pub/sub between the thread that receives claims and the
+    event loop that holds the live connections.
+
+    ``publish()`` may be called from any thread; each event is handed to
+    the subscribers' loops with ``call_soon_threadsafe``. Nothing is
+    published until an ASGI application has ``enable()``-d the broker, so
+    WSGI workers pay nothing for it.
+    """
+
+    def __init__(self, size=LIVE_QUEUE_SIZE):
+        self.size = size
+        self.enabled = False
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, asyncio.get_event_loop(), self.size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._channels.get(subscription.channel, set()).discard(subscription)
+
+    def publish(self, channel, event):
+        if not self.enabled:
+            return 0
+        loops = {}
+        with self._lock:
+            for subscription in self._channels.get(channel, ()):
+                loops.setdefault(subscription.loop, []).append(subscription)
+        # One wake-up per loop rather than one per connection
+        for loop, subscriptions in loops.items():
+            loop.call_soon_threadsafe(_deliver, subscriptions, event)
+        return sum(len(subscriptions) for subscriptions in loops.values())
+
+    def count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subscriptions) for subscriptions in self._channels.values())
+
+
+def _deliver(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+broker = Broker()
+
+
+def live_url(board):
+    if (broker.enabled or getattr(settings, 'LIVE_ENABLED', False)) and board in LIVE_BOARDS:
+        return LIVE_PATH.format(board)
+    return None
+
+
+def publish_claim(diffs):
+    """
+    Sends each board's diff to its live clients: straight to the broker
+    when this process holds the streams, otherwise with a Postgres NOTIFY
+    that the live process's ``Listener`` passes on. A NOTIFY sent inside a
+    transaction is only delivered if it commits.
+    """
+    diffs = {board: diff for board, diff in diffs.items() if diff}
+    if not diffs:
+        return
+    if broker.enabled:
+        for board, diff in diffs.items():
+            broker.publish(board, diff)
+    elif getattr(settings, 'LIVE_ENABLED', False):
+        payload = json.dumps(diffs, separators=(',', ':'))
+        if len(payload.encode('utf-8')) > LIVE_PAYLOAD_LIMIT:
+            payload = json.dumps({board: RESET for board in diffs})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [LIVE_CHANNEL, payload])
+
+
+class Listener(threading.Thread):
+    """
+    Listens on ``LIVE_CHANNEL`` with a connection of its own and publishes
+    what the web workers send to ``broker``.
+
+    Diffs sent while it wasn't listening are lost, so every (re)connection
+    starts by telling clients to refetch their boards.
+    """
+
+    def __init__(self, broker, alias='default'):
+        super().__init__(name='live-listener', daemon=True)
+        self.broker = broker
+        self.alias = alias
+        self.listening = threading.Event()
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.listen()
+            except Exception:
+                # psycopg2's own errors, as this connection bypasses Django's wrapper
+                logger.warning('Lost the live leaderboard channel, reconnecting', exc_info=True)
+            self.listening.clear()
+            self._stopping.wait(LIVE_RECONNECT_DELAY)
+
+    def listen(self):
+        database = connections[self.alias]
+        conn = database.get_new_connection(database.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(LIVE_CHANNEL))
+            self.listening.set()
+            for board in LIVE_BOARDS:
+                self.broker.publish(board, RESET)
+
+            while not self._stopping.is_set():
+                # Wakes up every second to notice stop()
+                if not select.select([conn], [], [], 1)[0]:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def dispatch(self, payload):
+        try:
+            diffs = json.loads(payload)
+        except ValueError:
+            logger.warning('Ignoring a malformed live leaderboard event: %r', payload)
+            return
+        for board, diff in diffs.items():
+            if board in LIVE_BOARDS:
+                self.broker.publish(board, diff)
+
+    def stop(self):
+        self._stopping.set()
+
+
+def format_event(event):
+    name = 'reset' if event.get('reset') else 'rank'
+    return 'event: {}\ndata: {}\n\n'.format(name, json.dumps(event, separators=(',', ':'))).encode('utf-8')
+
+
+async def leaderboard_events(board, receive, send):
+    subscription = broker.subscribe(board)
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                subscription.close()
+                return
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            if event is None:
+                break
+            await send({'type': 'http.response.body', 'body': format_event(event), 'more_body': True})
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(subscription)
+
+
+async def not_found(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'Not found.'})
+
+
+class LiveApplication:
+    """
+    ASGI application that streams leaderboard diffs as server-sent events
+    from ``/live/leaderboard/<board>/`` and hands every other request to
+    ``fallback``, a 404 unless given one.
+
+    Run as its own process next to the WSGI site: while the server is up
+    a ``Listener`` feeds the broker with the claims made in the web workers.
+    """
+
+    path = re.compile(r'^/live/leaderboard/(?P<board>{})/$'.format('|'.join(LIVE_BOARDS)))
+
+    def __init__(self, fallback=not_found):
+        self.fallback = fallback
+        self.listener = None
+        broker.enable()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        match = self.path.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.fallback(scope, receive, send)
+
+        if scope['method'] != 'GET':
+            await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await leaderboard_events(match.group('board'), receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.listener = Listener(broker)
+                self.listener.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.listener is not None:
+                    self.listener.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from spiritdashboard import ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the points ledger and the daily/weekly rollups from completed missions.'
+
+    def handle(self, *args, **options):
+        created = ledger.rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} ledger entries and rebuilt rollups.'.format(created)))
@@ -0,0 +1,95 @@
+import json
+import platform
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from spiritdashboard import benchmarks, synthetic
+
+from .generate_school import add_school_arguments, school_options
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic school in a throwaway test database and reports latency percentiles '
+            'and throughput for the dashboard, leaderboard, register and claim flows and for assembly bursts '
+            'from separate addresses and from one shared one.')
+
+    def add_arguments(self, parser):
+        add_school_arguments(parser)
+        parser.set_defaults(users=2000, missions=200, seed=2019)
+        parser.add_argument('--scenario', action='append', choices=benchmarks.SCENARIOS,
+                            help='Run only this scenario (repeatable).')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads sending requests.')
+        parser.add_argument('--burst', type=int, default=300, help='Students in the assembly burst.')
+        parser.add_argument('--burst-concurrency', type=int, default=16)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Print changes against an earlier JSON results file.')
+        parser.add_argument('--existing-data', action='store_true',
+                            help='Benchmark the configured database as it is instead of a generated '
+                                 'school. Claims and registrations are written to it.')
+
+    def handle(self, *args, **options):
+        baseline = benchmarks.load(options['compare']) if options['compare'] else None
+
+        setup_test_environment()
+        old_name = None
+        try:
+            if not options['existing_data']:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                start = time.perf_counter()
+                with transaction.atomic():
+                    counts = synthetic.generate_school(**school_options(options))
+                self.stderr.write('Generated {} in {:.1f}s.'.format(
+                    ', '.join('{} {}'.format(count, name) for name, count in counts.items()),
+                    time.perf_counter() - start))
+
+            harness = benchmarks.Harness(
+                requests=options['requests'], concurrency=options['concurrency'], burst_size=options['burst'],
+                burst_concurrency=options['burst_concurrency'], seed=options['seed'])
+            scenarios = harness.run(options['scenario'] or benchmarks.SCENARIOS, progress=self.report)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'revision': self.revision(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'options': {name: options[name] for name in (
+                'grades', 'users', 'missions', 'keys_per_mission', 'completions', 'distribution',
+                'open_fraction', 'seed', 'requests', 'concurrency', 'burst', 'burst_concurrency',
+                'existing_data')},
+            'scenarios': scenarios,
+        }
+
+        if options['output']:
+            benchmarks.save(results, options['output'])
+        else:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+
+        if baseline is not None:
+            for name, metric, before, after, change in benchmarks.compare(baseline, results):
+                self.stderr.write('{:<12} {:<15} {:>10.2f} -> {:>10.2f} ({:+.1%})'.format(
+                    name, metric, before, after, change))
+
+        if any(result['errors'] for result in scenarios.values()):
+            raise CommandError('Some requests failed; see "errors" in the results.')
+
+    def report(self, name, result):
+        self.stderr.write('{:<12} {requests:>5} requests  p50 {p50_ms} ms  p95 {p95_ms} ms  p99 {p99_ms} ms  '
+                          '{throughput_rps} req/s  {errors} errors  {tasks} tasks'.format(name, **result))
+
+    def revision(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
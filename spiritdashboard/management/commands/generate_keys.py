@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from spiritdashboard import keys
+from spiritdashboard.models import Mission
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generates unique keys for a mission and exports them as CSV or printable QR sheets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mission_id', type=int)
+        parser.add_argument('count', type=int)
+        parser.add_argument('--multi-use', action='store_true',
+                            help='Create keys that can be claimed by more than one user.')
+        parser.add_argument('--batch-size', type=int, default=keys.KEY_BATCH_SIZE)
+        parser.add_argument('--format', choices=['csv', 'pdf', 'png'], default='csv')
+        parser.add_argument('--output',
+                            help='File to write (CSV defaults to stdout; PNG pages use this as a prefix).')
+        parser.add_argument('--base-url', default='https://smusgo.com',
+                            help='Site root the QR codes and URLs point at.')
+
+    def handle(self, *args, **options):
+        try:
+            mission = Mission.objects.get(pk=options['mission_id'])
+        except Mission.DoesNotExist:
+            raise CommandError('Mission {} does not exist.'.format(options['mission_id']))
+
+        batches = keys.generate_keys(mission, options['count'], one_use=not options['multi_use'],
+                                     batch_size=options['batch_size'])
+        output = options['output']
+        fmt = options['format']
+
+        if fmt == 'csv':
+            if output:
+                with open(output, 'w', newline='') as f:
+                    keys.write_csv(batches, f, options['base_url'])
+            else:
+                keys.write_csv(batches, self.stdout, options['base_url'])
+            return
+
+        if not output:
+            raise CommandError('--output is required for {} sheets.'.format(fmt))
+
+        if fmt == 'pdf':
+            pages = keys.write_pdf(batches, output, options['base_url'])
+        else:
+            pages = keys.write_pngs(batches, output, options['base_url'])
+        self.stderr.write('Wrote {} pages.'.format(pages))
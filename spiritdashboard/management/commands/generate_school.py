@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from spiritdashboard import synthetic
+
+
+def add_school_arguments(parser):
+    parser.add_argument('--grades', type=int, default=6)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--missions', type=int, default=100)
+    parser.add_argument('--keys-per-mission', type=int, default=5)
+    parser.add_argument('--completions', type=float, default=10,
+                        help='Mean number of missions each user has completed.')
+    parser.add_argument('--distribution', choices=synthetic.DISTRIBUTIONS, default='pareto',
+                        help='Shape of completions per user and of mission popularity.')
+    parser.add_argument('--open-fraction', type=float, default=0.5,
+                        help='Share of missions that are running now.')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def school_options(options):
+    return {
+        'grades': options['grades'],
+        'users': options['users'],
+        'missions': options['missions'],
+        'keys_per_mission': options['keys_per_mission'],
+        'completions': options['completions'],
+        'distribution': options['distribution'],
+        'open_fraction': options['open_fraction'],
+        'seed': options['seed'],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a synthetic school for load testing. Every user\'s password is "password".'
+
+    def add_arguments(self, parser):
+        add_school_arguments(parser)
+        parser.add_argument('--force', action='store_true',
+                            help='Run even though DEBUG is off, e.g. against a staging database.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('DEBUG is off, so this may be a real school\'s database; '
+                               'pass --force to add synthetic users to it anyway.')
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            counts = synthetic.generate_school(**school_options(options))
+        self.stdout.write(self.style.SUCCESS('Created {} in {:.1f}s.'.format(
+            ', '.join('{} {}'.format(count, name) for name, count in counts.items()),
+            time.perf_counter() - start)))
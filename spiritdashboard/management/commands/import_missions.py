@@ -0,0 +1,71 @@
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spiritdashboard import imports, keys
+
+
+class Command(BaseCommand):
+    help = ('Creates or updates missions from a CSV or JSON file, matched on title and start time, and '
+            'optionally generates keys for the new ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input.')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='Defaults to json for .json/.jsonl/.ndjson files and csv otherwise.')
+        parser.add_argument('--keys', type=int, default=0,
+                            help='Keys to create for each new mission, unless its row has a "keys" column.')
+        parser.add_argument('--multi-use', action='store_true',
+                            help='Create keys that can be claimed by more than one user.')
+        parser.add_argument('--keys-output', help='Write the new keys to this CSV file.')
+        parser.add_argument('--base-url', default='https://smusgo.com',
+                            help='Site root the key URLs point at.')
+        parser.add_argument('--batch-size', type=int, default=imports.IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or imports.detect_format(path)
+        f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+
+        # Keys go to a temporary file that only replaces the output once the import commits
+        output = options['keys_output']
+        keys_file = writer = None
+        if output:
+            keys_file = tempfile.NamedTemporaryFile('w', newline='', delete=False,
+                                                    dir=os.path.dirname(os.path.abspath(output)))
+            writer = csv.writer(keys_file)
+            writer.writerow(keys.CSV_HEADER)
+
+        def on_keys(batch):
+            if writer is not None:
+                writer.writerows(keys.batch_rows(batch, options['base_url']))
+
+        start = time.perf_counter()
+        result = None
+        try:
+            result = imports.import_missions(
+                imports.read_rows(f, fmt), keys_per_mission=options['keys'], one_use=not options['multi_use'],
+                batch_size=options['batch_size'], on_keys=on_keys)
+        except imports.InvalidRows as e:
+            lines = list(imports.format_errors(e.errors))
+            if e.count > len(e.errors):
+                lines.append('... and {} more.'.format(e.count - len(e.errors)))
+            raise CommandError('{} invalid rows; nothing was imported.\n{}'.format(e.count, '\n'.join(lines)))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            if keys_file is not None:
+                keys_file.close()
+                if result is None:
+                    os.remove(keys_file.name)
+                else:
+                    os.replace(keys_file.name, output)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} missions, updated {}, left {} unchanged and generated {} keys in {:.2f}s.'.format(
+                result.created, result.updated, result.unchanged, result.keys, elapsed)))
@@ -0,0 +1,55 @@
+import csv
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spiritdashboard import imports
+
+
+class Command(BaseCommand):
+    help = ('Creates student accounts from a CSV roster (username, first_name, last_name, email, grade, '
+            'password) and writes their invitation credentials to a file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Roster CSV with a header row, or - for standard input.')
+        parser.add_argument('--credentials', required=True,
+                            help='CSV file to write usernames and passwords to. Keep it private.')
+        parser.add_argument('--create-grades', action='store_true',
+                            help='Create grades the roster names but the database does not have.')
+        parser.add_argument('--workers', type=int,
+                            help='Processes hashing passwords; defaults to the number of cores.')
+        parser.add_argument('--batch-size', type=int, default=imports.ROSTER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        # Readable by the owner only: the file holds every new password
+        descriptor = os.open(options['credentials'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        start = time.perf_counter()
+
+        def progress(rows, created, skipped):
+            elapsed = time.perf_counter() - start
+            self.stderr.write('{} rows read, {} users created, {} skipped ({:.0f} users/s)'.format(
+                rows, created, skipped, created / elapsed if elapsed else 0))
+
+        try:
+            with open(descriptor, 'w', newline='') as out:
+                credentials = csv.writer(out)
+                credentials.writerow(imports.CREDENTIALS_HEADER)
+                result = imports.import_roster(
+                    imports.read_rows(f, 'csv'), credentials=credentials, create_grades=options['create_grades'],
+                    workers=options['workers'], batch_size=options['batch_size'], progress=progress)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        for line in imports.format_errors(result.errors):
+            self.stderr.write(line)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} users and skipped {} existing ones in {:.1f}s; credentials are in {}.'.format(
+                result.created, result.skipped, time.perf_counter() - start, options['credentials'])))
+        if result.errors:
+            raise CommandError('{} rows were not imported.'.format(len(result.errors)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from spiritdashboard import health
+from spiritdashboard.models import User
+
+
+class Command(BaseCommand):
+    help = ('Stores every user\'s decayed health in one UPDATE. Reads decay health on their own; run this before '
+            'querying the column directly or changing HEALTH_DECAY_INTERVAL.')
+
+    def handle(self, *args, **options):
+        updated = health.materialize(User.objects.all())
+        self.stdout.write(self.style.SUCCESS('Updated health for {} users.'.format(updated)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from spiritdashboard import leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the cached user and grade leaderboards from the database.'
+
+    def handle(self, *args, **options):
+        leaderboards.rebuild_all()
+        self.stdout.write(self.style.SUCCESS('Rebuilt leaderboards.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from spiritdashboard import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Recomputes user points and XP and grade points from what each completed mission paid when it '
+            'was claimed and corrects the totals that drifted. Changing a mission\'s value doesn\'t reprice '
+            'claims already in the ledger.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without correcting it.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only check users with claims since the last run, and their grades.')
+        parser.add_argument('--batch-size', type=int, default=reconcile.RECONCILE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        result = reconcile.reconcile(incremental=options['incremental'], dry_run=options['dry_run'],
+                                     batch_size=options['batch_size'])
+
+        for label, drifts in (('user', result.users), ('grade', result.grades)):
+            for drift in drifts:
+                self.stdout.write('{} {}: {} -> {}'.format(
+                    label, drift.pk, '/'.join(map(str, drift.stored)), '/'.join(map(str, drift.expected))))
+
+        verb = 'Found' if options['dry_run'] else 'Corrected'
+        self.stdout.write(self.style.SUCCESS('{} {} users and {} grades (completions up to {}).'.format(
+            verb, len(result.users), len(result.grades), result.last_completion_id)))
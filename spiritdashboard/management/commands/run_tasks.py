@@ -0,0 +1,39 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from spiritdashboard import tasks
+
+
+class Command(BaseCommand):
+    help = ('Runs background tasks as they fall due. Start as many as needed; they share the queue without '
+            'running a task twice.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the tasks due now and exit.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait before looking again when nothing is due.')
+        parser.add_argument('--batch-size', type=int, default=tasks.TASK_BATCH_SIZE)
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='Delete tasks that finished this many days ago, once at startup.')
+
+    def handle(self, *args, **options):
+        stopping = []
+        # Finish the task in hand when the platform asks us to stop
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+        purged = tasks.purge(options['purge_days'])
+        if purged:
+            self.stdout.write('Purged {} finished tasks.'.format(purged))
+
+        total = 0
+        while not stopping:
+            ran = tasks.run_pending(options['batch_size'])
+            total += ran
+            if ran < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS('Ran {} tasks.'.format(total)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from spiritdashboard.avatars import avatar_cache
+from spiritdashboard.models import User
+
+
+class Command(BaseCommand):
+    help = 'Renders and stores the avatar of every user so dashboards never render one inline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete every stored avatar before warming.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            avatar_cache.clear(storage=True)
+
+        usernames = User.objects.values_list('username', flat=True).iterator()
+        count = avatar_cache.warm(usernames)
+        self.stdout.write(self.style.SUCCESS('Warmed {} avatars.'.format(count)))
@@ -0,0 +1,167 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.template.backends.django import DjangoTemplates, Template
+
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name: (help, buckets)
+METRICS = {
+    'request_duration_seconds': ('Wall time spent in the view, middleware included.', SECONDS),
+    'db_queries': ('Database queries per request.', QUERIES),
+    'db_duration_seconds': ('Time per request spent waiting on the database.', SECONDS),
+    'template_render_seconds': ('Time per request spent rendering templates.', SECONDS),
+    'avatar_render_seconds': ('Time per request spent generating avatars.', SECONDS),
+}
+
+_local = threading.local()
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """
+    Histograms of every metric in ``METRICS``, kept in memory per URL name.
+    Each process has its own registry, so a scrape reports the worker that
+    answered it; Prometheus sums them per instance.
+    """
+
+    def __init__(self, prefix='spirit'):
+        self.prefix = prefix
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, values):
+        with self._lock:
+            histograms = self._views.get(view)
+            if histograms is None:
+                histograms = self._views[view] = {name: Histogram(buckets) for name, (_, buckets) in METRICS.items()}
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def histogram(self, view, name):
+        return self._views[view][name]
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in METRICS.items():
+                metric = '{}_{}'.format(self.prefix, name)
+                lines.append('# HELP {} {}'.format(metric, help_text))
+                lines.append('# TYPE {} histogram'.format(metric))
+                for view in sorted(self._views):
+                    histogram = self._views[view][name]
+                    label = 'view="{}"'.format(_escape(view))
+                    for bound, total in histogram.cumulative():
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, label, bound, total))
+                    lines.append('{}_sum{{{}}} {}'.format(metric, label, _number(histogram.sum)))
+                    lines.append('{}_count{{{}}} {}'.format(metric, label, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.avatar_time = 0.0
+        self._rendering = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def begin():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def end():
+    _local.stats = None
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def timed(attribute):
+    """
+    Adds the time spent in the block to ``attribute`` of the current
+    request's stats. Does nothing outside a profiled request.
+    """
+    stats = current()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, attribute, getattr(stats, attribute) + time.perf_counter() - start)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed('template_time'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing each top-level render for the
+    profiling middleware. Included and extended templates are rendered
+    inside it, so nothing is counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
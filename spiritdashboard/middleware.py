@@ -0,0 +1,78 @@
+import cProfile
+import os
+import random
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+
+class ProfilingMiddleware:
+    """
+    Records wall time, database queries and time, template render time and
+    avatar render time for every request into ``metrics.registry``, keyed
+    by URL name.
+
+    A ``PROFILE_SAMPLE_RATE`` fraction of requests is also run under
+    cProfile, and the stats are dumped to ``PROFILE_DIR``, which keeps the
+    newest ``PROFILE_KEEP`` files.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.directory = getattr(settings, 'PROFILE_DIR', None)
+        self.keep = getattr(settings, 'PROFILE_KEEP', 100)
+
+    def __call__(self, request):
+        profiler = None
+        if self.directory and self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+
+        stats = metrics.begin()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                if profiler is not None:
+                    response = profiler.runcall(self.get_response, request)
+                else:
+                    response = self.get_response(request)
+        finally:
+            metrics.end()
+        elapsed = time.perf_counter() - start
+
+        view = self.view_name(request)
+        metrics.registry.observe(view, {
+            'request_duration_seconds': elapsed,
+            'db_queries': stats.queries,
+            'db_duration_seconds': stats.db_time,
+            'template_render_seconds': stats.template_time,
+            'avatar_render_seconds': stats.avatar_time,
+        })
+        if profiler is not None:
+            self.dump(profiler, view)
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        if match.url_name:
+            return match.view_name
+        # Unnamed patterns are reported by route rather than by raw path
+        return match.route or match._func_path
+
+    def dump(self, profiler, view):
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{:.6f}-{}.prof'.format(time.time(), re.sub(r'[^\w.-]+', '_', view))
+        profiler.dump_stats(os.path.join(self.directory, name))
+
+        profiles = sorted(entry for entry in os.listdir(self.directory) if entry.endswith('.prof'))
+        for old in profiles[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:34
+
+from django.db import migrations
+from django.db.models import Min
+import spiritdashboard.models
+
+
+def delete_duplicate_completions(apps, schema_editor):
+    # Racing claims could record the same mission twice; keep the first one
+    CompletedMission = apps.get_model('spiritdashboard', 'CompletedMission')
+    first_ids = CompletedMission.objects.values('mission', 'user').annotate(
+        first_id=Min('id')).values('first_id')
+    CompletedMission.objects.exclude(id__in=first_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0019_remove_user_avatar'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_completions, migrations.RunPython.noop),
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', spiritdashboard.models.CaseInsensitiveUserManager()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='completedmission',
+            unique_together={('mission', 'user')},
+        ),
+    ]
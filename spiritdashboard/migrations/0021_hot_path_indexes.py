@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0020_completedmission_unique'),
+    ]
+
+    operations = [
+        # Backs CaseInsensitiveUserManager's username__iexact lookup, which
+        # PostgreSQL compiles to UPPER("username"::text) = UPPER(%s)
+        migrations.RunSQL(
+            'CREATE INDEX user_username_upper_idx ON spiritdashboard_user (UPPER("username"::text));',
+            'DROP INDEX user_username_upper_idx;',
+        ),
+        migrations.AddIndex(
+            model_name='completedmission',
+            index=models.Index(fields=['user', 'mission'], name='completedmission_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['-points', 'id'], name='grade_points_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mission',
+            index=models.Index(fields=['end_time', 'start_time'], name='mission_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-points', 'id'], name='user_points_idx'),
+        ),
+    ]
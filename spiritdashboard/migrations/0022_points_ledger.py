@@ -0,0 +1,75 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0021_hot_path_indexes'),
+    ]
+
+    operations = [
+        # Existing completions keep a NULL time instead of the migration's
+        migrations.AddField(
+            model_name='completedmission',
+            name='completed_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='completedmission',
+            name='completed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.CreateModel(
+            name='UserPointsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=10)),
+                ('bucket', models.DateField()),
+                ('points', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField(default=0)),
+                ('xp_points', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('grade', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='spiritdashboard.Grade')),
+                ('mission', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='spiritdashboard.Mission')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GradePointsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=10)),
+                ('bucket', models.DateField()),
+                ('points', models.IntegerField(default=0)),
+                ('grade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spiritdashboard.Grade')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userpointsrollup',
+            index=models.Index(fields=['period', 'bucket', '-points', 'user'], name='userrollup_standings_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='userpointsrollup',
+            unique_together={('period', 'bucket', 'user')},
+        ),
+        migrations.AddIndex(
+            model_name='gradepointsrollup',
+            index=models.Index(fields=['period', 'bucket', '-points', 'grade'], name='graderollup_standings_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gradepointsrollup',
+            unique_together={('period', 'bucket', 'grade')},
+        ),
+    ]
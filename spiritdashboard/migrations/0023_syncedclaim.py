@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0022_points_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncedClaim',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(max_length=20)),
+                ('scanned_at', models.DateTimeField(null=True)),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('mission', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='spiritdashboard.Mission')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:51
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0023_syncedclaim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='completed_mission_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.RunSQL(
+            'UPDATE spiritdashboard_user u SET completed_mission_ids = ARRAY('
+            'SELECT c.mission_id FROM spiritdashboard_completedmission c WHERE c.user_id = u.id ORDER BY c.id);',
+            migrations.RunSQL.noop,
+        ),
+    ]
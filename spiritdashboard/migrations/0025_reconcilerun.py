@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0024_user_completed_mission_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconcileRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_completion_id', models.IntegerField(default=0)),
+                ('users_corrected', models.IntegerField(default=0)),
+                ('grades_corrected', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0025_reconcilerun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mission',
+            index=models.Index(fields=['title', 'start_time'], name='mission_natural_key_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0027_backgroundtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='health_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0028_user_health_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncedclaim',
+            name='station',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='syncedclaim',
+            name='client_id',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterUniqueTogether(
+            name='syncedclaim',
+            unique_together={('station', 'client_id')},
+        ),
+    ]
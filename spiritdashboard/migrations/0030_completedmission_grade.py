@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0029_syncedclaim_station'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='completedmission',
+            name='grade',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='spiritdashboard.Grade'),
+        ),
+        # The ledger recorded the grade at claim time; older completions
+        # without an entry fall back to the user's current grade
+        migrations.RunSQL(
+            'UPDATE spiritdashboard_completedmission c SET grade_id = u.grade_id '
+            'FROM spiritdashboard_user u WHERE u.id = c.user_id;'
+            'UPDATE spiritdashboard_completedmission c SET grade_id = l.grade_id '
+            'FROM spiritdashboard_ledgerentry l WHERE l.user_id = c.user_id AND l.mission_id = c.mission_id;',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:01
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def rename_duplicate_missions(apps, schema_editor):
+    # Concurrent imports could store a mission twice. Their keys may already
+    # be printed and claimed, so rather than merging, every copy but the
+    # first gets its id in the title and keeps its keys and completions
+    Mission = apps.get_model('spiritdashboard', 'Mission')
+    duplicates = Mission.objects.values('title', 'start_time').annotate(
+        copies=Count('id'), first_id=Min('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        for mission in Mission.objects.filter(title=duplicate['title'], start_time=duplicate['start_time']).exclude(
+                id=duplicate['first_id']):
+            suffix = ' (#{})'.format(mission.id)
+            mission.title = mission.title[:Mission._meta.get_field('title').max_length - len(suffix)] + suffix
+            mission.save(update_fields=['title'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spiritdashboard', '0030_completedmission_grade'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_missions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='mission',
+            unique_together={('title', 'start_time')},
+        ),
+        migrations.RemoveIndex(
+            model_name='mission',
+            name='mission_natural_key_idx',
+        ),
+    ]
@@ -1,18 +1,26 @@
-import random
+import secrets
 import string
 import datetime
 
 import math
+from collections import namedtuple
 
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.db import models
 from django.utils import timezone
 import pagan
 
+from . import health as health_decay
+from .ranking import rank_for_points
+
+
+Progress = namedtuple('Progress', ['level', 'xp', 'percent'])
+
 
 def generate_random_key():
     chars = string.ascii_lowercase + string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(10))
+    return ''.join(secrets.choice(chars) for _ in range(10))
 
 
 def generate_profile_picture():
@@ -25,10 +33,13 @@ class Grade(models.Model):
     name = models.CharField(max_length=50)
     points = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-points', 'id'], name='grade_points_idx'),
+        ]
+
     def rank(self):
-        aggregate = Grade.objects.filter(points__gt=self.points).aggregate(
-            ranking=models.Count('points'))
-        return aggregate['ranking'] + 1
+        return rank_for_points(Grade, self.points)
 
     def __str__(self):
         return self.name
@@ -43,32 +54,61 @@ class User(AbstractUser):
     points = models.IntegerField(default=0)
     grade = models.ForeignKey(Grade, on_delete=models.SET_NULL, null=True)
 
+    # Health as of health_updated_at; it decays from there when read, see
+    # current_health()
     health = models.IntegerField(default=100)
     health_max = models.IntegerField(default=100)
+    health_updated_at = models.DateTimeField(default=timezone.now)
 
     total_xp = models.IntegerField(default=0)
 
+    # Denormalized from CompletedMission so the dashboard gets it with the
+    # user row that authentication already loads
+    completed_mission_ids = ArrayField(models.IntegerField(), default=list, blank=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-points', 'id'], name='user_points_idx'),
+        ]
+
     def rank(self):
-        aggregate = User.objects.filter(points__gt=self.points).aggregate(
-            ranking=models.Count('points'))
-        return aggregate['ranking'] + 1
+        return rank_for_points(User, self.points)
+
+    def current_health(self, now=None):
+        return health_decay.decay(self.health, self.health_updated_at, now)[0]
 
-    def health_percent(self):
-        return math.floor((self.health / self.health_max) * 100)
+    def health_percent(self, now=None):
+        return math.floor((self.current_health(now) / self.health_max) * 100)
 
     def level(self):
-        prev_level = 1  
-        while self.total_xp > User.total_xp_for_level(prev_level):
-            prev_level += 1
-        if self.total_xp != User.total_xp_for_level(prev_level):
-            prev_level -= 1
-        return prev_level
+        return self.progress().level
 
     def xp_toward_next_level(self):
-        return self.total_xp - User.total_xp_for_level(self.level())
+        return self.progress().xp
 
     def xp_percent(self):
-        return math.floor(self.xp_toward_next_level() / User.total_xp_for_level(self.level()+1) * 100)
+        return self.progress().percent
+
+    def progress(self):
+        level = User.level_for_xp(self.total_xp)
+        xp = self.total_xp - User.total_xp_for_level(level)
+        percent = math.floor(xp / User.total_xp_for_level(level + 1) * 100)
+        return Progress(level, xp, percent)
+
+    @staticmethod
+    def level_for_xp(total_xp):
+        # Highest level L with 5 * L * (L - 1) / 2 <= total_xp, i.e. the
+        # quadratic in total_xp_for_level solved for L
+        if total_xp < 0:
+            return 0
+        discriminant = 4 * ((2 * total_xp) // 5) + 1
+        root = int(math.sqrt(discriminant))
+        # Float sqrt can be off by one for very large values
+        while root * root > discriminant:
+            root -= 1
+        while (root + 1) * (root + 1) <= discriminant:
+            root += 1
+        return (root + 1) // 2
 
     @staticmethod
     def xp_for_level(level):
@@ -90,22 +130,66 @@ class Mission(models.Model):
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(default=timezone.now)
 
-    def is_future(self):
-        return self.start_time > timezone.now()
+    class Meta:
+        # Natural key the mission import upserts on
+        unique_together = ('title', 'start_time')
+        indexes = [
+            models.Index(fields=['end_time', 'start_time'], name='mission_schedule_idx'),
+        ]
+
+    def is_future(self, now=None):
+        return self.start_time > (now or timezone.now())
 
-    def is_expired(self):
-        return self.end_time < timezone.now()
+    def is_expired(self, now=None):
+        return self.end_time < (now or timezone.now())
 
     def is_completed_by_user(self, user):
-        return CompletedMission.objects.filter(mission=self, user=user) > 0
+        return self.pk in CompletedMission.objects.completed_mission_ids(user, [self])
 
     def __str__(self):
         return self.title
 
 
+def _pks(objects):
+    # Querysets stay lazy and become a subquery, so the caller's filter and
+    # the completion lookup are still one query
+    if isinstance(objects, models.QuerySet):
+        return objects.values('pk')
+    return [getattr(obj, 'pk', obj) for obj in objects]
+
+
+class CompletedMissionManager(models.Manager):
+    """
+    Completion checks for many missions or many users at once. Each takes
+    model instances, primary keys or a queryset and costs one query that
+    the (user, mission) index answers, however many there are.
+    """
+
+    def completed_mission_ids(self, user, missions):
+        return set(self.filter(user=user, mission__in=_pks(missions)).values_list('mission_id', flat=True))
+
+    def completed_user_ids(self, mission, users):
+        return set(self.filter(mission=mission, user__in=_pks(users)).values_list('user_id', flat=True))
+
+    def completed_pairs(self, users, missions):
+        return set(self.filter(user__in=_pks(users), mission__in=_pks(missions))
+                   .values_list('user_id', 'mission_id'))
+
+
 class CompletedMission(models.Model):
     mission = models.ForeignKey(Mission, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The grade credited with the points: the user's grade when they claimed
+    grade = models.ForeignKey(Grade, on_delete=models.SET_NULL, null=True, blank=True)
+    completed_at = models.DateTimeField(default=timezone.now, null=True)
+
+    objects = CompletedMissionManager()
+
+    class Meta:
+        unique_together = ('mission', 'user')
+        indexes = [
+            models.Index(fields=['user', 'mission'], name='completedmission_user_idx'),
+        ]
 
     def __str__(self):
         return self.mission.title + ' by ' + self.user.username
@@ -120,3 +204,109 @@ class MissionKey(models.Model):
 
     def __str__(self):
         return self.mission.title + ': ' + self.key
+
+
+class SyncedClaim(models.Model):
+    # Outcome of one item sent by a scanning station, keyed by the station
+    # and the id it gave the item so a retried upload gets the same answer
+    station = models.CharField(max_length=64)
+    client_id = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    mission = models.ForeignKey(Mission, on_delete=models.SET_NULL, null=True)
+    status = models.CharField(max_length=20)
+    scanned_at = models.DateTimeField(null=True)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('station', 'client_id')
+
+    def __str__(self):
+        return '{}/{}: {}'.format(self.station, self.client_id, self.status)
+
+
+class LedgerEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    grade = models.ForeignKey(Grade, on_delete=models.SET_NULL, null=True)
+    mission = models.ForeignKey(Mission, on_delete=models.SET_NULL, null=True)
+    points = models.IntegerField(default=0)
+    xp_points = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '{} points for {}'.format(self.points, self.user.username)
+
+
+class ReconcileRun(models.Model):
+    # Highest CompletedMission id a reconcile_totals run had seen, where the
+    # next incremental run picks up
+    last_completion_id = models.IntegerField(default=0)
+    users_corrected = models.IntegerField(default=0)
+    grades_corrected = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return 'Reconciled up to completion {}'.format(self.last_completion_id)
+
+
+class BackgroundTask(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    # Dotted path of the function to run, with its JSON arguments
+    name = models.CharField(max_length=200)
+    arguments = JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers only ever look for due pending tasks
+            models.Index(fields=['run_at'], name='backgroundtask_due_idx', condition=models.Q(status='pending')),
+        ]
+
+    def __str__(self):
+        return '{} ({})'.format(self.name, self.status)
+
+
+ROLLUP_PERIODS = (
+    ('day', 'Day'),
+    ('week', 'Week'),
+)
+
+
+class UserPointsRollup(models.Model):
+    period = models.CharField(max_length=10, choices=ROLLUP_PERIODS)
+    bucket = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('period', 'bucket', 'user')
+        indexes = [
+            models.Index(fields=['period', 'bucket', '-points', 'user'], name='userrollup_standings_idx'),
+        ]
+
+
+class GradePointsRollup(models.Model):
+    period = models.CharField(max_length=10, choices=ROLLUP_PERIODS)
+    bucket = models.DateField()
+    grade = models.ForeignKey(Grade, on_delete=models.CASCADE)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('period', 'bucket', 'grade')
+        indexes = [
+            models.Index(fields=['period', 'bucket', '-points', 'grade'], name='graderollup_standings_idx'),
+        ]
@@ -0,0 +1,144 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import caches
+
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 3600)
+PAGE_CACHE_RELEASE = getattr(settings, 'PAGE_CACHE_RELEASE', '')
+PAGE_VERSION_LOCAL_TIMEOUT = getattr(settings, 'PAGE_VERSION_LOCAL_TIMEOUT', 30)
+
+MISSIONS = 'missions'
+USERS = 'users'
+GRADES = 'grades'
+COMPLETIONS = 'completions'
+SECTIONS = (MISSIONS, USERS, GRADES, COMPLETIONS)
+
+
+def digest(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class ContentVersions:
+    """
+    A ``(token, modified)`` pair per section of content, bumped whenever a
+    row behind it changes. Tokens go into cache keys and ETags; the times
+    are what Last-Modified reports.
+
+    A bump only reaches other processes through a shared cache. With a
+    per-process one, versions expire after ``PAGE_VERSION_LOCAL_TIMEOUT``
+    seconds instead, which bounds how stale another worker's pages get.
+    """
+
+    KEY = 'pages:version:{}'
+
+    def get(self, sections):
+        keys = [self.KEY.format(section) for section in sections]
+        found = cache.get_many(keys)
+        missing = [section for section, key in zip(sections, keys) if key not in found]
+        if missing:
+            found.update(self.bump(*missing))
+        return [found[key] for key in keys]
+
+    def bump(self, *sections):
+        # Random tokens, like the schedule's, so a flushed cache can't bring
+        # back a version some worker already cached pages under
+        now = time.time()
+        versions = {self.KEY.format(section): (uuid.uuid4().hex, now) for section in sections}
+        cache.set_many(versions, self.timeout())
+        return versions
+
+    def timeout(self):
+        return None if caches.is_shared() else PAGE_VERSION_LOCAL_TIMEOUT
+
+
+content_versions = ContentVersions()
+
+
+def cached_page(*sections, skip=None):
+    """
+    Serves GET requests for a page that depends only on ``sections`` (and
+    on the release) with ETag and Last-Modified headers, answering matching
+    conditional requests with a 304 before the view runs.
+
+    Anonymous visitors all see the same page, so the whole response is
+    cached for them. Signed-in ones get their own navbar, so templates
+    cache the rest as a fragment keyed by ``request.page_version``.
+    ``skip(request)`` opts requests out, e.g. ones showing the visitor's
+    own row.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.page_version = None
+            if request.method not in ('GET', 'HEAD') or (skip is not None and skip(request)):
+                return view(request, *args, **kwargs)
+
+            versions = content_versions.get(sections)
+            request.page_version = digest(PAGE_CACHE_RELEASE, [token for token, _ in versions])
+            modified = int(max([modified for _, modified in versions], default=0))
+            viewer = request.user.username if request.user.is_authenticated else ''
+            etag = quote_etag(digest(request.page_version, request.get_full_path(), viewer))
+
+            response = get_conditional_response(request, etag=etag, last_modified=modified or None)
+            if response is None and not viewer:
+                key = 'pages:page:{}'.format(digest(request.page_version, request.get_full_path()))
+                response = cache.get(key)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                    _store(request, response, key)
+            elif response is None:
+                response = view(request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if modified:
+                    response['Last-Modified'] = http_date(modified)
+                # Browsers revalidate every time; the 304 is what makes that cheap
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _store(request, response, key):
+    def store(response):
+        # Never share a page that carries a visitor's CSRF token
+        if response.status_code == 200 and not request.META.get('CSRF_COOKIE_USED'):
+            cache.set(key, response, PAGE_CACHE_TIMEOUT)
+
+    if getattr(response, 'is_rendered', True):
+        store(response)
+    else:
+        response.add_post_render_callback(store)
+
+
+def page_cache(request):
+    # Context processor for {% cache %} fragments outside cached_page()
+    return {'page_cache_timeout': PAGE_CACHE_TIMEOUT, 'page_cache_release': PAGE_CACHE_RELEASE}
+
+
+def dashboard_fragments(user, summary):
+    """
+    Cache keys for the dashboard's fragments. Each is the user plus the
+    values the fragment shows, so a fragment is only rendered again once
+    what it shows has changed.
+    """
+    (missions_version, _), = content_versions.get((MISSIONS,))
+    grade = summary.grade
+    return {
+        'profile': digest(PAGE_CACHE_RELEASE, user.pk, user.username, user.first_name, user.last_name, user.total_xp,
+                          user.health_percent()),
+        'stats': digest(PAGE_CACHE_RELEASE, user.pk, user.points, summary.user_rank, grade and grade.name,
+                        grade and grade.points, summary.grade_rank),
+        'missions': digest(PAGE_CACHE_RELEASE, user.pk, missions_version,
+                           [mission['id'] for mission in summary.missions],
+                           [mission['id'] for mission in summary.completed_missions]),
+    }
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import DenseRank, Rank
+
+
+RANK_CACHE_TIMEOUT = getattr(settings, 'RANK_CACHE_TIMEOUT', 30)
+
+
+def ranked(queryset, dense=False):
+    """
+    Annotates every row of ``queryset`` with ``ranking`` in a single query.
+
+    Competition ranks (1, 2, 2, 4) match ``User.rank()``; dense ranks
+    (1, 2, 2, 3) are available with ``dense=True``. The window is evaluated
+    before any slicing, so ``ranked(qs)[:10]`` still ranks against the
+    whole table.
+    """
+    expression = DenseRank() if dense else Rank()
+    return queryset.annotate(ranking=Window(
+        expression=expression, order_by=F('points').desc())).order_by('-points', 'pk')
+
+
+def rank_for_points(model, points):
+    aggregate = model.objects.filter(points__gt=points).aggregate(
+        ranking=Count('points'))
+    return aggregate['ranking'] + 1
+
+
+def cached_rank(instance):
+    # Rank only depends on points, so everyone on the same score shares an entry
+    model = instance._meta.model
+    key = 'rank:{}:{}'.format(model._meta.label_lower, instance.points)
+    ranking = cache.get(key)
+    if ranking is None:
+        ranking = rank_for_points(model, instance.points)
+        cache.set(key, ranking, RANK_CACHE_TIMEOUT)
+    return ranking
+
+
+def seek(queryset, after=None, size=10):
+    """
+    Returns up to ``size`` rows of ``queryset`` in leaderboard order that
+    come after the ``(points, pk)`` cursor ``after``. The cursor turns into
+    a range condition on the (-points, id) index, so deep pages cost the
+    same as the first one.
+    """
+    queryset = queryset.order_by('-points', 'pk')
+    if after is not None:
+        points, pk = after
+        queryset = queryset.filter(Q(points__lt=points) | Q(points=points, pk__gt=pk))
+    return annotate_ranks(list(queryset[:size]))
+
+
+def around(queryset, instance, size=5):
+    # Two index seeks outwards from the instance's own position
+    points, pk = instance.points, instance.pk
+    above = queryset.filter(Q(points__gt=points) | Q(points=points, pk__lt=pk)).order_by('points', '-pk')[:size]
+    below = queryset.filter(Q(points__lt=points) | Q(points=points, pk__gte=pk)).order_by('-points', 'pk')[:size + 1]
+    return annotate_ranks(list(reversed(list(above))) + list(below))
+
+
+def annotate_ranks(rows):
+    """
+    Sets ``ranking`` on a contiguous run of leaderboard rows with one count.
+
+    Only the first row needs counting against the table: every row scoring
+    between it and a later row is itself part of the run.
+    """
+    if not rows:
+        return rows
+
+    top = rows[0].points
+    counts = rows[0]._meta.model.objects.filter(points__gte=top).aggregate(
+        above=Count('pk', filter=Q(points__gt=top)), at_or_above=Count('pk'))
+
+    below_top = 0
+    for i, row in enumerate(rows):
+        if row.points == top:
+            row.ranking = counts['above'] + 1
+            continue
+        if row.points == rows[i - 1].points:
+            row.ranking = rows[i - 1].ranking
+        else:
+            row.ranking = counts['at_or_above'] + below_top + 1
+        below_top += 1
+    return rows
+
+
+def parse_cursor(value):
+    try:
+        points, pk = value.split('_')
+        return int(points), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_cursor(points, pk):
+    return '{}_{}'.format(points, pk)
@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from . import leaderboards, pages
+from .models import CompletedMission, Grade, LedgerEntry, Mission, ReconcileRun, User
+
+
+RECONCILE_BATCH_SIZE = 1000
+
+# stored and expected are tuples lined up with the table's totals
+Drift = namedtuple('Drift', 'pk stored expected')
+Result = namedtuple('Result', 'users grades last_completion_id')
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return {
+        'user': quote(User._meta.db_table),
+        'grade': quote(Grade._meta.db_table),
+        'completed': quote(CompletedMission._meta.db_table),
+        'mission': quote(Mission._meta.db_table),
+        'ledger': quote(LedgerEntry._meta.db_table),
+    }
+
+
+# What each completion paid: the ledger's copy of the mission's value at
+# claim time, or the current value while its ledger entry is still queued
+PAID = (
+    'LEFT JOIN {completed} c ON c.{owner} = o.id '
+    'LEFT JOIN {mission} m ON m.id = c.mission_id '
+    'LEFT JOIN {ledger} l ON l.user_id = c.user_id AND l.mission_id = c.mission_id '
+)
+
+
+def _drift(sql, pks, params=()):
+    if pks is not None:
+        sql = sql.replace('GROUP BY', 'WHERE o.id = ANY(%s) GROUP BY')
+        params = list(params) + [list(pks)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def user_drift(pks=None):
+    """
+    Users whose ``points`` or ``total_xp`` differ from what their completed
+    missions paid, found with one grouped aggregate. Later edits to a
+    mission's value don't reprice past claims. ``pks`` limits the check to
+    those users.
+    """
+    sql = (
+        'SELECT o.id, o.points, o.total_xp, '
+        'COALESCE(SUM(COALESCE(l.points, m.value)), 0), COALESCE(SUM(COALESCE(l.xp_points, m.xp_points)), 0) '
+        'FROM {user} o ' + PAID + 'GROUP BY o.id '
+        'HAVING o.points <> COALESCE(SUM(COALESCE(l.points, m.value)), 0) '
+        'OR o.total_xp <> COALESCE(SUM(COALESCE(l.xp_points, m.xp_points)), 0) ORDER BY o.id'
+    ).format(owner='user_id', **_tables())
+    return [Drift(pk, (points, total_xp), (expected_points, expected_xp))
+            for pk, points, total_xp, expected_points, expected_xp in _drift(sql, pks)]
+
+
+def grade_drift(pks=None):
+    # Grades are owed the missions their members completed while in them, as
+    # claims credit them, so moving a student doesn't move their points
+    sql = (
+        'SELECT o.id, o.points, COALESCE(SUM(COALESCE(l.points, m.value)), 0) '
+        'FROM {grade} o ' + PAID + 'GROUP BY o.id '
+        'HAVING o.points <> COALESCE(SUM(COALESCE(l.points, m.value)), 0) ORDER BY o.id'
+    ).format(owner='grade_id', **_tables())
+    return [Drift(pk, (points,), (expected_points,)) for pk, points, expected_points in _drift(sql, pks)]
+
+
+def _correct(model, fields, find, drifts, batch_size):
+    """
+    Writes the expected totals with ``bulk_update``, a batch per transaction.
+    Each batch locks its rows and checks them again first: a claim that was
+    in flight either committed before the lock, and is counted, or adds its
+    ``F()`` increment on top of the corrected value afterwards.
+    """
+    corrected = []
+    pks = [drift.pk for drift in drifts]
+    for start in range(0, len(pks), batch_size):
+        with transaction.atomic():
+            batch = list(model.objects.select_for_update().filter(
+                pk__in=pks[start:start + batch_size]).order_by('pk').values_list('pk', flat=True))
+            current = find(batch) if batch else []
+            model.objects.bulk_update(
+                [model(pk=drift.pk, **dict(zip(fields, drift.expected))) for drift in current], fields)
+        corrected.extend(current)
+    return corrected
+
+
+def reconcile(incremental=False, dry_run=False, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recomputes every user's points and XP and every grade's points from
+    what their ``CompletedMission`` rows paid and corrects the ones that
+    drifted. Returns the
+    drifts found, or corrected unless ``dry_run``.
+
+    ``incremental`` only checks users with claims since the last recorded
+    run, and their grades. It cannot see totals edited by hand, so a full
+    run is still worth scheduling now and then.
+    """
+    last_completion_id = CompletedMission.objects.aggregate(last=Max('pk'))['last'] or 0
+    user_pks = grade_pks = None
+    if incremental:
+        previous = ReconcileRun.objects.order_by('-pk').first()
+        if previous is not None:
+            claimed = CompletedMission.objects.filter(pk__gt=previous.last_completion_id,
+                                                      pk__lte=last_completion_id)
+            user_pks = set(claimed.values_list('user_id', flat=True))
+            grade_pks = set(claimed.filter(grade__isnull=False).values_list('grade_id', flat=True))
+
+    users = user_drift(user_pks) if user_pks is None or user_pks else []
+    grades = grade_drift(grade_pks) if grade_pks is None or grade_pks else []
+    if dry_run:
+        return Result(users, grades, last_completion_id)
+
+    users = _correct(User, ('points', 'total_xp'), user_drift, users, batch_size)
+    grades = _correct(Grade, ('points',), grade_drift, grades, batch_size)
+    ReconcileRun.objects.create(last_completion_id=last_completion_id, users_corrected=len(users),
+                                grades_corrected=len(grades))
+
+    # bulk_update sends no signals
+    if users:
+        leaderboards.user_leaderboard.invalidate()
+        pages.content_versions.bump(pages.USERS)
+    if grades:
+        leaderboards.grade_leaderboard.invalidate()
+        pages.content_versions.bump(pages.GRADES)
+    return Result(users, grades, last_completion_id)
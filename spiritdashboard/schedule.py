@@ -0,0 +1,107 @@
+import threading
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import caches
+from .models import Mission
+
+
+SCHEDULE_CACHE_TIMEOUT = getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 3600)
+SCHEDULE_LOCAL_TIMEOUT = getattr(settings, 'SCHEDULE_LOCAL_TIMEOUT', 60)
+MISSION_FIELDS = ('id', 'title', 'description', 'location', 'value', 'xp_points', 'start_time', 'end_time')
+
+Snapshot = namedtuple('Snapshot', ['version', 'missions', 'active', 'upcoming', 'valid_until'])
+
+
+def build_snapshot(version, now):
+    """
+    Reads every mission that hasn't ended, in start order, with one range
+    scan of ``mission_schedule_idx``, and works out when that answer next
+    changes: the first time one of them starts or ends.
+    """
+    # Plain rows rather than model instances keep the cached copy cheap to unpickle
+    missions = list(Mission.objects.filter(end_time__gte=now).order_by('start_time', 'pk').values(*MISSION_FIELDS))
+    active = [mission for mission in missions if mission['start_time'] <= now]
+    upcoming = [mission for mission in missions if mission['start_time'] > now]
+
+    # A mission is expired from the first instant after its end_time
+    boundaries = [mission['end_time'] + timedelta(microseconds=1) for mission in missions]
+    boundaries.extend(mission['start_time'] for mission in upcoming)
+    valid_until = min(boundaries) if boundaries else None
+
+    return Snapshot(version, missions, active, upcoming, valid_until)
+
+
+class MissionSchedule:
+    """
+    The missions every dashboard lists, shared until the next time a
+    mission starts or ends.
+
+    Like the key index, snapshots live in Django's cache under a version
+    token that ``Mission`` saves and deletes replace, and each worker keeps
+    a local copy; a snapshot past its ``valid_until`` is simply rebuilt.
+
+    A version bump made in another process only reaches this one through a
+    shared cache, so the local copy is dropped after ``local_timeout``
+    seconds and, with a per-process cache, that is also the longest a
+    snapshot is cached at all.
+    """
+
+    VERSION_KEY = 'schedule:version'
+
+    def __init__(self, timeout=SCHEDULE_CACHE_TIMEOUT, local_timeout=SCHEDULE_LOCAL_TIMEOUT):
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self._snapshot = None
+        self._expires = None
+        self._lock = threading.Lock()
+
+    def current(self, now=None):
+        now = now or timezone.now()
+        version = cache.get(self.VERSION_KEY)
+        snapshot = self._snapshot
+        if version is not None and self._fresh(snapshot, version, now) and now < self._expires:
+            return snapshot
+
+        with self._lock:
+            if version is None:
+                version = self.invalidate()
+            snapshot_key = 'schedule:missions:{}'.format(version)
+            snapshot = cache.get(snapshot_key)
+            if not self._fresh(snapshot, version, now):
+                snapshot = build_snapshot(version, now)
+                cache.set(snapshot_key, snapshot, self._timeout(snapshot, now))
+            self._snapshot = snapshot
+            self._expires = now + timedelta(seconds=self.local_timeout)
+            return snapshot
+
+    def version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            version = self.invalidate()
+        return version
+
+    def invalidate(self):
+        # A random token rather than a counter, so a cache flush can't hand
+        # out a version some worker already holds a stale snapshot for
+        version = uuid.uuid4().hex
+        cache.set(self.VERSION_KEY, version, None)
+        return version
+
+    def _fresh(self, snapshot, version, now):
+        return (snapshot is not None and snapshot.version == version
+                and (snapshot.valid_until is None or now < snapshot.valid_until))
+
+    def _timeout(self, snapshot, now):
+        timeout = self.timeout if caches.is_shared() else min(self.timeout, self.local_timeout)
+        if snapshot.valid_until is None:
+            return timeout
+        return max(1, min(timeout, int((snapshot.valid_until - now).total_seconds()) + 1))
+
+
+mission_schedule = MissionSchedule()
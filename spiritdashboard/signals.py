@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .avatars import avatar_cache
+from .keyindex import key_index
+from .leaderboards import grade_leaderboard, user_leaderboard
+from .models import CompletedMission, Grade, Mission, MissionKey, User
+from .pages import COMPLETIONS, GRADES, MISSIONS, USERS, content_versions
+from .schedule import mission_schedule
+from .summary import append_completed, remove_completed
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._original_username = instance.username
+
+
+@receiver(post_save, sender=User)
+def invalidate_avatar_on_rename(sender, instance, created, **kwargs):
+    original = getattr(instance, '_original_username', None)
+    if not created and original and original != instance.username:
+        avatar_cache.invalidate(original)
+    instance._original_username = instance.username
+
+
+@receiver(post_delete, sender=User)
+def invalidate_avatar_on_delete(sender, instance, **kwargs):
+    avatar_cache.invalidate(instance.username)
+
+
+def touches_points(update_fields):
+    # Logins save last_login only, which no leaderboard shows
+    return update_fields is None or 'points' in update_fields
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_leaderboard(sender, instance, update_fields=None, **kwargs):
+    if touches_points(update_fields):
+        user_leaderboard.invalidate()
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def invalidate_grade_leaderboard(sender, instance, update_fields=None, **kwargs):
+    if touches_points(update_fields):
+        grade_leaderboard.invalidate()
+
+
+@receiver(post_save, sender=MissionKey)
+@receiver(post_delete, sender=MissionKey)
+@receiver(post_save, sender=Mission)
+@receiver(post_delete, sender=Mission)
+def invalidate_key_index(sender, instance, **kwargs):
+    key_index.invalidate()
+    # Again once the change is visible, in case a worker rebuilt in between
+    transaction.on_commit(key_index.invalidate)
+
+
+@receiver(post_save, sender=Mission)
+@receiver(post_delete, sender=Mission)
+def invalidate_mission_schedule(sender, instance, **kwargs):
+    mission_schedule.invalidate()
+    transaction.on_commit(mission_schedule.invalidate)
+
+
+PAGE_SECTIONS = {
+    Mission: MISSIONS,
+    User: USERS,
+    Grade: GRADES,
+    CompletedMission: COMPLETIONS,
+}
+
+
+@receiver(post_save, sender=Mission)
+@receiver(post_delete, sender=Mission)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+@receiver(post_save, sender=CompletedMission)
+@receiver(post_delete, sender=CompletedMission)
+def bump_page_version(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    section = PAGE_SECTIONS[sender]
+    content_versions.bump(section)
+    transaction.on_commit(lambda: content_versions.bump(section))
+
+
+@receiver(post_save, sender=CompletedMission)
+def add_completed_mission_id(sender, instance, created, **kwargs):
+    # Claims write completions with bulk_create and update the array themselves
+    if created:
+        User.objects.filter(pk=instance.user_id).exclude(
+            completed_mission_ids__contains=[instance.mission_id]).update(
+            completed_mission_ids=append_completed(instance.mission_id))
+
+
+@receiver(post_delete, sender=CompletedMission)
+def remove_completed_mission_id(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.user_id).update(
+        completed_mission_ids=remove_completed(instance.mission_id))
@@ -0,0 +1,82 @@
+(function () {
+    var board = document.querySelector('[data-live-url]');
+    if (!board || !window.EventSource) {
+        return;
+    }
+
+    // Every client gets a reset at the same moment, so refetches are spread
+    // over this many milliseconds instead of all hitting the server at once
+    var REFRESH_JITTER = 10000;
+    var pending = null;
+
+    var source = new EventSource(board.getAttribute('data-live-url'));
+
+    source.addEventListener('reset', refresh);
+
+    source.addEventListener('rank', function (message) {
+        var diff = JSON.parse(message.data);
+        // Someone entered or left the board: only the server has their row
+        var reload = diff.removed.length > 0;
+
+        diff.changed.forEach(function (entry) {
+            var row = board.querySelector('[data-id="' + entry.id + '"]');
+            if (!row) {
+                reload = true;
+                return;
+            }
+            row.setAttribute('data-points', entry.points);
+            row.querySelector('.live-points').textContent = entry.points;
+            row.querySelector('.live-ranking').textContent = '#' + entry.ranking;
+        });
+
+        if (reload) {
+            refresh();
+            return;
+        }
+
+        var rows = Array.prototype.slice.call(board.querySelectorAll('[data-id]'));
+        rows.sort(function (a, b) {
+            var points = points_of(b) - points_of(a);
+            return points || Number(a.getAttribute('data-id')) - Number(b.getAttribute('data-id'));
+        });
+        Array.prototype.forEach.call(board.querySelectorAll('hr'), function (hr) {
+            hr.parentNode.removeChild(hr);
+        });
+        rows.forEach(function (row, i) {
+            if (i) {
+                board.appendChild(document.createElement('hr'));
+            }
+            board.appendChild(row);
+        });
+    });
+
+    function refresh() {
+        if (pending) {
+            return;
+        }
+        pending = window.setTimeout(function () {
+            if (!window.fetch || !window.DOMParser) {
+                window.location.reload();
+                return;
+            }
+            // Only the board is swapped in; the page is served with an ETag,
+            // so an unchanged board costs the server a 304
+            window.fetch(window.location.href, {credentials: 'same-origin'}).then(function (response) {
+                return response.ok ? response.text() : Promise.reject(response.status);
+            }).then(function (html) {
+                var fresh = new DOMParser().parseFromString(html, 'text/html').querySelector('[data-live-url]');
+                if (fresh) {
+                    board.innerHTML = fresh.innerHTML;
+                }
+            }).catch(function () {
+                // The next reset or rank event tries again
+            }).then(function () {
+                pending = null;
+            });
+        }, Math.random() * REFRESH_JITTER);
+    }
+
+    function points_of(row) {
+        return Number(row.getAttribute('data-points') || row.querySelector('.live-points').textContent);
+    }
+})();
@@ -0,0 +1,104 @@
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Func, IntegerField, Value
+
+from .models import CompletedMission, Mission, User
+from .ranking import cached_rank
+from .schedule import MISSION_FIELDS, mission_schedule
+
+
+SUMMARY_CACHE_TIMEOUT = getattr(settings, 'SUMMARY_CACHE_TIMEOUT', 3600)
+
+Summary = namedtuple('Summary', ['missions', 'completed_missions', 'grade', 'user_rank', 'grade_rank', 'progress'])
+
+
+class ArrayAppend(Func):
+    function = 'array_append'
+    output_field = ArrayField(IntegerField())
+
+
+class ArrayRemove(Func):
+    function = 'array_remove'
+    output_field = ArrayField(IntegerField())
+
+
+def append_completed(mission_id):
+    """
+    Expression for ``User.objects.update(completed_mission_ids=...)``, so a
+    claim records the mission in the same statement that pays its points.
+    """
+    return ArrayAppend(F('completed_mission_ids'), Value(mission_id))
+
+
+def remove_completed(mission_id):
+    return ArrayRemove(F('completed_mission_ids'), Value(mission_id))
+
+
+def summary_key(user, ids):
+    # Everything a claim changes is in the key, so claims never have to delete it
+    digest = hashlib.sha1(','.join(str(pk) for pk in sorted(ids)).encode('ascii')).hexdigest()
+    return 'summary:{}:{}:{}'.format(user.pk, digest, mission_schedule.version())
+
+
+def dashboard_summary(user, now=None):
+    """
+    Everything the dashboard shows about ``user``.
+
+    Open and upcoming missions come from the shared mission schedule, less
+    the user's denormalized ``completed_mission_ids``. Completed missions
+    that have since ended are the only per-user rows; they are read once
+    and cached under a key that changes with them. Ranks come from the
+    shared rank cache and level progress is computed from ``total_xp``, so
+    a warm summary costs only the query for the user's grade.
+    """
+    snapshot = mission_schedule.current(now)
+    completed_ids = set(user.completed_mission_ids)
+
+    missions, completed = [], []
+    for mission in snapshot.missions:
+        (completed if mission['id'] in completed_ids else missions).append(mission)
+
+    ended_ids = completed_ids.difference(mission['id'] for mission in snapshot.missions)
+    if ended_ids:
+        key = summary_key(user, ended_ids)
+        ended = cache.get(key)
+        if ended is None:
+            ended = list(Mission.objects.filter(pk__in=ended_ids).order_by('start_time', 'pk')
+                         .values(*MISSION_FIELDS))
+            cache.set(key, ended, SUMMARY_CACHE_TIMEOUT)
+        completed = ended + completed
+
+    grade = user.grade
+    return Summary(
+        missions=missions,
+        completed_missions=completed,
+        grade=grade,
+        user_rank=cached_rank(user),
+        grade_rank=cached_rank(grade) if grade else None,
+        progress=user.progress(),
+    )
+
+
+def rebuild_completed_ids(user_ids=None):
+    """
+    Recomputes ``User.completed_mission_ids`` from ``CompletedMission`` in
+    one statement, for every user or just ``user_ids``.
+    """
+    quote = connection.ops.quote_name
+    sql = (
+        'UPDATE {users} u SET completed_mission_ids = ARRAY('
+        'SELECT c.mission_id FROM {completed} c WHERE c.user_id = u.id ORDER BY c.id)'
+    ).format(users=quote(User._meta.db_table), completed=quote(CompletedMission._meta.db_table))
+    params = []
+    if user_ids is not None:
+        sql += ' WHERE u.id = ANY(%s)'
+        params.append(list(user_ids))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
@@ -0,0 +1,147 @@
+import random
+import string
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db.models import BigIntegerField, Max
+from django.db.models.functions import Cast, Substr
+from django.utils import timezone
+
+from . import leaderboards, ledger, pages
+from .keyindex import key_index
+from .claims import KEY_LENGTH
+from .models import CompletedMission, Grade, Mission, MissionKey, User
+from .schedule import mission_schedule
+
+
+DISTRIBUTIONS = ('uniform', 'normal', 'pareto')
+KEY_ALPHABET = string.ascii_letters + string.digits
+PARETO_ALPHA = 2.0
+
+
+def draw(rng, distribution, mean):
+    """
+    A non-negative sample with the given ``mean``. ``pareto`` gives the
+    long tail seen in real schools: most students complete a few missions
+    and a handful complete almost all of them.
+    """
+    if distribution == 'uniform':
+        value = rng.uniform(0, 2 * mean)
+    elif distribution == 'normal':
+        value = rng.gauss(mean, mean / 3)
+    elif distribution == 'pareto':
+        value = mean * (PARETO_ALPHA - 1) / PARETO_ALPHA * rng.paretovariate(PARETO_ALPHA)
+    else:
+        raise ValueError('Unknown distribution {!r}; expected one of {}.'.format(distribution, DISTRIBUTIONS))
+    return max(0, value)
+
+
+def next_student_number():
+    # One past the highest existing studentN, so reruns never reuse a
+    # username even after users were deleted or added by hand
+    numbers = User.objects.filter(username__regex=r'^student[0-9]+$').annotate(
+        number=Cast(Substr('username', len('student') + 1), BigIntegerField()))
+    highest = numbers.aggregate(Max('number'))['number__max']
+    return 0 if highest is None else highest + 1
+
+
+def generate_school(grades=6, users=1000, missions=100, keys_per_mission=5, completions=10,
+                    distribution='pareto', open_fraction=0.5, one_use_fraction=0.2,
+                    password='password', seed=None, batch_size=1000):
+    """
+    Fills the database with a synthetic school using ``bulk_create``.
+
+    ``completions`` is the mean number of missions each user has completed,
+    drawn from ``distribution``; the same distribution skews which missions
+    are popular. ``open_fraction`` of the missions are running now and the
+    rest are split between ended and upcoming. Points, XP, grade totals,
+    the ledger and every denormalized column are consistent with the
+    completions created. Returns the number of rows created per model.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    start = next_student_number()
+
+    grade_rows = Grade.objects.bulk_create(
+        Grade(name='Grade {}'.format(7 + i)) for i in range(grades))
+
+    mission_rows = []
+    for i in range(missions):
+        phase = rng.random()
+        if phase < open_fraction:
+            begins = now - timedelta(days=rng.uniform(0, 14))
+            ends = now + timedelta(days=rng.uniform(1, 14))
+        elif phase < open_fraction + (1 - open_fraction) / 2:
+            ends = now - timedelta(days=rng.uniform(0, 30))
+            begins = ends - timedelta(days=rng.uniform(1, 7))
+        else:
+            begins = now + timedelta(days=rng.uniform(0, 14))
+            ends = begins + timedelta(days=rng.uniform(1, 7))
+        mission_rows.append(Mission(
+            title='Mission {}'.format(i + 1), description='Synthetic mission.', location=rng.choice(
+                ['Gym', 'Library', 'Cafeteria', 'Field', 'Theatre']),
+            value=rng.randrange(10, 105, 5), xp_points=rng.randrange(5, 30, 5), start_time=begins, end_time=ends))
+    mission_rows = Mission.objects.bulk_create(mission_rows, batch_size=batch_size)
+
+    started = [mission for mission in mission_rows if mission.start_time <= now]
+    popularity = [draw(rng, distribution, 1) + 0.01 for _ in started]
+
+    hashed = make_password(password)
+    user_rows = []
+    completed = []
+    for i in range(users):
+        user = User(username='student{}'.format(start + i), password=hashed, first_name='Student',
+                    last_name=str(start + i), email='student{}@example.com'.format(start + i),
+                    grade=rng.choice(grade_rows) if grade_rows else None)
+        count = min(len(started), int(round(draw(rng, distribution, completions))))
+        chosen = set(rng.choices(started, popularity, k=count)) if count else set()
+        for mission in chosen:
+            user.points += mission.value
+            user.total_xp += mission.xp_points
+        user.completed_mission_ids = [mission.pk for mission in chosen]
+        user_rows.append(user)
+        completed.append(chosen)
+    user_rows = User.objects.bulk_create(user_rows, batch_size=batch_size)
+
+    grade_points = defaultdict(int)
+    completion_rows = []
+    for user, chosen in zip(user_rows, completed):
+        grade_points[user.grade_id] += user.points
+        for mission in chosen:
+            finished = min(mission.end_time, now)
+            completed_at = mission.start_time + (finished - mission.start_time) * rng.random()
+            completion_rows.append(CompletedMission(user=user, mission=mission, grade_id=user.grade_id,
+                                                    completed_at=completed_at))
+    CompletedMission.objects.bulk_create(completion_rows, batch_size=batch_size)
+
+    for grade in grade_rows:
+        Grade.objects.filter(pk=grade.pk).update(points=grade_points[grade.pk])
+
+    # Drawn from rng rather than secrets so a seed reproduces the same keys
+    seen = set(MissionKey.objects.values_list('key', flat=True))
+    key_rows = []
+    for mission in mission_rows:
+        for _ in range(keys_per_mission):
+            key = ''.join(rng.choice(KEY_ALPHABET) for _ in range(KEY_LENGTH))
+            while key in seen:
+                key = ''.join(rng.choice(KEY_ALPHABET) for _ in range(KEY_LENGTH))
+            seen.add(key)
+            key_rows.append(MissionKey(mission=mission, key=key, one_use=rng.random() < one_use_fraction))
+    MissionKey.objects.bulk_create(key_rows, batch_size=batch_size)
+
+    # bulk_create sends no signals, so everything they keep fresh is redone here
+    ledger.rebuild_rollups()
+    key_index.invalidate()
+    mission_schedule.invalidate()
+    leaderboards.user_leaderboard.invalidate()
+    leaderboards.grade_leaderboard.invalidate()
+    pages.content_versions.bump(*pages.SECTIONS)
+
+    return {
+        'grades': len(grade_rows),
+        'users': len(user_rows),
+        'missions': len(mission_rows),
+        'keys': len(key_rows),
+        'completions': len(completion_rows),
+    }
@@ -0,0 +1,124 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BackgroundTask
+
+
+logger = logging.getLogger(__name__)
+
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10
+TASK_BATCH_SIZE = 100
+
+
+def eager():
+    return getattr(settings, 'TASKS_EAGER', False)
+
+
+class Task:
+    """
+    A function that can also be run later by a worker. Tasks are stored by
+    dotted path, so arguments must be JSON serializable (pass ids, not
+    model instances).
+    """
+
+    def __init__(self, func, max_attempts=TASK_MAX_ATTEMPTS):
+        self.func = func
+        self.name = '{}.{}'.format(func.__module__, func.__qualname__)
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, key=None, delay=None, **kwargs):
+        enqueue(self, args, kwargs, key=key, delay=delay)
+
+
+def task(func=None, max_attempts=TASK_MAX_ATTEMPTS):
+    if func is None:
+        return lambda func: Task(func, max_attempts)
+    return Task(func, max_attempts)
+
+
+def enqueue(task, args=(), kwargs=None, key=None, delay=None):
+    """
+    Stores a run of ``task`` for a worker.
+
+    The row is written in the caller's transaction, so the task only
+    exists if the work that asked for it commits. A ``key`` makes the call
+    idempotent: while a task with that key is stored, enqueueing it again
+    does nothing. With ``TASKS_EAGER`` the task runs straight away instead.
+    """
+    kwargs = kwargs or {}
+    if eager():
+        task(*args, **kwargs)
+        return
+
+    run_at = timezone.now()
+    if delay is not None:
+        run_at += datetime.timedelta(seconds=delay)
+    BackgroundTask.objects.bulk_create([BackgroundTask(
+        name=task.name, arguments={'args': list(args), 'kwargs': kwargs}, idempotency_key=key,
+        max_attempts=task.max_attempts, run_at=run_at)], ignore_conflicts=True)
+
+
+def retry_delay(attempts):
+    # Exponential backoff: 10s, 20s, 40s...
+    return TASK_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def run_pending(limit=TASK_BATCH_SIZE):
+    """
+    Runs up to ``limit`` due tasks and returns how many ran.
+
+    Each task is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``, so
+    any number of workers can share the table, and runs in the transaction
+    that marks it done: its database writes commit together with that, or
+    not at all. A task that raises is retried with exponential backoff
+    until it has had ``max_attempts``, then left as failed.
+    """
+    ran = 0
+    while ran < limit:
+        with transaction.atomic():
+            task = BackgroundTask.objects.select_for_update(skip_locked=True).filter(
+                status=BackgroundTask.PENDING, run_at__lte=timezone.now()).order_by('run_at', 'pk').first()
+            if task is None:
+                break
+            _run(task)
+        ran += 1
+    return ran
+
+
+def _run(task):
+    task.attempts += 1
+    try:
+        with transaction.atomic():
+            func = import_string(task.name)
+            func(*task.arguments.get('args', ()), **task.arguments.get('kwargs', {}))
+    except Exception:
+        task.last_error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            task.status = BackgroundTask.FAILED
+            task.finished_at = timezone.now()
+            logger.error('Task %s (%s) failed for good', task.pk, task.name, exc_info=True)
+        else:
+            task.run_at = timezone.now() + datetime.timedelta(seconds=retry_delay(task.attempts))
+            logger.warning('Task %s (%s) failed, retrying', task.pk, task.name, exc_info=True)
+    else:
+        task.status = BackgroundTask.DONE
+        task.finished_at = timezone.now()
+    task.save(update_fields=['status', 'attempts', 'run_at', 'last_error', 'finished_at'])
+
+
+def purge(days):
+    # Done tasks are kept a while so their idempotency keys still hold
+    before = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = BackgroundTask.objects.filter(status=BackgroundTask.DONE, finished_at__lt=before).delete()
+    return deleted
@@ -1,10 +1,42 @@
+import asyncio
+import csv
+import datetime
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
 from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from PIL import PdfParser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import CompletedMission, Grade, Mission, MissionKey, User
+from . import (benchmarks, health, imports, keys, ledger, live, metrics, pages, ranking, reconcile, summary, synthetic,
+               tasks, urls, views)
+from .avatars import AvatarCache, avatar_cache, avatar_digest
+from .claims import ClaimError, KeyAlreadyUsed, claim, claim_batch
+from .keyindex import BloomFilter, KeyIndex, key_index
+from .leaderboards import Leaderboard, UserLeaderboard, grade_leaderboard, user_leaderboard
+from .models import (BackgroundTask, CompletedMission, Grade, GradePointsRollup, LedgerEntry, Mission, MissionKey,
+                     ReconcileRun, User, UserPointsRollup)
+from .ranking import cached_rank, ranked
+from .schedule import SCHEDULE_LOCAL_TIMEOUT, MissionSchedule
+from .throttling import client_ip, is_throttled
 
 
 class MissionKeyClaimTests(TestCase):
@@ -42,6 +74,16 @@ class MissionKeyClaimTests(TestCase):
         self.assertEqual(len(CompletedMission.objects.filter(
             mission=mission, user=self.user)), 1)
 
+    def test_completed_page_shows_the_claimed_mission(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        for title, value in (('Pep rally', 25), ('Food drive', 40)):
+            mission = Mission.objects.create(title=title, value=value, end_time=timezone.now() + timedelta(days=1))
+            response = self.client.get(reverse('spiritdashboard:claim_key', args=[
+                MissionKey.objects.create(mission=mission).key]), secure=True)
+            self.assertContains(response, 'You have completed the mission "{}"'.format(title))
+            self.assertContains(response, '<b>{} gems</b>'.format(value), html=False)
+
     def test_claim_future_mission_key(self):
         mission = Mission.objects.create(title='test_claim_future_mission_key', value=50, start_time=timezone.now(
         ) + timedelta(days=1), end_time=timezone.now() + timedelta(days=2))
@@ -150,6 +192,680 @@ class MissionKeyClaimTests(TestCase):
         self.assertEqual(self.grade.points - points_before, 50)
 
 
+class ClaimPipelineTests(TestCase):
+
+    def setUp(self):
+        self.grade = Grade.objects.create(name='grade')
+        self.user = User.objects.create_user('username', grade=self.grade)
+        self.mission = Mission.objects.create(
+            title='mission', value=50, xp_points=5, end_time=timezone.now() + timedelta(days=1))
+
+    @override_settings(TASKS_EAGER=False)
+    def test_claim_issues_constant_number_of_queries(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        key_index.might_contain(mission_key.key)
+        with CaptureQueriesContext(connection) as context:
+            claim(self.user, mission_key.key)
+
+        # Key lookup, completion insert, one update each for key, user (which
+        # also records the mission id) and grade, then the ledger task insert;
+        # savepoints only appear because the test itself is atomic
+        queries = [query['sql'] for query in context.captured_queries
+                   if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(queries), 6)
+
+    def test_claim_without_grade(self):
+        user = User.objects.create_user('gradeless')
+        mission_key = MissionKey.objects.create(mission=self.mission)
+
+        claim(user, mission_key.key)
+
+        user.refresh_from_db()
+        self.assertEqual(user.points, 50)
+        self.assertEqual(user.total_xp, 5)
+
+    def test_one_use_key_cannot_be_claimed_by_second_user(self):
+        mission_key = MissionKey.objects.create(mission=self.mission, one_use=True)
+        other = User.objects.create_user('other', grade=self.grade)
+
+        claim(self.user, mission_key.key)
+        with self.assertRaises(KeyAlreadyUsed):
+            claim(other, mission_key.key)
+
+        self.grade.refresh_from_db()
+        self.assertEqual(self.grade.points, 50)
+        self.assertFalse(CompletedMission.objects.filter(user=other).exists())
+
+    def test_second_claim_of_same_mission_changes_nothing(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        claim(self.user, mission_key.key)
+        with self.assertRaises(ClaimError):
+            claim(self.user, mission_key.key)
+
+        mission_key.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(mission_key.times_used, 1)
+        self.assertEqual(self.user.points, 50)
+
+    def test_unknown_key(self):
+        with self.assertRaises(ClaimError):
+            claim(self.user, 'x' * 10)
+
+
+class BatchClaimTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.grade = Grade.objects.create(name='grade')
+        self.users = [User.objects.create_user('Student{}'.format(i), grade=self.grade) for i in range(30)]
+        self.mission = Mission.objects.create(
+            title='assembly', value=50, xp_points=5, start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1))
+        self.mission_key = MissionKey.objects.create(mission=self.mission)
+        self.during = (now - timedelta(hours=1, minutes=30)).isoformat()
+        self.after = now.isoformat()
+
+    def item(self, i, user=None, key=None, scanned_at=None):
+        return {
+            'id': 'station-1-{}'.format(i),
+            'user': user or self.users[i].username,
+            'key': key or self.mission_key.key,
+            'scanned_at': scanned_at or self.during,
+        }
+
+    def test_scans_within_window_are_claimed_after_mission_ends(self):
+        results = claim_batch('station-1', [self.item(i) for i in range(3)])
+
+        self.assertEqual([result['status'] for result in results], ['claimed'] * 3)
+        self.grade.refresh_from_db()
+        self.mission_key.refresh_from_db()
+        self.assertEqual(self.grade.points, 150)
+        self.assertEqual(self.mission_key.times_used, 3)
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).total_xp, 5)
+        self.assertEqual(LedgerEntry.objects.count(), 3)
+        self.assertEqual(UserPointsRollup.objects.filter(user=self.users[0], period='day').get().points, 50)
+
+    def test_per_item_outcomes(self):
+        MissionKey.objects.create(mission=self.mission, key='b' * 10, one_use=True)
+        CompletedMission.objects.create(mission=self.mission, user=self.users[3])
+
+        results = claim_batch('station-1', [
+            self.item(0, scanned_at=self.after),
+            self.item(1, user='nobody'),
+            self.item(2, key='z' * 10),
+            self.item(3),
+            self.item(4, key='b' * 10),
+            self.item(5, key='b' * 10, scanned_at=(timezone.now() - timedelta(hours=1, minutes=45)).isoformat()),
+            self.item(6, scanned_at='yesterday'),
+            {'user': 'Student7'},
+            self.item(8, user='STUDENT8'),
+        ])
+
+        self.assertEqual([result['status'] for result in results], [
+            'outside_window', 'unknown_user', 'invalid_key', 'already_completed',
+            'key_used', 'claimed', 'invalid', 'invalid', 'claimed'])
+        self.assertEqual(CompletedMission.objects.filter(user=self.users[5]).count(), 1)
+
+    def test_retry_is_idempotent(self):
+        batch = [self.item(i) for i in range(5)]
+        first = claim_batch('station-1', batch)
+        second = claim_batch('station-1', batch)
+
+        self.assertEqual(first, second)
+        self.grade.refresh_from_db()
+        self.assertEqual(self.grade.points, 250)
+        self.assertEqual(LedgerEntry.objects.count(), 5)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        def count(items):
+            with CaptureQueriesContext(connection) as context:
+                claim_batch('station-1', items)
+            return len(context)
+
+        small = count([self.item(i) for i in range(2)])
+        large = count([self.item(i) for i in range(2, 30)])
+        self.assertEqual(small, large)
+
+    def test_endpoint_requires_staff(self):
+        self.client.force_login(self.users[0])
+        response = self.client.post(reverse('spiritdashboard:claim_batch'), '{"claims": []}',
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 403)
+
+    def test_endpoint(self):
+        staff = User.objects.create_user('station', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('spiritdashboard:claim_batch')
+
+        response = self.client.post(url, 'nope', content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, json.dumps({'claims': [self.item(0)]}),
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, json.dumps({'station': 'gym', 'claims': [self.item(0)]}),
+                                    content_type='application/json', secure=True)
+        self.assertEqual(response.json(), {'results': [{'id': 'station-1-0', 'status': 'claimed'}]})
+
+    def test_ids_are_scoped_to_their_station(self):
+        # Both stations number their scans from 1
+        gym = claim_batch('gym', [dict(self.item(0), id='1'), dict(self.item(1), id='2')])
+        library = claim_batch('library', [dict(self.item(2), id='1'), dict(self.item(3), id='2')])
+
+        self.assertEqual([result['status'] for result in gym + library], ['claimed'] * 4)
+        self.assertEqual(CompletedMission.objects.filter(mission=self.mission).count(), 4)
+        self.assertEqual(claim_batch('gym', [dict(self.item(4), id='1')]), [{'id': '1', 'status': 'claimed'}])
+        self.assertEqual(CompletedMission.objects.filter(mission=self.mission).count(), 4)
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+
+    THREADS = 40
+
+    def setUp(self):
+        self.grade = Grade.objects.create(name='grade')
+        self.mission = Mission.objects.create(
+            title='assembly', value=50, xp_points=5, end_time=timezone.now() + timedelta(days=1))
+        self.users = [User.objects.create_user('user{}'.format(i), grade=self.grade)
+                      for i in range(self.THREADS)]
+
+    def claim_concurrently(self, users, key):
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def worker(user):
+            barrier.wait()
+            try:
+                claim(user, key)
+                results.append(True)
+            except ClaimError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=[user]) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_burst_on_shared_key_keeps_totals_exact(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+
+        results = self.claim_concurrently(self.users, mission_key.key)
+
+        self.assertTrue(all(results))
+        self.grade.refresh_from_db()
+        mission_key.refresh_from_db()
+        self.assertEqual(self.grade.points, 50 * self.THREADS)
+        self.assertEqual(mission_key.times_used, self.THREADS)
+        self.assertEqual(CompletedMission.objects.count(), self.THREADS)
+        for user in User.objects.all():
+            self.assertEqual((user.points, user.total_xp), (50, 5))
+
+    def test_burst_on_one_use_key_pays_out_once(self):
+        mission_key = MissionKey.objects.create(mission=self.mission, one_use=True)
+
+        results = self.claim_concurrently(self.users, mission_key.key)
+
+        self.assertEqual(results.count(True), 1)
+        self.grade.refresh_from_db()
+        mission_key.refresh_from_db()
+        self.assertEqual(self.grade.points, 50)
+        self.assertEqual(mission_key.times_used, 1)
+        self.assertEqual(CompletedMission.objects.count(), 1)
+
+    def test_burst_leaves_cached_boards_matching_the_database(self):
+        cache.clear()
+        user_leaderboard.rebuild()
+        grade_leaderboard.rebuild()
+        mission_key = MissionKey.objects.create(mission=self.mission)
+
+        self.claim_concurrently(self.users, mission_key.key)
+
+        for board in (user_leaderboard, grade_leaderboard):
+            cached = cache.get(board.key)
+            # Contended writers may have dropped the board; if it's there it's right
+            if cached is not None:
+                self.assertEqual(cached, board.rebuild())
+
+    def test_burst_by_one_user_completes_mission_once(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        user = self.users[0]
+
+        results = self.claim_concurrently([user] * 10, mission_key.key)
+
+        self.assertEqual(results.count(True), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.points, 50)
+        self.assertEqual(CompletedMission.objects.count(), 1)
+
+
+class KeyGenerationTests(TestCase):
+
+    def setUp(self):
+        self.mission = Mission.objects.create(title='assembly', end_time=timezone.now() + timedelta(days=1))
+
+    def test_stored_batches_read_keys_back_in_order(self):
+        created = [mission_key for batch in keys.generate_keys(self.mission, 5) for mission_key in batch]
+        other = Mission.objects.create(title='other', end_time=timezone.now() + timedelta(days=1))
+        MissionKey.objects.create(mission=other)
+
+        batches = list(keys.stored_batches({self.mission.pk}, batch_size=2))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual([mission_key.key for batch in batches for mission_key in batch],
+                         [mission_key.key for mission_key in sorted(created, key=lambda mission_key: mission_key.pk)])
+
+    def test_generates_unique_keys_in_batches(self):
+        batches = list(keys.generate_keys(self.mission, 250, batch_size=100))
+
+        self.assertEqual([len(batch) for batch in batches], [100, 100, 50])
+        self.assertEqual(MissionKey.objects.filter(mission=self.mission, one_use=True).count(), 250)
+
+    def test_existing_keys_are_redrawn(self):
+        MissionKey.objects.create(mission=self.mission, key='a' * 10)
+        candidates = iter(['a' * 10, 'b' * 10, 'a' * 10, 'c' * 10])
+
+        with mock.patch('spiritdashboard.keys.generate_random_key', lambda: next(candidates)):
+            created, = keys.generate_keys(self.mission, 2)
+
+        self.assertEqual(sorted(key.key for key in created), ['b' * 10, 'c' * 10])
+
+    def test_command_streams_csv(self):
+        out = StringIO()
+        call_command('generate_keys', self.mission.pk, 5, stdout=out)
+
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ['mission', 'key', 'one_use', 'url'])
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(rows[1][3].endswith(reverse('spiritdashboard:claim_key', args=[rows[1][1]])))
+
+    def test_command_writes_multi_page_pdf(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'keys.pdf')
+
+        call_command('generate_keys', self.mission.pk, 13, format='pdf', output=path,
+                     stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(len(PdfParser.PdfParser(path).pages), 2)
+
+    def test_admin_action_downloads_csv(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.post(reverse('admin:spiritdashboard_mission_changelist'), {
+            'action': 'generate_keys', '_selected_action': [self.mission.pk], 'apply': 'Generate',
+            'count': 3, 'one_use': 'on',
+        }, secure=True)
+
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(sorted(row[1] for row in rows[1:]), sorted(MissionKey.objects.values_list('key', flat=True)))
+        self.assertEqual(MissionKey.objects.filter(mission=self.mission).count(), 3)
+
+
+MISSION_CSV = """title,description,location,value,xp_points,start_time,end_time,keys
+Spirit Day,Wear school colours.,Gym,50,10,2019-05-01T08:00:00,2019-05-01T15:00:00,
+Food Drive,Bring a can.,Cafeteria,30,,2019-05-02 08:00,2019-05-09 15:00,2
+"""
+
+
+class MissionImportTests(TestCase):
+
+    def rows(self, text, fmt='csv'):
+        return imports.read_rows(StringIO(text), fmt)
+
+    def test_creates_missions_and_keys(self):
+        result = imports.import_missions(self.rows(MISSION_CSV), keys_per_mission=3, batch_size=1)
+
+        self.assertEqual((result.created, result.updated, result.keys), (2, 0, 5))
+        spirit = Mission.objects.get(title='Spirit Day')
+        self.assertEqual((spirit.value, spirit.xp_points, spirit.location), (50, 10, 'Gym'))
+        self.assertEqual(spirit.start_time, timezone.make_aware(datetime.datetime(2019, 5, 1, 8)))
+        food = Mission.objects.get(title='Food Drive')
+        self.assertEqual(food.xp_points, Mission._meta.get_field('xp_points').default)
+        self.assertEqual(MissionKey.objects.filter(mission=spirit).count(), 3)
+        self.assertEqual(MissionKey.objects.filter(mission=food, one_use=True).count(), 2)
+
+    def test_upserts_on_title_and_start_time(self):
+        imports.import_missions(self.rows(MISSION_CSV), keys_per_mission=1)
+        changed = MISSION_CSV.replace('Gym,50', 'Field,55').replace('2019-05-02 08:00,2019-05-09', '2019-06-02 08:00,2019-06-09')
+
+        # One lookup, insert and update per batch, plus one batch of keys (savepoints included)
+        with self.assertNumQueries(9):
+            result = imports.import_missions(self.rows(changed), keys_per_mission=1)
+
+        # The moved food drive is a new mission; the spirit day is updated in place
+        self.assertEqual((result.created, result.updated, result.unchanged, result.keys), (1, 1, 0, 2))
+        self.assertEqual(Mission.objects.get(title='Spirit Day').location, 'Field')
+        self.assertEqual(Mission.objects.filter(title='Food Drive').count(), 2)
+        self.assertEqual(MissionKey.objects.filter(mission__title='Spirit Day').count(), 1)
+
+        result = imports.import_missions(self.rows(changed))
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 2))
+
+    def test_concurrent_import_does_not_duplicate(self):
+        insert_missions = imports._insert_missions
+
+        def racing_import(rows):
+            # Another import commits the spirit day between our lookup and our insert
+            Mission.objects.create(title='Spirit Day', description='Theirs', location='Gym', value=50,
+                                   start_time=timezone.make_aware(datetime.datetime(2019, 5, 1, 8)),
+                                   end_time=timezone.make_aware(datetime.datetime(2019, 5, 1, 15)))
+            return insert_missions(rows)
+
+        with mock.patch('spiritdashboard.imports._insert_missions', racing_import):
+            result = imports.import_missions(self.rows(MISSION_CSV), keys_per_mission=1)
+
+        self.assertEqual((result.created, result.updated, result.keys), (1, 1, 2))
+        spirit = Mission.objects.get(title='Spirit Day')
+        self.assertNotEqual(spirit.description, 'Theirs')
+        self.assertFalse(MissionKey.objects.filter(mission=spirit).exists())
+
+    def test_streams_json_arrays_and_lines(self):
+        missions = [{'title': 'Mission {}'.format(i), 'description': 'd' * 50, 'location': 'Gym', 'value': i,
+                     'start_time': '2019-05-01T08:00:00-07:00', 'end_time': '2019-05-02T08:00:00-07:00'}
+                    for i in range(200)]
+        with mock.patch('spiritdashboard.imports.JSON_CHUNK_SIZE', 100):
+            self.assertEqual([row for _, row in self.rows(json.dumps(missions, indent=2), 'json')], missions)
+            lines = '\n'.join(json.dumps(mission) for mission in missions)
+            self.assertEqual([row for _, row in self.rows(lines, 'json')], missions)
+
+        result = imports.import_missions(self.rows(json.dumps(missions), 'json'), batch_size=64)
+        self.assertEqual(result.created, 200)
+        self.assertEqual(Mission.objects.get(title='Mission 7').end_time.isoformat(), '2019-05-02T15:00:00+00:00')
+
+    def test_invalid_rows_import_nothing(self):
+        text = MISSION_CSV + 'Broken,,Gym,lots,,2019-05-03 08:00,2019-05-01 08:00,\n'
+        with self.assertRaises(imports.InvalidRows) as raised:
+            imports.import_missions(self.rows(text), batch_size=1)
+
+        self.assertEqual(raised.exception.count, 1)
+        line, errors = raised.exception.errors[0]
+        self.assertEqual(line, 4)
+        self.assertEqual(set(errors), {'description', 'value', '__all__'})
+        self.assertFalse(Mission.objects.exists())
+
+        with self.assertRaises(imports.InvalidRows) as raised:
+            imports.import_missions(self.rows('[1, {"title": "x"}]', 'json'))
+        self.assertEqual(raised.exception.count, 2)
+
+    def test_import_invalidates_the_schedule(self):
+        now = timezone.now()
+        MissionSchedule().current(now)
+        text = 'title,description,location,value,start_time,end_time\nNow,d,Gym,5,{},{}\n'.format(
+            (now - timedelta(hours=1)).isoformat(), (now + timedelta(hours=1)).isoformat())
+        imports.import_missions(self.rows(text))
+        self.assertEqual([mission['title'] for mission in MissionSchedule().current(now).active], ['Now'])
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'missions.csv')
+        output = os.path.join(directory, 'keys.csv')
+        with open(source, 'w') as f:
+            f.write(MISSION_CSV)
+
+        out = StringIO()
+        call_command('import_missions', source, keys=1, keys_output=output, stdout=out)
+        self.assertIn('Created 2 missions', out.getvalue())
+        with open(output) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], keys.CSV_HEADER)
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ['Food Drive', 'Food Drive', 'Spirit Day'])
+
+        with open(source, 'a') as f:
+            f.write('Broken,d,Gym,1,,nope,2019-05-01 08:00,\n')
+        with self.assertRaisesMessage(CommandError, 'Line 4: start_time: Enter a valid date/time.'):
+            call_command('import_missions', source, stdout=StringIO())
+
+    def test_admin_upload(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        url = reverse('admin:spiritdashboard_mission_import')
+        self.assertContains(self.client.get(reverse('admin:spiritdashboard_mission_changelist'), secure=True), url)
+
+        upload = SimpleUploadedFile('missions.csv', MISSION_CSV.encode())
+        response = self.client.post(url, {'file': upload, 'keys': 1, 'one_use': 'on'}, secure=True)
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 4)
+
+        upload = SimpleUploadedFile('missions.json', b'[{"title": "x"}]')
+        response = self.client.post(url, {'file': upload, 'keys': 0}, secure=True)
+        self.assertContains(response, '1 invalid row;')
+        self.assertEqual(Mission.objects.count(), 2)
+
+
+ROSTER_CSV = """username,first_name,last_name,email,grade,password
+,Alice,Smith,alice.smith@example.com,grade 9,
+bob,Bob,Jones,bob@example.com,Grade 10,correct horse
+carol,Carol,Lee,carol@example.com,,
+,Dan,Brown,not-an-email,Grade 9,
+erin,Erin,Wu,erin@example.com,Grade 12,
+BOB,Robert,Jones,robert@example.com,Grade 9,
+"""
+
+
+class RosterImportTests(TestCase):
+
+    def setUp(self):
+        self.grade9 = Grade.objects.create(name='Grade 9')
+        self.grade10 = Grade.objects.create(name='Grade 10')
+
+    def rows(self, text=ROSTER_CSV):
+        return imports.read_rows(StringIO(text), 'csv')
+
+    def test_creates_users_in_batches(self):
+        out = StringIO()
+        calls = []
+        with self.assertNumQueries(1):
+            grades = imports.GradeLookup()
+        self.assertEqual(grades('GRADE 9 '), self.grade9.pk)
+
+        result = imports.import_roster(self.rows(), credentials=csv.writer(out), workers=1, batch_size=2,
+                                       progress=lambda *counts: calls.append(counts))
+
+        self.assertEqual((result.created, result.skipped), (3, 1))
+        self.assertEqual([line for line, _ in result.errors], [5, 6])
+        self.assertEqual(calls, [(2, 2, 0), (4, 3, 0), (6, 3, 1)])
+
+        alice = User.objects.get(username='alice.smith')
+        self.assertEqual((alice.first_name, alice.grade), ('Alice', self.grade9))
+        self.assertIsNone(User.objects.get(username='carol').grade)
+        self.assertTrue(User.objects.get(username='bob').check_password('correct horse'))
+
+        credentials = {row[0]: row[1] for row in csv.reader(StringIO(out.getvalue()))}
+        self.assertEqual(set(credentials), {'alice.smith', 'bob', 'carol'})
+        self.assertTrue(alice.check_password(credentials['alice.smith']))
+        self.assertEqual(len(credentials['carol']), 12)
+
+    def test_existing_users_are_skipped(self):
+        User.objects.create_user('Carol', password='password')
+        result = imports.import_roster(self.rows(), workers=1, create_grades=True)
+
+        self.assertEqual((result.created, result.skipped), (3, 2))
+        self.assertEqual(Grade.objects.get(name='Grade 12').user_set.get().username, 'erin')
+        self.assertTrue(User.objects.get(username='Carol').check_password('password'))
+
+    def test_hashes_in_a_process_pool(self):
+        result = imports.import_roster(self.rows(), workers=2, create_grades=True)
+        self.assertEqual(result.created, 4)
+        self.assertTrue(User.objects.get(username='bob').check_password('correct horse'))
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'roster.csv')
+        output = os.path.join(directory, 'credentials.csv')
+        with open(source, 'w') as f:
+            f.write(ROSTER_CSV)
+
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, '2 rows were not imported.'):
+            call_command('import_roster', source, credentials=output, workers=1, stdout=StringIO(), stderr=err)
+        self.assertIn('Line 5: email: Enter a valid email address.', err.getvalue())
+        self.assertIn("Line 6: grade: No grade named 'Grade 12'.", err.getvalue())
+
+        self.assertEqual(os.stat(output).st_mode & 0o777, 0o600)
+        with open(output) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], imports.CREDENTIALS_HEADER)
+        self.assertEqual(len(rows), 4)
+
+
+@skipUnless(os.environ.get('SPIRIT_BENCHMARKS'), 'set SPIRIT_BENCHMARKS=1 to run benchmarks')
+class MissionImportBenchmark(TestCase):
+    MISSIONS = 10000
+    KEYS_PER_MISSION = 5
+
+    def test_import(self):
+        start = timezone.now()
+        f = StringIO()
+        writer = csv.writer(f)
+        writer.writerow(['title', 'description', 'location', 'value', 'xp_points', 'start_time', 'end_time'])
+        for i in range(self.MISSIONS):
+            begins = start + timedelta(hours=i)
+            writer.writerow(['Mission {}'.format(i), 'Synthetic mission.', 'Gym', 10 + i % 90, 5,
+                             begins.isoformat(), (begins + timedelta(days=1)).isoformat()])
+        text = f.getvalue()
+
+        def run(**options):
+            began = time.perf_counter()
+            result = imports.import_missions(imports.read_rows(StringIO(text), 'csv'), **options)
+            return result, time.perf_counter() - began
+
+        created, fresh = run(keys_per_mission=self.KEYS_PER_MISSION)
+        unchanged, again = run()
+        text = text.replace('Synthetic mission.', 'Updated mission.')
+        updated, changed = run()
+
+        print('\nimport {} missions: create + {} keys each {:.2f}s, unchanged {:.2f}s, update {:.2f}s'.format(
+            self.MISSIONS, self.KEYS_PER_MISSION, fresh, again, changed))
+        self.assertEqual((created.created, created.keys), (self.MISSIONS, self.MISSIONS * self.KEYS_PER_MISSION))
+        self.assertEqual(unchanged.unchanged, self.MISSIONS)
+        self.assertEqual(updated.updated, self.MISSIONS)
+
+
+class KeyIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.mission = Mission.objects.create(title='mission', end_time=timezone.now() + timedelta(days=1))
+        self.mission_key = MissionKey.objects.create(mission=self.mission)
+        self.index = KeyIndex(enabled=True)
+
+    def test_unknown_key_is_rejected_without_queries(self):
+        self.index.might_contain(self.mission_key.key)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.index.might_contain(self.mission_key.key))
+            self.assertFalse(self.index.might_contain('x' * 10))
+
+    def test_index_is_shared_through_cache(self):
+        self.index.might_contain(self.mission_key.key)
+        with self.assertNumQueries(0):
+            self.assertTrue(KeyIndex(enabled=True).might_contain(self.mission_key.key))
+
+    def test_saved_and_deleted_keys_update_index(self):
+        self.index.might_contain('x' * 10)
+        new_key = MissionKey.objects.create(mission=self.mission)
+        self.assertTrue(self.index.might_contain(new_key.key))
+
+        new_key.delete()
+        self.assertFalse(self.index.might_contain(new_key.key))
+
+    def test_bulk_generated_keys_are_indexed(self):
+        self.index.might_contain('x' * 10)
+        batch, = keys.generate_keys(self.mission, 5)
+        self.assertTrue(all(self.index.might_contain(mission_key.key) for mission_key in batch))
+
+    def test_expired_missions_are_left_out(self):
+        self.mission.end_time = timezone.now() - timedelta(days=1)
+        self.mission.save()
+        self.assertFalse(self.index.might_contain(self.mission_key.key))
+
+    def test_local_cache_turns_the_filter_off(self):
+        # Keys another process creates would never reach this process's copy
+        index = KeyIndex()
+        with self.settings(KEY_INDEX_ENABLED=True):
+            index.might_contain(self.mission_key.key)
+            MissionKey.objects.bulk_create([MissionKey(mission=self.mission, key='y' * 10)])
+            self.assertFalse(index.might_contain('y' * 10))
+        with self.assertNumQueries(0):
+            self.assertTrue(index.might_contain('y' * 10))
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache'}}):
+            self.assertTrue(index.is_enabled())
+
+    def test_bloom_filter_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('key{}'.format(i))
+        self.assertTrue(all('key{}'.format(i) in bloom for i in range(1000)))
+        false_positives = sum('other{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class ClaimThrottlingTests(TestCase):
+
+    RATES = {'user': (3, 60)}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_limit_within_window(self):
+        results = [is_throttled('user', 1, self.RATES, now=600 + i) for i in range(4)]
+        self.assertEqual(results, [False, False, False, True])
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for i in range(3):
+            is_throttled('user', 1, self.RATES, now=600 + i)
+        # Halfway into the next window the three earlier attempts count as 1.5
+        self.assertFalse(is_throttled('user', 1, self.RATES, now=690))
+        self.assertTrue(is_throttled('user', 1, self.RATES, now=691))
+
+    def test_clients_are_counted_separately(self):
+        for i in range(3):
+            is_throttled('user', 1, self.RATES, now=600)
+        self.assertFalse(is_throttled('user', 2, self.RATES, now=600))
+
+    def test_client_ip_uses_last_forwarded_address(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_ip(request), '2.2.2.2')
+
+    def test_claim_view_answers_429_when_throttled(self):
+        User.objects.create_user('username', password='password')
+        self.client.login(username='username', password='password')
+        url = reverse('spiritdashboard:claim_key', args=['x' * 10])
+
+        with mock.patch('spiritdashboard.throttling.CLAIM_THROTTLE_RATES', {'user': (2, 60), 'failed_ip': (100, 60)}):
+            statuses = [self.client.get(url, secure=True).status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [400, 400, 429])
+
+    def test_assembly_behind_one_address_is_not_throttled(self):
+        mission = Mission.objects.create(title='Assembly', end_time=timezone.now() + timedelta(hours=1))
+        url = reverse('spiritdashboard:claim_key', args=[MissionKey.objects.create(mission=mission).key])
+        statuses = []
+        with mock.patch('spiritdashboard.throttling.CLAIM_THROTTLE_RATES', {'user': (2, 60), 'failed_ip': (3, 60)}):
+            for i in range(10):
+                self.client.force_login(User.objects.create_user('student{}'.format(i)))
+                statuses.append(self.client.get(url, secure=True, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code)
+        self.assertEqual(statuses, [200] * 10)
+
+    def test_failed_claims_are_limited_per_address(self):
+        url = reverse('spiritdashboard:claim_key', args=['x' * 10])
+        statuses = []
+        with mock.patch('spiritdashboard.throttling.CLAIM_THROTTLE_RATES', {'user': (2, 60), 'failed_ip': (3, 60)}):
+            for i in range(5):
+                self.client.force_login(User.objects.create_user('student{}'.format(i)))
+                statuses.append(self.client.get(url, secure=True, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code)
+            self.assertEqual(self.client.get(url, secure=True, HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 400)
+        self.assertEqual(statuses, [400, 400, 400, 429, 429])
+
+
 class LeaderboardTests(TestCase):
 
     def test_user_ranking(self):
@@ -180,45 +896,2051 @@ class LeaderboardTests(TestCase):
         self.assertEqual(grade4.rank(), 4)
 
 
-class ProgressionTests(TestCase):
+class RankingTests(TestCase):
 
-    USERNAME = 'username'
-    PASSWORD = 'password'
+    def setUp(self):
+        cache.clear()
+
+    def create_users(self, count, start=0):
+        grade = Grade.objects.create(name='grade{}'.format(start))
+        for i in range(start, start + count):
+            User.objects.create_user(username='user{}'.format(i), points=i % 7 * 10, grade=grade)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_competition_and_dense_ranks(self):
+        for username, points in [('a', 100), ('b', 75), ('c', 75), ('d', 50)]:
+            User.objects.create_user(username=username, points=points)
+
+        competition = [user.ranking for user in ranked(User.objects.all())]
+        dense = [user.ranking for user in ranked(User.objects.all(), dense=True)]
+
+        self.assertEqual(competition, [1, 2, 2, 4])
+        self.assertEqual(dense, [1, 2, 2, 3])
+
+    def test_ranked_slice_matches_rank_method(self):
+        self.create_users(30)
+        for user in ranked(User.objects.all())[:10]:
+            self.assertEqual(user.ranking, user.rank())
+
+    def test_cached_rank_is_shared_by_equal_points(self):
+        user1 = User.objects.create_user(username='user1', points=100)
+        user2 = User.objects.create_user(username='user2', points=100)
+        self.assertEqual(cached_rank(user1), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_rank(user2), 1)
+
+    def test_user_leaderboard_query_count_is_constant(self):
+        url = reverse('spiritdashboard:user_leaderboard')
+        self.create_users(3)
+        small = self.count_queries(url)
+        self.create_users(20, start=3)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_grade_leaderboard_query_count_is_constant(self):
+        url = reverse('spiritdashboard:grade_leaderboard')
+        self.create_users(1)
+        small = self.count_queries(url)
+        for i in range(1, 12):
+            self.create_users(1, start=i)
+        self.assertEqual(self.count_queries(url), small)
+
+
+class IndexUsageTests(TestCase):
+    """
+    Runs EXPLAIN on each hot query and checks that the planner can answer it
+    from an index. Sequential scans are disabled for the transaction because
+    on a table this small PostgreSQL would rightly prefer one.
+    """
 
     def setUp(self):
-        self.grade = Grade(name='grade')
-        self.grade.save()
-        self.user = User.objects.create_user(
-            self.USERNAME, password=self.PASSWORD, grade=self.grade)
+        self.grade = Grade.objects.create(name='grade')
+        self.user = User.objects.create_user('UserName', grade=self.grade)
+        self.mission = Mission.objects.create(
+            title='mission', end_time=timezone.now() + timedelta(days=1))
+        self.mission_key = MissionKey.objects.create(mission=self.mission)
+        CompletedMission.objects.create(mission=self.mission, user=self.user)
 
-    def test_xp_for_level(self):
-        self.assertEqual(User.xp_for_level(1), 0)
-        self.assertEqual(User.xp_for_level(2), 5)
-        self.assertEqual(User.xp_for_level(3), 10)
-        self.assertEqual(User.xp_for_level(4), 15)
-        self.assertEqual(User.xp_for_level(5), 20)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
 
-    def test_total_xp_for_level(self):
-        self.assertEqual(User.total_xp_for_level(1), 0)
-        self.assertEqual(User.total_xp_for_level(2), 5)
-        self.assertEqual(User.total_xp_for_level(3), 15)
-        self.assertEqual(User.total_xp_for_level(4), 30)
-        self.assertEqual(User.total_xp_for_level(5), 50)
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, plan)
+        self.assertIn('Index', plan, plan)
+        if index is not None:
+            self.assertIn(index, plan, plan)
 
-    def test_level_when_xp_is_zero(self):
-        self.user.total_xp = 0
+    def test_mission_key_by_key(self):
+        self.assertUsesIndex(MissionKey.objects.filter(key=self.mission_key.key))
+
+    def test_completed_mission_by_user_and_mission(self):
+        self.assertUsesIndex(CompletedMission.objects.filter(user=self.user, mission=self.mission))
+
+    def test_completed_missions_of_user(self):
+        self.assertUsesIndex(CompletedMission.objects.filter(user=self.user))
+
+    def test_active_missions(self):
+        self.assertUsesIndex(Mission.objects.filter(
+            end_time__gte=timezone.now()).order_by('start_time'), 'mission_schedule_idx')
+
+    def test_user_leaderboard(self):
+        self.assertUsesIndex(ranked(User.objects.all())[:10], 'user_points_idx')
+
+    def test_grade_leaderboard(self):
+        self.assertUsesIndex(ranked(Grade.objects.all())[:10], 'grade_points_idx')
+
+    def test_user_leaderboard_seek(self):
+        self.assertUsesIndex(User.objects.filter(
+            Q(points__lt=10) | Q(points=10, pk__gt=5)).order_by('-points', 'pk')[:10], 'user_points_idx')
+
+    def test_username_case_insensitive_lookup(self):
+        self.assertUsesIndex(User.objects.filter(username__iexact='username'), 'user_username_upper_idx')
+
+
+class LeaderboardCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.grades = [Grade.objects.create(name='grade{}'.format(i), points=i * 100) for i in range(3)]
+        self.users = [User.objects.create_user('user{}'.format(i), points=i * 10, grade=self.grades[i % 3])
+                      for i in range(15)]
+        self.mission = Mission.objects.create(
+            title='mission', value=25, end_time=timezone.now() + timedelta(days=1))
+        self.board = UserLeaderboard('test-users', size=5)
+
+    def claim(self, user):
+        claim(user, MissionKey.objects.create(mission=self.mission).key)
+
+    def test_base_board_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Leaderboard('base')
+
+    def test_cached_board_is_read_without_queries(self):
+        entries = user_leaderboard.entries()
+        with self.assertNumQueries(0):
+            self.assertEqual(user_leaderboard.entries(), entries)
+
+    def test_rebuild_stores_ranked_top_n(self):
+        entries = self.board.rebuild()
+        self.assertEqual([entry['points'] for entry in entries], [140, 130, 120, 110, 100])
+        self.assertEqual([entry['ranking'] for entry in entries], [1, 2, 3, 4, 5])
+        self.assertEqual(entries[0]['grade'], {'name': 'grade2'})
+
+    def test_claim_updates_entry_in_place(self):
+        user_leaderboard.rebuild()
+        user = User.objects.get(username='user13')
+
+        self.claim(user)
+
+        with self.assertNumQueries(0):
+            entries = user_leaderboard.entries()
+        self.assertEqual(entries[0]['id'], user.pk)
+        self.assertEqual(entries[0]['points'], 155)
+        self.assertEqual(entries[1]['ranking'], 2)
+
+    def test_record_moves_new_player_onto_board(self):
+        self.board.rebuild()
+        user = self.users[0]
+        User.objects.filter(pk=user.pk).update(points=135)
+
+        self.board.record(user.pk, 135)
+
+        entries = cache.get(self.board.key)
+        self.assertEqual([entry['points'] for entry in entries], [140, 135, 130, 120, 110])
+        self.assertEqual(entries[1]['id'], user.pk)
+
+    def test_record_ignores_player_below_board_without_queries(self):
+        self.board.rebuild()
+        with self.assertNumQueries(0):
+            self.board.record(self.users[0].pk, 5)
+        self.assertEqual(len(cache.get(self.board.key)), 5)
+
+    def test_record_sets_the_committed_total(self):
+        self.board.rebuild()
+        top = self.users[14]
+
+        self.board.record(top.pk, 160)
+        # A claim recorded late, or after a rebuild that already counted it
+        self.board.record(top.pk, 150)
+
+        self.assertEqual(cache.get(self.board.key)[0]['points'], 160)
+
+    def test_contended_record_makes_the_holder_drop_its_list(self):
+        self.board.rebuild()
+        lock = self.board.key + ':lock'
+        cache.add(lock, True)
+        self.assertEqual(self.board.record(self.users[13].pk, 200), {'reset': True})
+
+        # The holder stores a list without that total, then notices
+        cache.delete(lock)
+        self.board.rebuild()
+        self.assertEqual(self.board.record(self.users[14].pk, 150), {'reset': True})
+        self.assertIsNone(cache.get(self.board.key))
+
+    def test_ties_share_a_rank(self):
+        entries = self.board.rerank([
+            {'id': 1, 'points': 50}, {'id': 2, 'points': 70}, {'id': 3, 'points': 50}])
+        self.assertEqual([entry['ranking'] for entry in entries], [1, 2, 2])
+
+    def test_claim_updates_grade_board(self):
+        grade_leaderboard.rebuild()
+        user = self.users[0]
+
+        self.claim(user)
+
+        entry = next(entry for entry in grade_leaderboard.entries() if entry['id'] == user.grade_id)
+        self.assertEqual(entry['points'], 25)
+
+    def test_admin_edit_invalidates_board(self):
+        user_leaderboard.rebuild()
+        user = self.users[0]
+        user.points = 1000
+        user.save()
+        self.assertEqual(user_leaderboard.entries()[0]['id'], user.pk)
+
+    def test_login_does_not_invalidate_board(self):
+        user_leaderboard.rebuild()
+        user = self.users[0]
+        user.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(user_leaderboard.key))
+
+    def test_rebuild_command(self):
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        self.assertIsNotNone(cache.get(user_leaderboard.key))
+        self.assertIsNotNone(cache.get(grade_leaderboard.key))
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.grade = Grade.objects.create(name='Grade 9')
+        self.user = User.objects.create_user('alice', password='password', first_name='Alice',
+                                             last_name='Smith', grade=self.grade)
+        self.mission = Mission.objects.create(title='Mission', description='d', location='Gym', value=25,
+                                              start_time=timezone.now() - timedelta(days=1),
+                                              end_time=timezone.now() + timedelta(days=1))
+
+    def get(self, name, *args, **extra):
+        return self.client.get(reverse('spiritdashboard:' + name), *args, secure=True, **extra)
+
+    def test_conditional_requests_get_304(self):
+        response = self.get('privacy_policy')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.get('privacy_policy', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        modified = self.get('user_leaderboard')['Last-Modified']
+        self.assertEqual(self.get('user_leaderboard', HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+
+    def test_whole_page_is_shared_by_anonymous_visitors(self):
+        first = self.get('user_leaderboard')
+        with self.assertNumQueries(0):
+            second = self.get('user_leaderboard')
+        self.assertEqual(second.content, first.content)
+
+    def test_signed_in_visitors_get_their_own_navbar(self):
+        self.client.get(reverse('spiritdashboard:user_leaderboard'), secure=True)
+        self.client.force_login(self.user)
+        response = self.get('user_leaderboard')
+        self.assertContains(response, 'Signed in as alice.')
+        self.assertContains(response, 'Around Me')
+
+        self.client.force_login(User.objects.create_user('bob', password='password'))
+        self.assertContains(self.get('user_leaderboard'), 'Signed in as bob.')
+        self.assertNotEqual(self.get('user_leaderboard')['ETag'], response['ETag'])
+
+    def test_saves_invalidate_their_pages_only(self):
+        users = self.get('user_leaderboard')['ETag']
+        grades = self.get('grade_leaderboard')['ETag']
+
+        self.user.last_name = 'Jones'
         self.user.save()
-        self.assertEqual(self.user.level(), 1)
+        self.assertNotEqual(self.get('user_leaderboard')['ETag'], users)
+        self.assertEqual(self.get('grade_leaderboard')['ETag'], grades)
 
-    def test_level_when_xp_is_more_than_zero_and_equal_to_total_xp_needed(self):
-        for i in range(2, 10):
-            self.user.total_xp = User.total_xp_for_level(i)
-            self.user.save()
-            self.assertEqual(self.user.level(), i)
+        self.grade.name = 'Grade Nine'
+        self.grade.save()
+        self.assertContains(self.get('grade_leaderboard'), 'Grade Nine')
 
+    def test_logins_do_not_invalidate(self):
+        etag = self.get('user_leaderboard')['ETag']
+        self.assertTrue(self.client.login(username='alice', password='password'))
+        self.client.logout()
+        self.assertEqual(self.get('user_leaderboard', HTTP_IF_NONE_MATCH=etag).status_code, 304)
 
-    def test_level_when_xp_is_more_than_zero_and_not_equal_to_total_xp_needed(self):
-        for i in range(2, 10):
-            self.user.total_xp = User.total_xp_for_level(i) - 1
-            self.user.save()
-            self.assertEqual(self.user.level(), i-1)
+    def test_claims_invalidate_leaderboards(self):
+        self.client.force_login(self.user)
+        etag = self.get('user_leaderboard')['ETag']
+        claim(self.user, MissionKey.objects.create(mission=self.mission).key)
+
+        response = self.get('user_leaderboard', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<span class="live-points">25</span>', html=False)
+
+    def test_versions_expire_without_a_shared_cache(self):
+        self.assertEqual(pages.content_versions.timeout(), pages.PAGE_VERSION_LOCAL_TIMEOUT)
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache'}}):
+            self.assertIsNone(pages.content_versions.timeout())
+
+        etag = self.get('user_leaderboard')['ETag']
+        # Another worker's bump can't reach this one, so the version runs out instead
+        cache.delete_many([pages.ContentVersions.KEY.format(section) for section in pages.SECTIONS])
+        self.assertNotEqual(self.get('user_leaderboard')['ETag'], etag)
+
+    def test_around_me_is_not_cached(self):
+        self.client.force_login(self.user)
+        response = self.get('user_leaderboard', {'around': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    @override_settings(TASKS_EAGER=False)
+    def test_period_standings_are_not_cached(self):
+        # The claim bumps the page versions before the worker writes its rollups
+        claim(self.user, MissionKey.objects.create(mission=self.mission).key)
+        self.assertEqual(list(self.get('user_leaderboard', {'period': 'day'}).context['object_list']), [])
+        tasks.run_pending()
+
+        response = self.get('user_leaderboard', {'period': 'day'})
+        self.assertNotIn('ETag', response)
+        self.assertEqual([user.pk for user in response.context['object_list']], [self.user.pk])
+
+    def test_dashboard_fragments_follow_what_they_show(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.get('dashboard'), '<h6>Mission</h6>', html=False)
+        before = pages.dashboard_fragments(self.user, summary.dashboard_summary(self.user))
+
+        # Someone else's claim leaves Alice's profile and missions alone
+        claim(User.objects.create_user('bob', password='password'), MissionKey.objects.create(
+            mission=self.mission).key)
+        after = pages.dashboard_fragments(self.user, summary.dashboard_summary(self.user))
+        self.assertEqual(before['profile'], after['profile'])
+        self.assertEqual(before['missions'], after['missions'])
+
+        claim(self.user, MissionKey.objects.create(mission=self.mission).key)
+        self.user.refresh_from_db()
+        after = pages.dashboard_fragments(self.user, summary.dashboard_summary(self.user))
+        self.assertNotEqual(before['profile'], after['profile'])
+        self.assertNotEqual(before['stats'], after['stats'])
+        self.assertNotEqual(before['missions'], after['missions'])
+
+        response = self.get('dashboard')
+        self.assertContains(response, '<s>Mission</s>', html=False)
+
+        self.mission.title = 'Renamed'
+        self.mission.save()
+        self.assertContains(self.get('dashboard'), '<s>Renamed</s>', html=False)
+
+
+class StreamClient:
+    """
+    An idle EventSource connection driven straight through the ASGI
+    application, without a server or sockets.
+    """
+
+    def __init__(self, application, path):
+        self.application = application
+        self.path = path
+        self.status = None
+        self.body = b''
+        self.received = asyncio.Event()
+        self.disconnected = asyncio.Event()
+
+    async def run(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': self.path, 'headers': []}
+        await self.application(scope, self.receive, self.send)
+
+    async def receive(self):
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        else:
+            self.body += message.get('body', b'')
+            self.received.set()
+
+    def events(self):
+        events = []
+        for block in self.body.decode('utf-8').split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+            if lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+
+class LiveStreamMixin:
+    """
+    Runs a LiveApplication on an event loop in a background thread, the
+    way an ASGI server would, while the test thread publishes as a request
+    thread does.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.broker = live.Broker()
+        patcher = mock.patch.object(live, 'broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.application = live.LiveApplication(self.fallback)
+
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.loop.call_soon_threadsafe, self.loop.stop)
+
+    async def fallback(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def run_async(self, coroutine, timeout=30):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def connect(self, count, board='users'):
+        async def start():
+            clients = [StreamClient(self.application, '/live/leaderboard/{}/'.format(board)) for _ in range(count)]
+            for client in clients:
+                client.task = asyncio.ensure_future(client.run())
+            await asyncio.wait([client.received.wait() for client in clients])
+            return clients
+        clients = self.run_async(start())
+        self.addCleanup(self.disconnect, clients)
+        return clients
+
+    def disconnect(self, clients):
+        async def stop():
+            for client in clients:
+                client.disconnected.set()
+            await asyncio.wait([client.task for client in clients])
+        self.run_async(stop())
+
+    def wait_for_events(self, clients):
+        async def wait():
+            await asyncio.wait([client.received.wait() for client in clients])
+        for client in clients:
+            client.received.clear()
+        return wait()
+
+
+class LiveLeaderboardTests(LiveStreamMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.grade = Grade.objects.create(name='grade', points=100)
+        self.users = [User.objects.create_user('user{}'.format(i), points=i * 10, grade=self.grade)
+                      for i in range(5)]
+        self.mission = Mission.objects.create(title='mission', value=25, end_time=timezone.now() + timedelta(days=1))
+
+    def test_record_returns_rank_diff(self):
+        user_leaderboard.rebuild()
+        diff = user_leaderboard.record(self.users[2].pk, 45)
+
+        self.assertEqual([(entry['id'], entry['points'], entry['ranking']) for entry in diff['changed']],
+                         [(self.users[2].pk, 45, 1), (self.users[4].pk, 40, 2), (self.users[3].pk, 30, 3)])
+        self.assertEqual(diff['removed'], [])
+
+    def test_record_reports_reset_without_cached_board(self):
+        self.assertEqual(user_leaderboard.record(self.users[0].pk, 25), {'reset': True})
+
+    def test_claim_streams_diff_to_connected_clients(self):
+        user_leaderboard.rebuild()
+        grade_leaderboard.rebuild()
+        clients = self.connect(3)
+        grade_clients = self.connect(1, 'grades')
+
+        waiting = self.wait_for_events(clients + grade_clients)
+        claim(self.users[0], MissionKey.objects.create(mission=self.mission).key)
+        self.run_async(waiting)
+
+        for client in clients:
+            self.assertEqual(client.status, 200)
+            [(name, diff)] = client.events()
+            self.assertEqual(name, 'rank')
+            self.assertEqual([(entry['id'], entry['points'], entry['ranking']) for entry in diff['changed']],
+                             [(self.users[0].pk, 25, 3), (self.users[2].pk, 20, 4), (self.users[1].pk, 10, 5)])
+        [(name, diff)] = grade_clients[0].events()
+        self.assertEqual(diff['changed'][0]['points'], 125)
+
+    def test_batch_claims_reset_clients(self):
+        clients = self.connect(1)
+        waiting = self.wait_for_events(clients)
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        claim_batch('station-1', [{'id': '1', 'user': 'user0', 'key': mission_key.key,
+                                   'scanned_at': timezone.now().isoformat()}])
+        self.run_async(waiting)
+
+        self.assertEqual(clients[0].events(), [('reset', {'reset': True})])
+
+    def test_slow_client_is_reset_instead_of_buffering(self):
+        self.broker.size = 2
+        clients = self.connect(1)
+
+        async def flood():
+            subscription = next(iter(self.broker._channels['users']))
+            for i in range(5):
+                subscription.deliver({'changed': [], 'removed': [i]})
+            return [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+
+        # Run inside the loop so the client can't drain the queue in between
+        self.assertEqual(self.run_async(flood()), [{'reset': True}])
+        self.assertEqual(self.broker.count('users'), len(clients))
+
+    def test_disconnect_unsubscribes(self):
+        clients = self.connect(2)
+        self.assertEqual(self.broker.count('users'), 2)
+
+        self.disconnect(clients)
+
+        self.assertEqual(self.broker.count(), 0)
+
+    def test_other_requests_reach_django(self):
+        client = StreamClient(self.application, '/user_leaderboard/')
+        self.run_async(client.run())
+        self.assertEqual(client.status, 204)
+
+    def test_leaderboard_page_links_stream(self):
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard'), secure=True)
+        self.assertContains(response, 'data-live-url="/live/leaderboard/users/"')
+
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard') + '?period=week', secure=True)
+        self.assertNotContains(response, 'data-live-url')
+
+    def test_nothing_is_published_until_enabled(self):
+        self.connect(1)
+        self.broker.enabled = False
+
+        self.assertEqual(self.broker.publish('users', {'reset': True}), 0)
+        self.assertIsNone(live.live_url('users'))
+
+    def test_web_workers_link_the_live_process(self):
+        self.broker.enabled = False
+        with self.settings(LIVE_ENABLED=True):
+            response = self.client.get(reverse('spiritdashboard:user_leaderboard'), secure=True)
+        self.assertContains(response, 'data-live-url="/live/leaderboard/users/"')
+
+    def test_only_streams_are_served(self):
+        client = StreamClient(live.LiveApplication(), '/user_leaderboard/')
+        self.run_async(client.run())
+        self.assertEqual(client.status, 404)
+
+
+class LiveNotifyTests(LiveStreamMixin, TransactionTestCase):
+    """
+    Claims in a gunicorn worker reach the live process's clients through
+    Postgres NOTIFY, which needs committed transactions.
+    """
+
+    def test_notify_reaches_clients(self):
+        clients = self.connect(1)
+        waiting = self.wait_for_events(clients)
+        listener = live.Listener(self.broker)
+        listener.start()
+        self.addCleanup(listener.join)
+        self.addCleanup(listener.stop)
+        self.assertTrue(listener.listening.wait(10))
+        self.run_async(waiting)
+
+        diff = {'changed': [{'id': 1, 'points': 10, 'ranking': 1}], 'removed': []}
+        waiting = self.wait_for_events(clients)
+        # The worker's own broker is disabled, as under gunicorn
+        with mock.patch.object(live, 'broker', live.Broker()), self.settings(LIVE_ENABLED=True):
+            live.publish_claim({'users': diff, 'grades': None})
+        self.run_async(waiting)
+
+        self.assertEqual(clients[0].events(), [('reset', {'reset': True}), ('rank', diff)])
+
+
+class LiveStreamLoadTests(LiveStreamMixin, TestCase):
+    """
+    Fans one diff out to many idle connections. Set SPIRIT_BENCHMARKS to
+    run it with 5000 connections and print the timings.
+    """
+
+    CONNECTIONS = 5000 if os.environ.get('SPIRIT_BENCHMARKS') else 500
+
+    def test_fan_out_to_idle_connections(self):
+        start = time.perf_counter()
+        clients = self.connect(self.CONNECTIONS)
+        connected = time.perf_counter() - start
+        self.assertEqual(self.broker.count('users'), self.CONNECTIONS)
+
+        diff = {'changed': [{'id': 1, 'points': 10, 'ranking': 1}], 'removed': []}
+        waiting = self.wait_for_events(clients)
+        start = time.perf_counter()
+        self.assertEqual(self.broker.publish('users', diff), self.CONNECTIONS)
+        self.run_async(waiting)
+        delivered = time.perf_counter() - start
+
+        self.assertTrue(all(client.events() == [('rank', diff)] for client in clients))
+        if os.environ.get('SPIRIT_BENCHMARKS'):
+            print('\n{} idle connections: connected in {:.2f}s, diff delivered to all in {:.1f}ms'.format(
+                self.CONNECTIONS, connected, delivered * 1000))
+
+
+class LeaderboardPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        rng = random.Random(7)
+        self.grade = Grade.objects.create(name='grade')
+        User.objects.bulk_create(
+            User(username='user{}'.format(i), password='!', points=rng.randrange(20) * 5, grade=self.grade)
+            for i in range(60))
+        self.expected = [(user.pk, user.ranking) for user in ranked(User.objects.all())]
+
+    def test_base_view_is_abstract(self):
+        with self.assertRaises(TypeError):
+            views.LeaderboardView()
+
+    def test_seek_pages_cover_ranked_table(self):
+        rows, after = [], None
+        while True:
+            with CaptureQueriesContext(connection) as context:
+                page = ranking.seek(User.objects.all(), after, size=7)
+            self.assertLessEqual(len(context), 2)
+            if not page:
+                break
+            rows.extend((user.pk, user.ranking) for user in page)
+            after = (page[-1].points, page[-1].pk)
+        self.assertEqual(rows, self.expected)
+
+    def test_around_returns_neighbours_with_ranks(self):
+        for index in [0, 1, 30, 58, 59]:
+            pk = self.expected[index][0]
+            user = User.objects.get(pk=pk)
+            with self.assertNumQueries(3):
+                rows = ranking.around(User.objects.all(), user, size=3)
+            window = self.expected[max(index - 3, 0):index + 4]
+            self.assertEqual([(row.pk, row.ranking) for row in rows], window)
+
+    def test_user_leaderboard_next_page(self):
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard'), secure=True)
+        cursor = response.context['next_cursor']
+        self.assertIsNotNone(cursor)
+
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard'), {'after': cursor}, secure=True)
+        page = [(user.pk, user.ranking) for user in response.context['object_list']]
+        self.assertEqual(page, self.expected[10:20])
+
+    def test_user_leaderboard_around_me(self):
+        pk = self.expected[40][0]
+        self.client.force_login(User.objects.get(pk=pk))
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard'), {'around': ''}, secure=True)
+        self.assertEqual(response.context['mode'], 'around')
+        self.assertIn(pk, [user.pk for user in response.context['object_list']])
+
+    def test_grade_leaderboard_around_my_grade(self):
+        user = User.objects.first()
+        self.client.force_login(user)
+        response = self.client.get(reverse('spiritdashboard:grade_leaderboard'), {'around': ''}, secure=True)
+        self.assertEqual([grade.pk for grade in response.context['object_list']], [self.grade.pk])
+
+    def test_bad_cursor_shows_top(self):
+        response = self.client.get(reverse('spiritdashboard:user_leaderboard'), {'after': 'x'}, secure=True)
+        self.assertEqual(response.context['mode'], 'top')
+
+
+@override_settings(TASKS_EAGER=True)
+class PointsLedgerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.grades = [Grade.objects.create(name='grade{}'.format(i)) for i in range(2)]
+        self.users = [User.objects.create_user('user{}'.format(i), grade=self.grades[i % 2]) for i in range(4)]
+        self.missions = [Mission.objects.create(
+            title='mission{}'.format(i), value=10 * (i + 1), end_time=timezone.now() + timedelta(days=1))
+            for i in range(3)]
+
+    def claim(self, user, mission):
+        claim(user, MissionKey.objects.create(mission=mission).key)
+
+    def rollups(self):
+        return (
+            sorted(UserPointsRollup.objects.values_list('period', 'bucket', 'user_id', 'points')),
+            sorted(GradePointsRollup.objects.values_list('period', 'bucket', 'grade_id', 'points')),
+        )
+
+    def test_week_bucket_starts_on_monday(self):
+        wednesday = timezone.make_aware(datetime.datetime(2019, 2, 13, 12))
+        self.assertEqual(ledger.bucket_start(ledger.WEEK, wednesday), datetime.date(2019, 2, 11))
+        self.assertEqual(ledger.bucket_start(ledger.DAY, wednesday), datetime.date(2019, 2, 13))
+
+    def test_claim_writes_ledger_and_rollups(self):
+        self.claim(self.users[0], self.missions[0])
+        self.claim(self.users[0], self.missions[1])
+        self.claim(self.users[2], self.missions[2])
+
+        self.assertEqual(LedgerEntry.objects.count(), 3)
+        week = ledger.bucket_start(ledger.WEEK)
+        self.assertEqual(UserPointsRollup.objects.get(period='week', bucket=week, user=self.users[0]).points, 30)
+        self.assertEqual(GradePointsRollup.objects.get(period='day', bucket=ledger.bucket_start(ledger.DAY),
+                                                       grade=self.grades[0]).points, 60)
+
+    def test_weekly_standings_are_one_query(self):
+        self.claim(self.users[0], self.missions[0])
+        self.claim(self.users[1], self.missions[2])
+        self.claim(self.users[3], self.missions[2])
+
+        with self.assertNumQueries(1):
+            standings = ledger.user_standings(ledger.WEEK)
+        self.assertEqual([(user.pk, user.points, user.ranking) for user in standings], [
+            (self.users[1].pk, 30, 1), (self.users[3].pk, 30, 1), (self.users[0].pk, 10, 3)])
+
+    def test_backfill_matches_claim_path(self):
+        for user in self.users:
+            for mission in self.missions[:2]:
+                self.claim(user, mission)
+        expected = self.rollups()
+
+        LedgerEntry.objects.all().delete()
+        UserPointsRollup.objects.all().delete()
+        GradePointsRollup.objects.all().delete()
+        call_command('backfill_rollups', stdout=StringIO())
+
+        self.assertEqual(LedgerEntry.objects.count(), 8)
+        self.assertEqual(self.rollups(), expected)
+
+    def test_backfill_dates_untimed_completions_by_mission_start(self):
+        mission = self.missions[0]
+        CompletedMission.objects.create(user=self.users[0], mission=mission, completed_at=None)
+
+        ledger.rebuild_rollups()
+
+        self.assertEqual(LedgerEntry.objects.get().created_at, mission.start_time)
+
+    def test_weekly_leaderboard_view(self):
+        self.claim(self.users[0], self.missions[2])
+        response = self.client.get(reverse('spiritdashboard:grade_leaderboard'), {'period': 'week'}, secure=True)
+        self.assertEqual(response.context['mode'], 'week')
+        self.assertEqual([(grade.pk, grade.points) for grade in response.context['object_list']],
+                         [(self.grades[0].pk, 30)])
+
+
+@tasks.task
+def create_grade(name):
+    Grade.objects.create(name=name)
+
+
+@tasks.task(max_attempts=2)
+def failing_task(name):
+    Grade.objects.create(name=name)
+    raise ValueError('no {}'.format(name))
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', grade=Grade.objects.create(name='Grade 9'))
+        self.mission = Mission.objects.create(title='Pep rally', value=25,
+                                              end_time=timezone.now() + timedelta(days=1))
+
+    def test_claim_leaves_the_ledger_to_a_worker(self):
+        claim(self.user, MissionKey.objects.create(mission=self.mission).key)
+        self.assertFalse(LedgerEntry.objects.exists())
+        self.assertEqual(User.objects.get(pk=self.user.pk).points, 25)
+        task = BackgroundTask.objects.get()
+        self.assertEqual((task.name, task.status), ('spiritdashboard.ledger.record_completion', 'pending'))
+
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(LedgerEntry.objects.get().points, 25)
+        self.assertEqual(UserPointsRollup.objects.get(period='day', user=self.user).points, 25)
+        self.assertEqual(BackgroundTask.objects.get().status, BackgroundTask.DONE)
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_ledger_task_skips_completions_already_recorded(self):
+        claim(self.user, MissionKey.objects.create(mission=self.mission).key)
+        ledger.rebuild_rollups()
+        tasks.run_pending()
+        self.assertEqual(LedgerEntry.objects.count(), 1)
+        self.assertEqual(UserPointsRollup.objects.get(period='day', user=self.user).points, 25)
+
+    def test_idempotency_key(self):
+        create_grade.enqueue('Grade 10', key='grade-10')
+        create_grade.enqueue('Grade 10', key='grade-10')
+        create_grade.enqueue('Grade 11')
+        self.assertEqual(BackgroundTask.objects.count(), 2)
+        tasks.run_pending()
+        self.assertEqual(Grade.objects.filter(name='Grade 10').count(), 1)
+
+        create_grade.enqueue('Grade 10', key='grade-10')
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_delayed_task_waits(self):
+        create_grade.enqueue('Grade 10', delay=60)
+        self.assertEqual(tasks.run_pending(), 0)
+        BackgroundTask.objects.update(run_at=timezone.now())
+        self.assertEqual(tasks.run_pending(), 1)
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        failing_task.enqueue('Grade 10')
+        with self.assertLogs('spiritdashboard.tasks', 'WARNING'):
+            self.assertEqual(tasks.run_pending(), 1)
+        task = BackgroundTask.objects.get()
+        self.assertEqual((task.status, task.attempts), (BackgroundTask.PENDING, 1))
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=tasks.TASK_RETRY_DELAY - 1))
+        self.assertIn('no Grade 10', task.last_error)
+        # The failed attempt's writes are rolled back
+        self.assertFalse(Grade.objects.filter(name='Grade 10').exists())
+        self.assertEqual(tasks.run_pending(), 0)
+
+        BackgroundTask.objects.update(run_at=timezone.now())
+        with self.assertLogs('spiritdashboard.tasks', 'ERROR'):
+            tasks.run_pending()
+        task = BackgroundTask.objects.get()
+        self.assertEqual((task.status, task.attempts), (BackgroundTask.FAILED, 2))
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_eager_mode_runs_inline(self):
+        with self.settings(TASKS_EAGER=True):
+            create_grade.enqueue('Grade 10', key='grade-10')
+        self.assertTrue(Grade.objects.filter(name='Grade 10').exists())
+        self.assertFalse(BackgroundTask.objects.exists())
+
+    def test_run_tasks_command(self):
+        for i in range(3):
+            create_grade.enqueue('Grade {}'.format(10 + i))
+        BackgroundTask.objects.create(name=create_grade.name, status=BackgroundTask.DONE,
+                                      finished_at=timezone.now() - timedelta(days=30))
+        out = StringIO()
+        call_command('run_tasks', once=True, batch_size=2, stdout=out)
+        self.assertIn('Purged 1 finished tasks.', out.getvalue())
+        self.assertIn('Ran 3 tasks.', out.getvalue())
+        self.assertEqual(Grade.objects.filter(name__startswith='Grade 1').count(), 3)
+
+
+class ReconcileTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.grade = Grade.objects.create(name='Grade 9')
+        self.alice = User.objects.create_user('alice', password='password', grade=self.grade)
+        self.bob = User.objects.create_user('bob', password='password', grade=self.grade)
+        self.carol = User.objects.create_user('carol', password='password')
+        self.missions = [
+            Mission.objects.create(title='Mission {}'.format(i), description='d', location='Gym', value=10 * i,
+                                   xp_points=i, start_time=now - timedelta(days=1),
+                                   end_time=now + timedelta(days=1))
+            for i in range(1, 4)]
+        for user, mission in ((self.alice, 0), (self.alice, 1), (self.bob, 2)):
+            claim(user, MissionKey.objects.create(mission=self.missions[mission]).key)
+
+    def drift(self):
+        User.objects.filter(pk=self.alice.pk).update(points=999)
+        User.objects.filter(pk=self.carol.pk).update(total_xp=7)
+        Grade.objects.filter(pk=self.grade.pk).update(points=1)
+
+    def totals(self):
+        return (list(User.objects.order_by('pk').values_list('points', 'total_xp')),
+                Grade.objects.get(pk=self.grade.pk).points)
+
+    def test_consistent_totals_are_left_alone(self):
+        with self.assertNumQueries(3):
+            result = reconcile.reconcile(dry_run=True)
+        self.assertEqual((result.users, result.grades), ([], []))
+
+    def test_dry_run_reports_without_correcting(self):
+        self.drift()
+        result = reconcile.reconcile(dry_run=True)
+        self.assertEqual(result.users, [
+            reconcile.Drift(self.alice.pk, (999, 3), (30, 3)),
+            reconcile.Drift(self.carol.pk, (0, 7), (0, 0))])
+        self.assertEqual(result.grades, [reconcile.Drift(self.grade.pk, (1,), (60,))])
+        self.assertEqual(self.totals(), ([(999, 3), (30, 3), (0, 7)], 1))
+        self.assertFalse(ReconcileRun.objects.exists())
+
+    def test_corrects_in_batches(self):
+        self.drift()
+        result = reconcile.reconcile(batch_size=1)
+        self.assertEqual(len(result.users), 2)
+        self.assertEqual(self.totals(), ([(30, 3), (30, 3), (0, 0)], 60))
+        self.assertEqual(reconcile.reconcile(dry_run=True).users, [])
+
+        run = ReconcileRun.objects.get()
+        self.assertEqual((run.users_corrected, run.grades_corrected), (2, 1))
+        self.assertEqual(run.last_completion_id, CompletedMission.objects.order_by('-pk')[0].pk)
+
+    def test_incremental_checks_new_claims_only(self):
+        reconcile.reconcile()
+        self.drift()
+        result = reconcile.reconcile(incremental=True)
+        self.assertEqual((result.users, result.grades), ([], []))
+
+        claim(self.bob, MissionKey.objects.create(mission=self.missions[0]).key)
+        result = reconcile.reconcile(incremental=True)
+        # Bob's claim puts his grade back in scope, but not Alice or Carol
+        self.assertEqual(result.users, [])
+        self.assertEqual(result.grades, [reconcile.Drift(self.grade.pk, (11,), (70,))])
+        self.assertEqual(self.totals(), ([(999, 3), (40, 4), (0, 7)], 70))
+
+    def test_grades_keep_points_claimed_while_members(self):
+        grade_10 = Grade.objects.create(name='Grade 10')
+        self.bob.grade = grade_10
+        self.bob.save()
+        claim(self.bob, MissionKey.objects.create(mission=self.missions[0]).key)
+
+        # Bob's earlier 30 points stay with Grade 9; only the new claim counts for Grade 10
+        self.assertEqual(reconcile.reconcile(dry_run=True).grades, [])
+        self.assertEqual(self.totals()[1], 60)
+        self.assertEqual(Grade.objects.get(pk=grade_10.pk).points, 10)
+
+    def test_repricing_a_mission_keeps_past_claims(self):
+        for completion in CompletedMission.objects.filter(mission=self.missions[0]):
+            ledger.record_completion(completion.pk, completion.grade_id)
+        Mission.objects.filter(pk=self.missions[0].pk).update(value=500, xp_points=50)
+
+        # Alice's claim of mission 1 is in the ledger at 10 points; mission 2's
+        # entry is still queued, so it counts at the current value
+        self.assertEqual(reconcile.reconcile(dry_run=True).users, [])
+        self.assertEqual(reconcile.reconcile(dry_run=True).grades, [])
+
+        Mission.objects.filter(pk=self.missions[1].pk).update(value=25)
+        result = reconcile.reconcile(dry_run=True)
+        self.assertEqual(result.users, [reconcile.Drift(self.alice.pk, (30, 3), (35, 3))])
+        self.assertEqual(result.grades, [reconcile.Drift(self.grade.pk, (60,), (65,))])
+
+    def test_command(self):
+        self.drift()
+        out = StringIO()
+        call_command('reconcile_totals', '--dry-run', stdout=out)
+        self.assertIn('user {}: 999/3 -> 30/3'.format(self.alice.pk), out.getvalue())
+        self.assertIn('Found 2 users and 1 grades', out.getvalue())
+
+        call_command('reconcile_totals', stdout=StringIO())
+        self.assertEqual(self.totals(), ([(30, 3), (30, 3), (0, 0)], 60))
+
+
+class HealthDecayTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.interval = timedelta(seconds=health.HEALTH_DECAY_INTERVAL)
+
+    def test_no_decay_within_an_interval(self):
+        since = self.now - self.interval + timedelta(seconds=1)
+        self.assertEqual(health.decay(80, since, self.now), (80, since))
+
+    def test_loses_a_point_per_whole_interval(self):
+        since = self.now - self.interval * 5 - timedelta(seconds=30)
+        self.assertEqual(health.decay(80, since, self.now), (75, since + self.interval * 5))
+
+    def test_stops_at_zero(self):
+        self.assertEqual(health.decay(3, self.now - self.interval * 10, self.now)[0], 0)
+
+    def test_stored_pair_reads_the_same_later(self):
+        since = self.now - self.interval * 7 - timedelta(minutes=5)
+        stored = health.decay(50, since, self.now)
+        for later in (self.now, self.now + self.interval / 2, self.now + self.interval * 3):
+            self.assertEqual(health.decay(*stored, later), health.decay(50, since, later))
+
+    def test_future_timestamps_do_not_add_health(self):
+        self.assertEqual(health.decay(50, self.now + self.interval * 2, self.now)[0], 50)
+
+    def test_regenerate_tops_up_to_the_maximum(self):
+        since = self.now - self.interval * 4
+        self.assertEqual(health.regenerate(50, since, 100, self.now), (46 + health.HEALTH_PER_CLAIM, self.now))
+        self.assertEqual(health.regenerate(98, since, 100, self.now, claims=3), (100, self.now))
+
+    def test_health_percent(self):
+        user = User(health=60, health_max=80, health_updated_at=self.now - self.interval * 20)
+        self.assertEqual(user.current_health(self.now), 40)
+        self.assertEqual(user.health_percent(self.now), 50)
+
+
+class HealthTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.interval = timedelta(seconds=health.HEALTH_DECAY_INTERVAL)
+        self.mission = Mission.objects.create(title='Pep rally', value=10, start_time=self.now - timedelta(days=1),
+                                              end_time=self.now + timedelta(days=1))
+
+    def make_users(self, pairs):
+        return User.objects.bulk_create(
+            User(username='user{}'.format(i), health=value, health_updated_at=since)
+            for i, (value, since) in enumerate(pairs))
+
+    def test_materialize_matches_lazy_reads_in_one_query(self):
+        self.make_users([
+            (100, self.now),
+            (100, self.now - self.interval * 3 - timedelta(minutes=1)),
+            (20, self.now - self.interval * 50),
+            (0, self.now - self.interval * 50),
+            (70, self.now - self.interval / 2),
+        ])
+        users = list(User.objects.order_by('pk'))
+        later = self.now + self.interval * 2
+
+        with self.assertNumQueries(1):
+            updated = health.materialize(User.objects.all(), self.now)
+        self.assertEqual(updated, 2)
+
+        stored = list(User.objects.order_by('pk'))
+        self.assertEqual([user.health for user in stored], [100, 97, 0, 0, 70])
+        for before, after in zip(users, stored):
+            self.assertEqual(after.current_health(self.now), before.current_health(self.now))
+            self.assertEqual(after.current_health(later), before.current_health(later))
+        self.assertEqual(health.materialize(User.objects.all(), self.now), 0)
+
+    def test_claim_regenerates_health(self):
+        user, = self.make_users([(50, self.now - self.interval * 4)])
+        claim(user, MissionKey.objects.create(mission=self.mission).key)
+
+        self.assertEqual(user.current_health(), 46 + health.HEALTH_PER_CLAIM)
+        user.refresh_from_db()
+        self.assertEqual(user.current_health(), 46 + health.HEALTH_PER_CLAIM)
+        self.assertGreaterEqual(user.health_updated_at, self.now)
+
+    def test_claim_batch_regenerates_health(self):
+        alice, bob = self.make_users([(95, self.now), (30, self.now - self.interval * 10)])
+        missions = [self.mission, Mission.objects.create(title='Game', start_time=self.now - timedelta(days=1),
+                                                                  end_time=self.now + timedelta(days=1))]
+        items = [{'id': str(i), 'user': user.username, 'key': MissionKey.objects.create(mission=mission).key,
+                  'scanned_at': self.now.isoformat()}
+                 for i, (user, mission) in enumerate([(alice, missions[0]), (alice, missions[1]),
+                                                      (bob, missions[0])])]
+        claim_batch('station-1', items)
+
+        self.assertEqual([user.health for user in User.objects.order_by('pk')],
+                         [100, 20 + health.HEALTH_PER_CLAIM])
+
+    def test_dashboard_shows_decayed_health(self):
+        user, = self.make_users([(100, self.now - self.interval * 25)])
+        user.set_password('password')
+        user.save()
+        self.client.login(username=user.username, password='password')
+        response = self.client.get(reverse('spiritdashboard:index'), secure=True)
+        self.assertContains(response, '<b>75%</b>', html=True)
+
+    def test_materialize_health_command(self):
+        self.make_users([(100, self.now - self.interval * 2), (100, self.now)])
+        out = StringIO()
+        call_command('materialize_health', stdout=out)
+        self.assertIn('Updated health for 1 users.', out.getvalue())
+        self.assertEqual(sorted(User.objects.values_list('health', flat=True)), [98, 100])
+
+
+@skipUnless(os.environ.get('SPIRIT_BENCHMARKS'), 'set SPIRIT_BENCHMARKS=1 to run benchmarks')
+class HealthMaterializeBenchmark(TestCase):
+    USERS = 10000
+
+    def test_materialize(self):
+        now = timezone.now()
+        rng = random.Random(2019)
+        interval = timedelta(seconds=health.HEALTH_DECAY_INTERVAL)
+        User.objects.bulk_create(
+            User(username='student{}'.format(i), password='!', health=rng.randrange(101),
+                 health_updated_at=now - interval * rng.randrange(100))
+            for i in range(self.USERS))
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            for user in User.objects.only('pk', 'health', 'health_updated_at'):
+                value, since = health.decay(user.health, user.health_updated_at, now)
+                if (value, since) != (user.health, user.health_updated_at):
+                    user.health, user.health_updated_at = value, since
+                    user.save(update_fields=['health', 'health_updated_at'])
+            expected = sorted(User.objects.values_list('pk', 'health', 'health_updated_at'))
+            transaction.set_rollback(True)
+        loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        updated = health.materialize(User.objects.all(), now)
+        batch = time.perf_counter() - start
+
+        print('\nmaterialize health for {} users: per-row loop {:.2f}s, one UPDATE {:.2f}s ({} rows)'.format(
+            self.USERS, loop, batch, updated))
+        self.assertEqual(sorted(User.objects.values_list('pk', 'health', 'health_updated_at')), expected)
+
+
+class ProgressionTests(TestCase):
+
+    USERNAME = 'username'
+    PASSWORD = 'password'
+
+    def setUp(self):
+        self.grade = Grade(name='grade')
+        self.grade.save()
+        self.user = User.objects.create_user(
+            self.USERNAME, password=self.PASSWORD, grade=self.grade)
+
+    def test_xp_for_level(self):
+        self.assertEqual(User.xp_for_level(1), 0)
+        self.assertEqual(User.xp_for_level(2), 5)
+        self.assertEqual(User.xp_for_level(3), 10)
+        self.assertEqual(User.xp_for_level(4), 15)
+        self.assertEqual(User.xp_for_level(5), 20)
+
+    def test_total_xp_for_level(self):
+        self.assertEqual(User.total_xp_for_level(1), 0)
+        self.assertEqual(User.total_xp_for_level(2), 5)
+        self.assertEqual(User.total_xp_for_level(3), 15)
+        self.assertEqual(User.total_xp_for_level(4), 30)
+        self.assertEqual(User.total_xp_for_level(5), 50)
+
+    def test_level_when_xp_is_zero(self):
+        self.user.total_xp = 0
+        self.user.save()
+        self.assertEqual(self.user.level(), 1)
+
+    def test_level_when_xp_is_more_than_zero_and_equal_to_total_xp_needed(self):
+        for i in range(2, 10):
+            self.user.total_xp = User.total_xp_for_level(i)
+            self.user.save()
+            self.assertEqual(self.user.level(), i)
+
+
+    def test_level_when_xp_is_more_than_zero_and_not_equal_to_total_xp_needed(self):
+        for i in range(2, 10):
+            self.user.total_xp = User.total_xp_for_level(i) - 1
+            self.user.save()
+            self.assertEqual(self.user.level(), i-1)
+
+
+def reference_level(total_xp):
+    # The original level-by-level walk, kept to check the closed form against
+    prev_level = 1
+    while total_xp > User.total_xp_for_level(prev_level):
+        prev_level += 1
+    if total_xp != User.total_xp_for_level(prev_level):
+        prev_level -= 1
+    return prev_level
+
+
+class LevelFormulaTests(SimpleTestCase):
+
+    EXHAUSTIVE_BOUND = 20000
+    BOUNDARY_LEVELS = 100000
+
+    def assertMatchesReference(self, total_xp, level=None):
+        if level is None:
+            level = reference_level(total_xp)
+        self.assertEqual(User.level_for_xp(total_xp), level, total_xp)
+
+        user = User(total_xp=total_xp)
+        progress = user.progress()
+        self.assertEqual(progress.level, level)
+        self.assertEqual(progress.xp, total_xp - User.total_xp_for_level(level))
+        self.assertEqual(progress.percent, math.floor(
+            progress.xp / User.total_xp_for_level(level + 1) * 100))
+
+    def test_every_xp_value_matches_loop(self):
+        for total_xp in range(self.EXHAUSTIVE_BOUND + 1):
+            self.assertMatchesReference(total_xp)
+
+    def test_exact_level_boundaries(self):
+        # Around each boundary the loop's answer is known without walking it
+        for level in range(2, self.BOUNDARY_LEVELS):
+            boundary = int(User.total_xp_for_level(level))
+            self.assertEqual(User.level_for_xp(boundary - 1), level - 1)
+            self.assertEqual(User.level_for_xp(boundary), level)
+            self.assertEqual(User.level_for_xp(boundary + 1), level)
+
+    def test_sampled_large_xp_values_match_loop(self):
+        rng = random.Random(2019)
+        for _ in range(200):
+            self.assertMatchesReference(rng.randrange(10 ** 7))
+
+    def test_negative_xp_matches_loop(self):
+        self.assertEqual(User.level_for_xp(-1), reference_level(-1))
+
+    def test_level_methods_agree_with_progress(self):
+        user = User(total_xp=42)
+        self.assertEqual(user.progress(), (user.level(), user.xp_toward_next_level(), user.xp_percent()))
+
+
+class DashboardSummaryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.grade = Grade.objects.create(name='grade', points=100)
+        self.user = User.objects.create_user('username', grade=self.grade, total_xp=150)
+        now = timezone.now()
+        self.mission = Mission.objects.create(title='open', value=50, end_time=now + timedelta(days=1))
+        self.done = Mission.objects.create(title='done', value=10, end_time=now + timedelta(days=2))
+        self.expired = Mission.objects.create(title='expired', start_time=now - timedelta(days=2),
+                                              end_time=now - timedelta(days=1))
+
+    def completed_ids(self, user=None):
+        return User.objects.get(pk=(user or self.user).pk).completed_mission_ids
+
+    def test_claim_records_completed_mission_id(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        claim(self.user, mission_key.key)
+
+        self.assertEqual(self.completed_ids(), [self.mission.pk])
+        self.assertEqual(self.user.completed_mission_ids, [self.mission.pk])
+
+    def test_batch_claim_records_completed_mission_ids(self):
+        other = User.objects.create_user('other')
+        first = MissionKey.objects.create(mission=self.mission)
+        second = MissionKey.objects.create(mission=self.done)
+        now = timezone.now().isoformat()
+        claim_batch('station-1', [
+            {'id': '1', 'user': 'username', 'key': first.key, 'scanned_at': now},
+            {'id': '2', 'user': 'username', 'key': second.key, 'scanned_at': now},
+            {'id': '3', 'user': 'other', 'key': first.key, 'scanned_at': now},
+        ])
+
+        self.assertEqual(sorted(self.completed_ids()), sorted([self.mission.pk, self.done.pk]))
+        self.assertEqual(self.completed_ids(other), [self.mission.pk])
+
+    def test_completions_made_elsewhere_stay_in_sync(self):
+        completion = CompletedMission.objects.create(user=self.user, mission=self.done)
+        self.assertEqual(self.completed_ids(), [self.done.pk])
+
+        completion.delete()
+        self.assertEqual(self.completed_ids(), [])
+
+    def test_rebuild_completed_ids(self):
+        CompletedMission.objects.bulk_create([CompletedMission(user=self.user, mission=self.done),
+                                              CompletedMission(user=self.user, mission=self.expired)])
+        User.objects.filter(pk=self.user.pk).update(completed_mission_ids=[self.mission.pk])
+
+        summary.rebuild_completed_ids([self.user.pk])
+
+        self.assertEqual(self.completed_ids(), [self.done.pk, self.expired.pk])
+
+    def test_summary(self):
+        CompletedMission.objects.create(user=self.user, mission=self.expired)
+        user = User.objects.get(pk=self.user.pk)
+
+        result = summary.dashboard_summary(user)
+
+        self.assertEqual([m['id'] for m in result.missions], [self.mission.pk, self.done.pk])
+        self.assertEqual([m['title'] for m in result.completed_missions], ['expired'])
+        self.assertEqual(result.grade, self.grade)
+        self.assertEqual(result.user_rank, 1)
+        self.assertEqual(result.grade_rank, 1)
+        self.assertEqual(result.progress, user.progress())
+
+    def test_ended_completions_are_cached_per_user(self):
+        CompletedMission.objects.create(user=self.user, mission=self.expired)
+        user = User.objects.get(pk=self.user.pk)
+        summary.dashboard_summary(user)
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            result = summary.dashboard_summary(user)
+        self.assertEqual([m['title'] for m in result.completed_missions], ['expired'])
+
+    def test_summary_queries(self):
+        # Ranks come from the shared rank cache, which other users keep warm
+        cached_rank(self.user), cached_rank(self.grade)
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(2):
+            summary.dashboard_summary(user)
+
+        # Warm, only the grade row is read
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            summary.dashboard_summary(user)
+
+    def test_claim_moves_mission_to_completed(self):
+        summary.dashboard_summary(self.user)
+        claim(self.user, MissionKey.objects.create(mission=self.done).key)
+
+        result = summary.dashboard_summary(self.user)
+
+        self.assertEqual([m['id'] for m in result.missions], [self.mission.pk])
+        self.assertEqual([m['id'] for m in result.completed_missions], [self.done.pk])
+
+    def test_mission_changes_invalidate_summaries(self):
+        summary.dashboard_summary(self.user)
+        self.mission.title = 'renamed'
+        self.mission.save()
+
+        result = summary.dashboard_summary(self.user)
+
+        self.assertEqual(result.missions[0]['title'], 'renamed')
+
+    def test_dashboard_renders_summary(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('spiritdashboard:dashboard'), secure=True)
+
+        self.assertContains(response, 'open')
+        self.assertContains(response, 'Level {} Warrior'.format(self.user.level()))
+
+
+class CompletionCheckTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user('user{}'.format(i)) for i in range(3)]
+        self.missions = [Mission.objects.create(title='mission {}'.format(i)) for i in range(4)]
+        for user, mission in [(0, 0), (0, 2), (1, 2)]:
+            CompletedMission.objects.create(user=self.users[user], mission=self.missions[mission])
+
+    def test_is_completed_by_user(self):
+        self.assertTrue(self.missions[0].is_completed_by_user(self.users[0]))
+        self.assertFalse(self.missions[1].is_completed_by_user(self.users[0]))
+        self.assertFalse(self.missions[0].is_completed_by_user(self.users[1]))
+
+    def test_completed_mission_ids(self):
+        self.assertEqual(CompletedMission.objects.completed_mission_ids(self.users[0], self.missions),
+                         {self.missions[0].pk, self.missions[2].pk})
+        self.assertEqual(CompletedMission.objects.completed_mission_ids(self.users[2], self.missions), set())
+
+    def test_completed_user_ids(self):
+        self.assertEqual(CompletedMission.objects.completed_user_ids(self.missions[2], self.users),
+                         {self.users[0].pk, self.users[1].pk})
+
+    def test_completed_pairs(self):
+        self.assertEqual(CompletedMission.objects.completed_pairs(self.users[1:], self.missions[1:]),
+                         {(self.users[1].pk, self.missions[2].pk)})
+
+    def test_accepts_pks_and_querysets(self):
+        expected = {self.missions[0].pk, self.missions[2].pk}
+        self.assertEqual(CompletedMission.objects.completed_mission_ids(
+            self.users[0].pk, [mission.pk for mission in self.missions]), expected)
+        with self.assertNumQueries(1):
+            self.assertEqual(CompletedMission.objects.completed_mission_ids(
+                self.users[0], Mission.objects.all()), expected)
+
+    def test_one_query_however_many_missions(self):
+        user = self.users[0]
+        for count in (10, 100, 1000):
+            missions = Mission.objects.bulk_create(Mission(title=str(i)) for i in range(count))
+            CompletedMission.objects.bulk_create(CompletedMission(user=user, mission=mission)
+                                                 for mission in missions[::2])
+            with self.assertNumQueries(1):
+                completed = CompletedMission.objects.completed_mission_ids(user, missions)
+            self.assertEqual(len(completed), (count + 1) // 2)
+
+    def test_one_query_however_many_users(self):
+        mission = self.missions[3]
+        users = User.objects.bulk_create(User(username='bulk{}'.format(i)) for i in range(1000))
+        CompletedMission.objects.bulk_create(CompletedMission(user=user, mission=mission) for user in users[:10])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(CompletedMission.objects.completed_user_ids(mission, users)), 10)
+
+
+@skipUnless(os.environ.get('SPIRIT_BENCHMARKS'), 'set SPIRIT_BENCHMARKS=1 to run benchmarks')
+class CompletionCheckBenchmark(TestCase):
+
+    def test_completion_checks(self):
+        user = User.objects.create_user('username')
+        for count in (10, 100, 1000):
+            missions = Mission.objects.bulk_create(Mission(title=str(i)) for i in range(count))
+            CompletedMission.objects.bulk_create(CompletedMission(user=user, mission=mission)
+                                                 for mission in missions[::3])
+
+            with CaptureQueriesContext(connection) as loop_queries:
+                start = time.perf_counter()
+                looped = {mission.pk for mission in missions if mission.is_completed_by_user(user)}
+                loop = time.perf_counter() - start
+            with CaptureQueriesContext(connection) as batch_queries:
+                start = time.perf_counter()
+                batched = CompletedMission.objects.completed_mission_ids(user, missions)
+                batch = time.perf_counter() - start
+
+            self.assertEqual(looped, batched)
+            print('\n{} missions: per mission {} queries in {:.2f}ms, batch {} query in {:.2f}ms'.format(
+                count, len(loop_queries), loop * 1000, len(batch_queries), batch * 1000))
+
+
+class MissionScheduleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.schedule = MissionSchedule()
+        self.open = Mission.objects.create(title='open', start_time=self.now - timedelta(hours=1),
+                                           end_time=self.now + timedelta(hours=2))
+        self.later = Mission.objects.create(title='later', start_time=self.now + timedelta(hours=1),
+                                            end_time=self.now + timedelta(hours=3))
+        Mission.objects.create(title='over', start_time=self.now - timedelta(hours=2),
+                               end_time=self.now - timedelta(hours=1))
+
+    def titles(self, missions):
+        return [mission['title'] for mission in missions]
+
+    def test_snapshot(self):
+        snapshot = self.schedule.current(self.now)
+
+        self.assertEqual(self.titles(snapshot.missions), ['open', 'later'])
+        self.assertEqual(self.titles(snapshot.active), ['open'])
+        self.assertEqual(self.titles(snapshot.upcoming), ['later'])
+        self.assertEqual(snapshot.valid_until, self.later.start_time)
+
+    def test_reused_until_next_boundary(self):
+        self.schedule.current(self.now)
+        with self.assertNumQueries(0):
+            self.schedule.current(self.now + timedelta(minutes=59))
+
+        with self.assertNumQueries(1):
+            snapshot = self.schedule.current(self.now + timedelta(hours=1))
+        self.assertEqual(self.titles(snapshot.active), ['open', 'later'])
+        self.assertEqual(snapshot.valid_until, self.open.end_time + timedelta(microseconds=1))
+
+    def test_mission_ends(self):
+        snapshot = self.schedule.current(self.now + timedelta(hours=2, seconds=1))
+
+        self.assertEqual(self.titles(snapshot.missions), ['later'])
+        self.assertEqual(snapshot.valid_until, self.later.end_time + timedelta(microseconds=1))
+
+    def test_shared_between_workers(self):
+        self.schedule.current(self.now)
+        with self.assertNumQueries(0):
+            MissionSchedule().current(self.now)
+
+    def test_mission_save_and_delete_invalidate(self):
+        self.schedule.current(self.now)
+
+        Mission.objects.create(title='new', start_time=self.now, end_time=self.now + timedelta(hours=1))
+        self.assertIn('new', self.titles(self.schedule.current(self.now).missions))
+
+        self.open.delete()
+        self.assertNotIn('open', self.titles(self.schedule.current(self.now).missions))
+
+    def test_empty_schedule(self):
+        Mission.objects.all().delete()
+        snapshot = self.schedule.current(self.now)
+
+        self.assertEqual(snapshot.missions, [])
+        self.assertIsNone(snapshot.valid_until)
+
+    def test_local_copy_expires(self):
+        Mission.objects.all().delete()
+        self.schedule.current(self.now)
+        # What another worker saw wouldn't reach this one through a local cache
+        cache.delete('schedule:missions:{}'.format(self.schedule.version()))
+
+        with self.assertNumQueries(0):
+            self.schedule.current(self.now + timedelta(seconds=59))
+        with self.assertNumQueries(1):
+            self.schedule.current(self.now + timedelta(seconds=60))
+
+    def test_local_cache_caps_timeout(self):
+        snapshot = self.schedule.current(self.now)
+
+        self.assertEqual(self.schedule._timeout(snapshot, self.now), SCHEDULE_LOCAL_TIMEOUT)
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache'}}):
+            self.assertEqual(self.schedule._timeout(snapshot, self.now), 3600)
+
+
+@skipUnless(os.environ.get('SPIRIT_BENCHMARKS'), 'set SPIRIT_BENCHMARKS=1 to run benchmarks')
+class DashboardBenchmark(TestCase):
+    """
+    Compares the dashboard's old per-request queries with the cached
+    summary at 10k users and 1k missions.
+    """
+
+    USERS = 10000
+    MISSIONS = 1000
+    COMPLETIONS_PER_USER = 20
+    ROUNDS = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate_school(users=cls.USERS, missions=cls.MISSIONS, completions=cls.COMPLETIONS_PER_USER,
+                                  distribution='uniform', seed=2019)
+
+    def time(self, render, users):
+        start = time.perf_counter()
+        for user in users:
+            render(user)
+        return (time.perf_counter() - start) / len(users)
+
+    def test_dashboard(self):
+        def legacy(user):
+            list(Mission.objects.filter(end_time__gte=timezone.now()).exclude(
+                completedmission__user=user).order_by('start_time'))
+            list(Mission.objects.filter(completedmission__user=user))
+            grade = user.grade
+            user.rank(), grade.rank(), user.level()
+
+        users = list(User.objects.order_by('?')[:self.ROUNDS])
+        cache.clear()
+        old = self.time(legacy, users)
+        cold = self.time(summary.dashboard_summary, users)
+        warm = self.time(summary.dashboard_summary, users)
+
+        print('\ndashboard: legacy {:.2f}ms, summary cold {:.2f}ms, warm {:.2f}ms'.format(
+            old * 1000, cold * 1000, warm * 1000))
+        self.assertLess(warm, old)
+
+
+class TemporaryAvatarStorageMixin:
+    # Keeps rendered avatars out of the real MEDIA_ROOT
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.media_root)
+        self.original_storage = avatar_cache.storage
+        avatar_cache.storage = self.storage
+        avatar_cache.clear()
+
+    def tearDown(self):
+        avatar_cache.storage = self.original_storage
+        avatar_cache.clear()
+        shutil.rmtree(self.media_root)
+        super().tearDown()
+
+
+class AvatarCacheTests(TemporaryAvatarStorageMixin, TestCase):
+
+    USERNAME = 'username'
+    PASSWORD = 'password'
+
+    def test_digest_depends_on_every_input(self):
+        digest = avatar_digest('user')
+        self.assertNotEqual(digest, avatar_digest('user2'))
+        self.assertNotEqual(digest, avatar_digest('user', size=64))
+        self.assertNotEqual(digest, avatar_digest('user', hashfun='MD5'))
+        with self.settings(SECRET_KEY='another secret'):
+            self.assertNotEqual(digest, avatar_digest('user'))
+
+    def test_avatar_is_rendered_once_and_stored(self):
+        cache = AvatarCache(storage=self.storage)
+        data = cache.get('user')
+
+        self.assertTrue(data.startswith(b'\x89PNG'))
+        self.assertTrue(self.storage.exists(cache.path('user')))
+
+        # A fresh process reads the stored copy instead of rendering again
+        fresh = AvatarCache(storage=self.storage)
+        self.assertEqual(fresh.get('user'), data)
+
+    def test_least_recently_used_avatar_is_evicted(self):
+        cache = AvatarCache(storage=self.storage, max_entries=2)
+        cache.get('user1')
+        cache.get('user2')
+        cache.get('user1')
+        cache.get('user3')
+
+        self.assertEqual(len(cache), 2)
+        self.assertIn(cache.digest('user1'), cache._entries)
+        self.assertNotIn(cache.digest('user2'), cache._entries)
+
+    def test_avatar_is_invalidated_when_username_changes(self):
+        user = User.objects.create_user(self.USERNAME, password=self.PASSWORD)
+        avatar_cache.get(self.USERNAME)
+        old_path = avatar_cache.path(self.USERNAME)
+
+        user.username = 'renamed'
+        user.save()
+
+        self.assertFalse(self.storage.exists(old_path))
+        self.assertNotIn(avatar_digest(self.USERNAME), avatar_cache._entries)
+
+    def test_dashboard_references_avatar_by_url(self):
+        User.objects.create_user(self.USERNAME, password=self.PASSWORD)
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+        response = self.client.get(reverse('spiritdashboard:dashboard'), secure=True)
+
+        url = reverse('spiritdashboard:avatar', args=[
+            self.USERNAME, avatar_digest(self.USERNAME)])
+        self.assertContains(response, url)
+        self.assertNotContains(response, 'base64')
+
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_avatar_with_wrong_digest_is_not_found(self):
+        url = reverse('spiritdashboard:avatar', args=[self.USERNAME, 'nope'])
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_unsigned_digest_renders_nothing(self):
+        # The old, unkeyed digest anyone could compute for any name
+        digest = hashlib.sha256('{}:{}:{}'.format('made-up', avatar_cache.hashfun, avatar_cache.size)
+                                .encode('utf-8')).hexdigest()
+        response = self.client.get(reverse('spiritdashboard:avatar', args=['made-up', digest]), secure=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(avatar_cache), 0)
+        self.assertFalse(self.storage.exists(avatar_cache.path('made-up')))
+
+
+class HistogramTests(SimpleTestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual((histogram.sum, histogram.count), (13, 4))
+
+    def test_prometheus_text(self):
+        registry = metrics.Registry()
+        registry.observe('spiritdashboard:dashboard', {'db_queries': 3, 'request_duration_seconds': 0.02})
+
+        text = registry.render()
+
+        self.assertIn('# TYPE spirit_db_queries histogram', text)
+        self.assertIn('spirit_db_queries_bucket{view="spiritdashboard:dashboard",le="3"} 1', text)
+        self.assertIn('spirit_db_queries_bucket{view="spiritdashboard:dashboard",le="2"} 0', text)
+        self.assertIn('spirit_request_duration_seconds_sum{view="spiritdashboard:dashboard"} 0.02', text)
+        self.assertIn('spirit_avatar_render_seconds_count{view="spiritdashboard:dashboard"} 0', text)
+
+
+class ProfilingMiddlewareTests(TemporaryAvatarStorageMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        metrics.registry.clear()
+        self.user = User.objects.create_user('username')
+        self.client.force_login(self.user)
+
+    def histogram(self, view, name):
+        return metrics.registry.histogram(view, name)
+
+    def test_records_view_metrics(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('spiritdashboard:dashboard'), secure=True)
+
+        view = 'spiritdashboard:dashboard'
+        self.assertEqual(self.histogram(view, 'request_duration_seconds').count, 1)
+        self.assertEqual(self.histogram(view, 'db_queries').sum, len(context.captured_queries))
+        self.assertGreater(self.histogram(view, 'db_duration_seconds').sum, 0)
+        self.assertGreater(self.histogram(view, 'template_render_seconds').sum, 0)
+        # The first dashboard for a user renders their avatar
+        self.assertGreater(self.histogram(view, 'avatar_render_seconds').sum, 0)
+
+        # A warm avatar costs nothing
+        self.client.get(reverse('spiritdashboard:dashboard'), secure=True)
+        self.assertEqual(self.histogram(view, 'avatar_render_seconds').count, 2)
+        self.assertEqual(self.histogram(view, 'avatar_render_seconds').counts[0], 1)
+
+    def test_unnamed_routes_are_reported_by_route(self):
+        self.client.get('/dashboard/', secure=True)
+        self.assertEqual(self.histogram('dashboard/', 'request_duration_seconds').count, 1)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        url = reverse('spiritdashboard:metrics')
+        self.assertEqual(self.client.get(url, secure=True).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(reverse('spiritdashboard:privacy_policy'), secure=True)
+        response = self.client.get(url, secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'spirit_request_duration_seconds_count{view="spiritdashboard:privacy_policy"} 1', response.content)
+
+    def test_sampled_profiles_rotate(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=directory, PROFILE_KEEP=2):
+            for _ in range(3):
+                self.client.get(reverse('spiritdashboard:privacy_policy'), secure=True)
+
+        profiles = sorted(os.listdir(directory))
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue(all(name.endswith('-spiritdashboard_privacy_policy.prof') for name in profiles))
+
+    def test_no_profiles_by_default(self):
+        with mock.patch('cProfile.Profile') as profile:
+            self.client.get(reverse('spiritdashboard:privacy_policy'), secure=True)
+        profile.assert_not_called()
+
+
+class SyntheticSchoolTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generates_consistent_school(self):
+        counts = synthetic.generate_school(grades=3, users=50, missions=20, keys_per_mission=2,
+                                           completions=4, seed=1)
+
+        self.assertEqual(counts['users'], User.objects.count())
+        self.assertEqual(counts['keys'], 40)
+        self.assertEqual(counts['completions'], CompletedMission.objects.count())
+        self.assertEqual(counts['completions'], LedgerEntry.objects.count())
+        self.assertFalse(CompletedMission.objects.filter(mission__start_time__gt=timezone.now()).exists())
+        for user in User.objects.all():
+            missions = Mission.objects.filter(completedmission__user=user)
+            self.assertEqual(user.points, sum(mission.value for mission in missions))
+            self.assertEqual(sorted(user.completed_mission_ids), sorted(mission.pk for mission in missions))
+        for grade in Grade.objects.all():
+            self.assertEqual(grade.points, sum(User.objects.filter(grade=grade).values_list('points', flat=True)))
+
+    def test_seed_is_reproducible(self):
+        synthetic.generate_school(grades=2, users=10, missions=5, seed=7)
+        first = list(User.objects.order_by('username').values_list('username', 'points'))
+        keys = list(MissionKey.objects.order_by('key').values_list('key', flat=True))
+        User.objects.all().delete()
+        Mission.objects.all().delete()
+        Grade.objects.all().delete()
+
+        synthetic.generate_school(grades=2, users=10, missions=5, seed=7)
+
+        self.assertEqual(list(User.objects.order_by('username').values_list('points', flat=True)),
+                         [points for _, points in first])
+        self.assertEqual(list(MissionKey.objects.order_by('key').values_list('key', flat=True)), keys)
+
+    def test_distributions_keep_their_mean(self):
+        rng = random.Random(3)
+        for distribution in synthetic.DISTRIBUTIONS:
+            values = [synthetic.draw(rng, distribution, 10) for _ in range(20000)]
+            self.assertAlmostEqual(sum(values) / len(values), 10, delta=0.6, msg=distribution)
+            self.assertGreaterEqual(min(values), 0)
+
+        with self.assertRaises(ValueError):
+            synthetic.draw(rng, 'zipf', 10)
+
+    def test_usernames_continue_after_existing_students(self):
+        User.objects.create_user('student4')
+        User.objects.create_user('student12b')
+        synthetic.generate_school(grades=1, users=3, missions=1, seed=2)
+
+        self.assertEqual(sorted(User.objects.filter(last_name__in=['5', '6', '7']).values_list(
+            'username', flat=True)), ['student5', 'student6', 'student7'])
+
+    def test_command_refuses_without_debug(self):
+        with self.assertRaisesMessage(CommandError, 'pass --force'):
+            call_command('generate_school', users=1, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+        call_command('generate_school', grades=1, users=2, missions=1, force=True, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 2)
+
+
+class BenchmarkHarnessTests(TemporaryAvatarStorageMixin, TestCase):
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertEqual(benchmarks.percentile([5], 95), 5)
+        self.assertIsNone(benchmarks.percentile([], 50))
+
+    def test_summarize(self):
+        result = benchmarks.summarize([0.01, 0.02, 0.03, 0.04], 1, 0.5)
+        self.assertEqual(result, {'requests': 4, 'errors': 1, 'p50_ms': 20.0, 'p95_ms': 40.0, 'p99_ms': 40.0,
+                                  'mean_ms': 25.0, 'throughput_rps': 8.0})
+
+    def test_runs_every_scenario(self):
+        cache.clear()
+        synthetic.generate_school(grades=2, users=30, missions=10, completions=2, open_fraction=1, seed=5)
+        harness = benchmarks.Harness(requests=5, burst_size=10, burst_concurrency=1, seed=5)
+
+        results = harness.run()
+
+        self.assertEqual(set(results), set(benchmarks.SCENARIOS))
+        for name, result in results.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(result['p50_ms'], 0, name)
+        self.assertEqual(results['burst']['requests'], 10)
+        self.assertEqual(CompletedMission.objects.filter(mission__title='Assembly').count(), 10)
+        self.assertEqual(CompletedMission.objects.filter(mission__title='Assembly on school Wi-Fi').count(), 10)
+        # The worker's share is done too, so the ledger has every claim
+        self.assertEqual(results['burst']['tasks'], 10)
+        self.assertFalse(BackgroundTask.objects.filter(status=BackgroundTask.PENDING).exists())
+        self.assertEqual(LedgerEntry.objects.count(), CompletedMission.objects.count())
+        self.assertEqual(User.objects.filter(username__startswith='bench').count(), 5)
+
+    def test_compare(self):
+        baseline = {'scenarios': {'claim': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': None, 'throughput_rps': 50.0}}}
+        results = {'scenarios': {'claim': {'p50_ms': 15.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'throughput_rps': 40.0}},
+                   'dashboard': {}}
+
+        self.assertEqual(list(benchmarks.compare(baseline, results)), [
+            ('claim', 'p50_ms', 10.0, 15.0, 0.5),
+            ('claim', 'p95_ms', 20.0, 20.0, 0.0),
+            ('claim', 'throughput_rps', 50.0, 40.0, -0.2),
+        ])
+
+
+@override_settings(TASKS_EAGER=True)
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.grade = Grade.objects.create(name='Grade 9')
+        self.other = Grade.objects.create(name='Grade 10')
+        self.staff = User.objects.create_user('staff', password='password', is_staff=True)
+        self.alice = User.objects.create_user('alice', password='password', grade=self.grade)
+        self.bob = User.objects.create_user('bob', password='password', grade=self.grade)
+        self.carol = User.objects.create_user('carol', password='password', grade=self.other)
+        self.old = Mission.objects.create(title='Old', description='d', location='Gym', value=30, xp_points=100,
+                                          start_time=self.now - timedelta(days=20),
+                                          end_time=self.now + timedelta(days=1))
+        self.new = Mission.objects.create(title='New', description='d', location='Gym', value=10, xp_points=10,
+                                          start_time=self.now - timedelta(days=1),
+                                          end_time=self.now + timedelta(days=1))
+        self.claim(self.alice, self.old, self.now - timedelta(days=10))
+        self.claim(self.bob, self.old, self.now - timedelta(days=10))
+        self.claim(self.carol, self.new, self.now)
+        self.client.force_login(self.staff)
+
+    def claim(self, user, mission, when):
+        claim(user, MissionKey.objects.create(mission=mission).key)
+        CompletedMission.objects.filter(user=user, mission=mission).update(completed_at=when)
+        LedgerEntry.objects.filter(user=user, mission=mission).update(created_at=when)
+
+    def export(self, kind, fmt='csv', **params):
+        response = self.client.get(reverse('spiritdashboard:export', args=[kind, fmt]), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        if fmt == 'json':
+            return json.loads(content)
+        return list(csv.DictReader(StringIO(content)))
+
+    def test_staff_only(self):
+        self.client.force_login(self.alice)
+        url = reverse('spiritdashboard:export', args=['users', 'csv'])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 403)
+
+    def test_unknown_export(self):
+        url = reverse('spiritdashboard:export', args=['passwords', 'csv'])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 404)
+        url = reverse('spiritdashboard:export', args=['users', 'xml'])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 404)
+
+    def test_invalid_filter(self):
+        url = reverse('spiritdashboard:export', args=['users', 'csv'])
+        response = self.client.get(url, {'start': '2019-05-02', 'end': '2019-05-01'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url, {'grade': 'x'}, secure=True).status_code, 400)
+
+    def test_users_ranked_in_stream(self):
+        rows = self.export('users')
+        self.assertEqual([(row['username'], row['rank'], row['points']) for row in rows], [
+            ('alice', '1', '30'), ('bob', '1', '30'), ('carol', '3', '10'), ('staff', '4', '0')])
+        self.assertEqual(rows[0]['level'], str(User.level_for_xp(100)))
+        self.assertEqual(rows[0]['grade'], 'Grade 9')
+        self.assertEqual(rows[3]['grade'], '')
+
+    def test_users_by_grade_and_range(self):
+        rows = self.export('users', 'json', grade=self.grade.pk)
+        self.assertEqual([row['username'] for row in rows], ['alice', 'bob'])
+        self.assertEqual(rows[0]['total_xp'], 100)
+
+        today = timezone.localdate(self.now)
+        rows = self.export('users', 'json', start=today.isoformat(), end=today.isoformat())
+        self.assertEqual([(row['username'], row['rank'], row['points']) for row in rows], [
+            ('carol', 1, 10), ('staff', 2, 0), ('alice', 2, 0), ('bob', 2, 0)])
+
+    def test_grades(self):
+        rows = self.export('grades')
+        self.assertEqual([(row['name'], row['rank'], row['points'], row['members']) for row in rows], [
+            ('Grade 9', '1', '60', '2'), ('Grade 10', '2', '10', '1')])
+
+        start = timezone.localdate(self.now - timedelta(days=1))
+        rows = self.export('grades', 'json', start=start.isoformat())
+        self.assertEqual([(row['name'], row['points'], row['members']) for row in rows], [
+            ('Grade 10', 10, 1), ('Grade 9', 0, 2)])
+
+    def test_history(self):
+        rows = self.export('history')
+        self.assertEqual([(row['username'], row['mission']) for row in rows], [
+            ('alice', 'Old'), ('bob', 'Old'), ('carol', 'New')])
+
+        rows = self.export('history', 'json', grade=self.other.pk)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['username'], rows[0]['points'], rows[0]['xp_points']), ('carol', 10, 10))
+
+        end = timezone.localdate(self.now - timedelta(days=5))
+        self.assertEqual(len(self.export('history', end=end.isoformat())), 2)
+
+    def test_history_follows_the_credited_grade(self):
+        # Carol's claim stays with the grade that got its points
+        self.carol.grade = self.grade
+        self.carol.save()
+
+        rows = self.export('history', 'json', grade=self.other.pk)
+        self.assertEqual([(row['username'], row['grade']) for row in rows], [('carol', 'Grade 10')])
+        self.assertEqual([row['username'] for row in self.export('history', 'json', grade=self.grade.pk)],
+                         ['alice', 'bob'])
+
+    def test_empty_json(self):
+        CompletedMission.objects.all().delete()
+        self.assertEqual(self.export('history', 'json'), [])
+
+
+class QueryBudgetTests(TemporaryAvatarStorageMixin, TestCase):
+    """
+    Renders every URL in spiritdashboard/urls.py against a seeded school and
+    fails when a view goes over its query or time budget. Set the
+    QUERY_BUDGET_REPORT environment variable to a file path to get the SQL
+    each view executed.
+    """
+
+    GRADES = 6
+    USERS = 3000
+    MISSIONS = 300
+    COMPLETIONS_PER_USER = 10
+
+    # URL name (or route, for unnamed patterns): (max queries, max seconds)
+    BUDGETS = {
+        'dashboard': (3, 1.0),
+        'index': (3, 1.0),
+        'dashboard/': (3, 1.0),
+        'register': (1, 1.0),
+        'login': (1, 1.0),
+        'logout': (4, 1.0),
+        'claim_key': (10, 1.0),
+        'claim_key_post': (10, 1.0),
+        'claim_batch': (18, 1.0),
+        'user_leaderboard': (3, 1.0),
+        'grade_leaderboard': (3, 1.0),
+        'avatar': (0, 2.0),
+        'metrics': (2, 1.0),
+        'export': (4, 2.0),
+        'completed': (2, 1.0),
+        'privacy_policy': (2, 1.0),
+    }
+
+    reports = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(2019)
+        now = timezone.now()
+
+        Grade.objects.bulk_create(
+            Grade(name='Grade {}'.format(7 + i), points=rng.randrange(10000)) for i in range(cls.GRADES))
+        grades = list(Grade.objects.all())
+
+        User.objects.bulk_create(
+            User(username='student{}'.format(i), password='!', first_name='Student', last_name=str(i),
+                 points=rng.randrange(2000), total_xp=rng.randrange(500), grade=rng.choice(grades))
+            for i in range(cls.USERS))
+
+        Mission.objects.bulk_create(
+            Mission(title='Mission {}'.format(i), description='Do the thing.', location='Gym',
+                    value=rng.randrange(10, 100), start_time=now - timedelta(days=rng.randrange(1, 30)),
+                    end_time=now + timedelta(days=rng.randrange(-10, 30)))
+            for i in range(cls.MISSIONS))
+        missions = list(Mission.objects.filter(end_time__gte=now))
+
+        user_ids = list(User.objects.values_list('id', flat=True))
+        CompletedMission.objects.bulk_create(
+            CompletedMission(user_id=user_id, mission=mission)
+            for user_id in user_ids
+            for mission in rng.sample(missions, cls.COMPLETIONS_PER_USER))
+        summary.rebuild_completed_ids()
+
+        cls.user = User.objects.get(username='student0')
+        cls.mission = missions[-1]
+        CompletedMission.objects.filter(user=cls.user, mission=cls.mission).delete()
+
+    @classmethod
+    def tearDownClass(cls):
+        path = os.environ.get('QUERY_BUDGET_REPORT')
+        if path and cls.reports:
+            with open(path, 'w') as f:
+                for name, (count, elapsed, queries) in sorted(cls.reports.items()):
+                    f.write('{} - {} queries in {:.3f}s\n'.format(name, count, elapsed))
+                    for sql in queries:
+                        f.write('    {}\n'.format(sql))
+                    f.write('\n')
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertWithinBudget(self, name, url, method='get', data=None, status=200, **extra):
+        max_queries, max_seconds = self.BUDGETS[name]
+
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(url, data, secure=True, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+
+        queries = [query['sql'] for query in context.captured_queries]
+        self.reports[name] = (len(queries), elapsed, queries)
+
+        self.assertEqual(response.status_code, status)
+        self.assertLessEqual(len(queries), max_queries, '{} went over its query budget:\n{}'.format(
+            name, '\n'.join(queries)))
+        self.assertLessEqual(elapsed, max_seconds, '{} went over its time budget'.format(name))
+
+    def test_every_url_has_a_budget(self):
+        for pattern in urls.urlpatterns:
+            self.assertIn(pattern.name or str(pattern.pattern), self.BUDGETS)
+
+    def test_dashboard(self):
+        # The first hit renders the avatar; the budget is for a warm worker
+        self.client.get(reverse('spiritdashboard:dashboard'), secure=True)
+        self.assertWithinBudget('dashboard', reverse('spiritdashboard:dashboard'))
+        self.assertWithinBudget('index', reverse('spiritdashboard:index'))
+        self.assertWithinBudget('dashboard/', '/dashboard/')
+
+    def test_register(self):
+        self.client.logout()
+        self.assertWithinBudget('register', reverse('spiritdashboard:register'))
+
+    def test_login(self):
+        self.client.logout()
+        self.assertWithinBudget('login', reverse('spiritdashboard:login'))
+
+    def test_logout(self):
+        self.assertWithinBudget('logout', reverse('spiritdashboard:logout'), status=302)
+
+    # Measured as deployed: the ledger is queued for the worker
+    @override_settings(TASKS_EAGER=False)
+    def test_claim_key(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        key_index.might_contain(mission_key.key)
+        self.assertWithinBudget('claim_key', reverse('spiritdashboard:claim_key', args=[mission_key.key]))
+
+    # Measured as deployed: the ledger is queued for the worker
+    @override_settings(TASKS_EAGER=False)
+    def test_claim_key_post(self):
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        key_index.might_contain(mission_key.key)
+        self.assertWithinBudget('claim_key_post', reverse('spiritdashboard:claim_key_post'),
+                                method='post', data={'key': mission_key.key})
+
+    def test_claim_batch(self):
+        self.user.is_staff = True
+        self.user.save()
+        mission_key = MissionKey.objects.create(mission=self.mission)
+        items = [{'id': str(user.pk), 'user': user.username, 'key': mission_key.key,
+                  'scanned_at': timezone.now().isoformat()} for user in User.objects.all()[:500]]
+        self.assertWithinBudget('claim_batch', reverse('spiritdashboard:claim_batch'), method='post',
+                                data=json.dumps({'station': 'gym', 'claims': items}),
+                                content_type='application/json')
+
+    def test_user_leaderboard(self):
+        self.assertWithinBudget('user_leaderboard', reverse('spiritdashboard:user_leaderboard'))
+
+    def test_grade_leaderboard(self):
+        self.assertWithinBudget('grade_leaderboard', reverse('spiritdashboard:grade_leaderboard'))
+
+    def test_export(self):
+        self.user.is_staff = True
+        self.user.save()
+        for kind in ('users', 'grades'):
+            self.assertWithinBudget('export', reverse('spiritdashboard:export', args=[kind, 'csv']))
+        # One grade's claims: the whole seeded history (30k rows) measures the
+        # machine more than the view
+        self.assertWithinBudget('export', reverse('spiritdashboard:export', args=['history', 'csv']),
+                                data={'grade': self.user.grade_id})
+
+    def test_avatar(self):
+        self.assertWithinBudget('avatar', avatar_cache.url(self.user.username))
+
+    def test_metrics(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertWithinBudget('metrics', reverse('spiritdashboard:metrics'))
+
+    def test_completed(self):
+        self.assertWithinBudget('completed', reverse('spiritdashboard:completed'))
+
+    def test_privacy_policy(self):
+        self.assertWithinBudget('privacy_policy', reverse('spiritdashboard:privacy_policy'))
@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Scope: (requests allowed, window in seconds). A whole assembly can claim
+# from behind the school's one NAT address, so addresses are only limited
+# on claims that failed, i.e. guessed or mistyped keys.
+CLAIM_THROTTLE_RATES = getattr(settings, 'CLAIM_THROTTLE_RATES', {
+    'user': (20, 60),
+    'failed_ip': (300, 60),
+})
+
+
+def is_throttled(scope, ident, rates=None, now=None):
+    """
+    Counts one attempt for ``ident`` and reports whether it is over the
+    ``scope`` rate.
+
+    Uses a sliding-window counter: the previous fixed window's count is
+    weighted by how much of it still overlaps the sliding window, so two
+    cache entries per client are enough.
+    """
+    limit, rate = _rate(scope, ident, rates, now, count=True)
+    return rate > limit
+
+
+def is_blocked(scope, ident, rates=None, now=None):
+    # Whether the next counted attempt would be throttled, without counting one
+    limit, rate = _rate(scope, ident, rates, now, count=False)
+    return rate + 1 > limit
+
+
+def _rate(scope, ident, rates, now, count):
+    limit, window = (rates or CLAIM_THROTTLE_RATES)[scope]
+    now = time.time() if now is None else now
+    current = int(now // window)
+    elapsed = (now % window) / window
+
+    key = 'throttle:{}:{}:{}'.format(scope, ident, current)
+    if count:
+        cache.add(key, 0, window * 2)
+        try:
+            attempts = cache.incr(key)
+        except ValueError:
+            # Expired between add and incr
+            cache.set(key, 1, window * 2)
+            attempts = 1
+    else:
+        attempts = cache.get(key, 0)
+
+    previous = cache.get('throttle:{}:{}:{}'.format(scope, ident, current - 1), 0)
+    return limit, previous * (1 - elapsed) + attempts
+
+
+def client_ip(request):
+    # Heroku's router appends the address it saw to X-Forwarded-For, so the
+    # last entry is the only one a client can't forge
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded:
+        return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
@@ -12,8 +12,12 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('claim/<str:key>/', views.claim_key, name='claim_key'),
     path('claim/', views.claim_key, name='claim_key_post'),
+    path('api/claims/', views.claim_batch, name='claim_batch'),
     path('user_leaderboard/', views.UserLeaderboard.as_view(), name='user_leaderboard'),
     path('grade_leaderboard/', views.GradeLeaderboard.as_view(), name='grade_leaderboard'),
+    path('avatar/<str:username>/<str:digest>.png', views.avatar, name='avatar'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('exports/<str:kind>.<str:fmt>', views.export, name='export'),
     path('completed/', views.completed, name='completed'),
     path('privacy/', views.privacy_policy, name='privacy_policy')
 ]
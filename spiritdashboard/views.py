@@ -1,22 +1,26 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse,
+                         StreamingHttpResponse)
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login
 
 from .models import Mission, CompletedMission, MissionKey, User, Grade
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_POST
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView
-import pagan
-from .forms import SignUpForm
-
-from django.core.files.storage import default_storage
-
-from projectspirit.settings import MEDIA_DIR, MEDIA_URL
-
-import base64
-from io import BytesIO
+from .avatars import avatar_cache
+from .claims import ClaimError, claim
+from .forms import ExportFilterForm, SignUpForm
+from . import claims, exports, ledger, live, metrics, pages, ranking
+from .leaderboards import LEADERBOARD_SIZE, grade_leaderboard, user_leaderboard
+from .summary import dashboard_summary
+from .throttling import client_ip, is_blocked, is_throttled
 
 import datetime
+import json
+from abc import ABCMeta, abstractmethod
 
 
 def index(request):
@@ -46,79 +50,185 @@ def register(request):
 @login_required
 def dashboard(request):
 
-    # Generate avatar base64
-    avatar = pagan.Avatar(request.user.username, pagan.SHA512)
-    buffered = BytesIO()
-    avatar.img.save(buffered, format='PNG')
-    avatar_base64 = base64.b64encode(buffered.getvalue()).decode('ascii')
-
+    summary = dashboard_summary(request.user)
     context = {
-        'missions': Mission.objects.filter(end_time__gte=timezone.now()).exclude(completedmission__user=request.user).order_by('start_time'),
-        'completed_missions': Mission.objects.filter(completedmission__user=request.user),
-        'grade': request.user.grade,
-        'avatar_base64': avatar_base64
+        'missions': summary.missions,
+        'completed_missions': summary.completed_missions,
+        'grade': summary.grade,
+        'user_rank': summary.user_rank,
+        'grade_rank': summary.grade_rank,
+        'progress': summary.progress,
+        'avatar_url': avatar_cache.url(request.user.username),
+        'fragments': pages.dashboard_fragments(request.user, summary),
     }
     return render(request, 'spiritdashboard/dashboard.html', context=context)
 
 
+def avatar(request, username, digest):
+    # The digest makes the URL content-addressed, so browsers may keep it forever
+    if not constant_time_compare(digest, avatar_cache.digest(username)):
+        raise Http404
+    response = HttpResponse(avatar_cache.get(username), content_type='image/png')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 @login_required
 def claim_key(request, key=None):
 
     if key is None and request.method == 'POST' and 'key' in request.POST.keys():
         key = request.POST['key']
 
-    # Validates key string
-    if len(key) == 10 and len(MissionKey.objects.filter(key=key)) > 0:
-        mission_key = MissionKey.objects.filter(key=key)[0]
-        mission = mission_key.mission
-
-        # Checks if mission is not expired or in the future, and that it has not been completed before
-        if not mission.is_future() and not mission.is_expired() and not CompletedMission.objects.filter(mission=mission, user=request.user):
-
-            if mission_key.one_use and mission_key.times_used > 0:
-                return HttpResponseBadRequest(reason='Key provided has already been used.')
-
-            # Creates CompletedMission object and saves it to database
-            completed_mission = CompletedMission(
-                mission=mission, user=request.user)
-            completed_mission.save()
-
-            # Adds points for the user
-            request.user.points += mission.value
-
-            # Adds XP points for the user
-            request.user.total_xp += mission.xp_points
-
-            # Adds points for the user's grade (if it exists)
-            if request.user.grade is not None:
-                request.user.grade.points += mission.value
-
-            request.user.save()
-            request.user.grade.save()
-
-            # Increases times_used of key
-            mission_key.times_used += 1
-            mission_key.save()
-
-            return render(request, 'spiritdashboard/completed.html', context={'mission': mission})
-    
-    return HttpResponseBadRequest(reason='Invalid key, or you have already completed the mission.')
+    ip = client_ip(request)
+    if is_throttled('user', request.user.pk) or is_blocked('failed_ip', ip):
+        return HttpResponse('Too many attempts. Please wait a minute and try again.', status=429)
+
+    try:
+        mission = claim(request.user, key)
+    except ClaimError as error:
+        is_throttled('failed_ip', ip)
+        return HttpResponseBadRequest(reason=str(error))
+
+    return render(request, 'spiritdashboard/completed.html', context={'mission': mission})
+
+
+@require_POST
+def claim_batch(request):
+    # Scanning stations sign in with a staff account and send their queue here
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only.'}, status=403)
+
+    try:
+        payload = json.loads(request.body.decode('utf-8'))
+        station, items = payload.get('station'), payload['claims']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Expected a JSON object with a "station" id and a "claims" list.'},
+                            status=400)
+    # Stations number their scans themselves, so ids only mean something per station
+    if claims.station_id(station) is None:
+        return JsonResponse({'error': 'Send the "station" id, a string of at most 64 characters.'}, status=400)
+    if not isinstance(items, list) or len(items) > claims.BATCH_LIMIT:
+        return JsonResponse({'error': 'Send a list of at most {} claims.'.format(claims.BATCH_LIMIT)}, status=400)
+
+    return JsonResponse({'results': claims.claim_batch(claims.station_id(station), items)})
+
+
+def metrics_view(request):
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return HttpResponseForbidden('Staff only.')
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def export(request, kind, fmt):
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return HttpResponseForbidden('Staff only.')
+    if kind not in exports.EXPORTS or fmt not in exports.FORMATS:
+        raise Http404
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_json(), content_type='application/json')
+
+    since, until = exports.day_bounds(form.cleaned_data['start'], form.cleaned_data['end'])
+    rows = exports.EXPORTS[kind](form.cleaned_data['grade'], since, until)
+    if fmt == 'csv':
+        response = StreamingHttpResponse(exports.stream_csv(rows), content_type='text/csv')
+    else:
+        response = StreamingHttpResponse(exports.stream_json(rows), content_type='application/json')
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, fmt)
+    return response
 
 
+@pages.cached_page()
 def completed(request):
     return render(request, 'spiritdashboard/completed.html')
 
 
-class UserLeaderboard(ListView):
+def uncacheable(request):
+    # Around-me pages are built around the visitor's own row, and period
+    # standings come from rollups the task worker writes after the claim
+    # has already bumped the page versions
+    return 'around' in request.GET or 'period' in request.GET
+
+
+class LeaderboardView(ListView, metaclass=ABCMeta):
+    leaderboard = None
+    page_size = LEADERBOARD_SIZE
+    around_size = 5
+
+    def get_queryset(self):
+        self.mode = 'top'
+        queryset = self.leaderboard.queryset()
+
+        period = self.request.GET.get('period')
+        if period in ledger.PERIODS:
+            self.mode = period
+            return self.get_standings(period)
+
+        if 'around' in self.request.GET:
+            me = self.get_own_entry()
+            if me is not None:
+                self.mode = 'around'
+                return ranking.around(queryset, me, self.around_size)
+
+        after = ranking.parse_cursor(self.request.GET.get('after'))
+        if after is None:
+            rows = self.leaderboard.entries()
+            last = (rows[-1]['points'], rows[-1]['id']) if rows else None
+        else:
+            self.mode = 'page'
+            rows = ranking.seek(queryset, after, self.page_size)
+            last = (rows[-1].points, rows[-1].pk) if rows else None
+
+        self.next_cursor = None
+        if last is not None and len(rows) >= self.page_size:
+            self.next_cursor = ranking.format_cursor(*last)
+        return rows
+
+    @abstractmethod
+    def get_own_entry(self):
+        """The visitor's own row for around-me pages, or None."""
+
+    @abstractmethod
+    def get_standings(self, period):
+        """Standings over the ledger ``period`` (day or week)."""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['mode'] = self.mode
+        context['next_cursor'] = getattr(self, 'next_cursor', None)
+        context['live_url'] = live.live_url(self.leaderboard.name) if self.mode == 'top' else None
+        return context
+
+
+@method_decorator(pages.cached_page(pages.USERS, pages.GRADES, pages.COMPLETIONS, skip=uncacheable),
+                  name='dispatch')
+class UserLeaderboard(LeaderboardView):
     model = User
     template_name = 'spiritdashboard/leaderboards/user.html'
-    queryset = User.objects.order_by('-points')[:10]
+    leaderboard = user_leaderboard
 
+    def get_own_entry(self):
+        if self.request.user.is_authenticated:
+            return self.request.user
 
-class GradeLeaderboard(ListView):
+    def get_standings(self, period):
+        return ledger.user_standings(period, size=self.page_size)
+
+
+@method_decorator(pages.cached_page(pages.GRADES, pages.COMPLETIONS, skip=uncacheable), name='dispatch')
+class GradeLeaderboard(LeaderboardView):
     model = Grade
     template_name = 'spiritdashboard/leaderboards/grade.html'
-    queryset = Grade.objects.order_by('-points')[:10]
+    leaderboard = grade_leaderboard
+
+    def get_own_entry(self):
+        if self.request.user.is_authenticated:
+            return self.request.user.grade
+
+    def get_standings(self, period):
+        return ledger.grade_standings(period, size=self.page_size)
+
 
+@pages.cached_page()
 def privacy_policy(request):
     return render(request, 'spiritdashboard/privacy_policy.html')
\ No newline at end of file